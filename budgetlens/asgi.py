@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'budgetlens.settings')
+# Async upload and save views; WSGI keeps the sync ones (budgetlens.urls)
+os.environ.setdefault('ROOT_URLCONF', 'budgetlens.asgi_urls')
 
 application = get_asgi_application()
@@ -0,0 +1,17 @@
+"""
+URL configuration for the ASGI entry point (budgetlens/asgi.py).
+
+Same routes as budgetlens.urls, but receipt upload and expense saving use the
+async views: under ASGI their HTTP clients live as long as the server's event
+loop. Under WSGI every async view would get a fresh loop and fresh clients,
+so budgetlens.urls keeps the sync views.
+"""
+from django.urls import path
+from core import views
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('core/upload/', views.aupload_receipt, name='upload'),
+    path('core/save_expense/<int:expense_id>/', views.asave_expense, name='save_expense'),
+    *wsgi_urlpatterns,
+]
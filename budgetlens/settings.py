@@ -23,6 +23,70 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Receipt images live in the default storage: the local filesystem, or an
+# S3-compatible bucket with MEDIA_STORAGE=s3 (django-storages + boto3; point
+# AWS_S3_ENDPOINT_URL at MinIO or another local stand-in for testing)
+MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'filesystem')
+# Cold storage for recompressed originals older than RECEIPT_ARCHIVE_AFTER_DAYS
+RECEIPT_ARCHIVE_ROOT = os.getenv('RECEIPT_ARCHIVE_ROOT', os.path.join(BASE_DIR, 'media_archive'))
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'archive': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': RECEIPT_ARCHIVE_ROOT, 'base_url': None},
+    },
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+if MEDIA_STORAGE == 's3':
+    S3_OPTIONS = {
+        'endpoint_url': os.getenv('AWS_S3_ENDPOINT_URL') or None,
+        'region_name': os.getenv('AWS_S3_REGION_NAME') or None,
+        'querystring_expire': int(os.getenv('AWS_QUERYSTRING_EXPIRE', '3600')),
+        'file_overwrite': False,
+    }
+    STORAGES['default'] = {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            **S3_OPTIONS,
+            'bucket_name': os.getenv('AWS_STORAGE_BUCKET_NAME', 'receipts'),
+            'object_parameters': {'CacheControl': 'private, max-age=31536000, immutable'},
+        },
+    }
+    STORAGES['archive'] = {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            **S3_OPTIONS,
+            'bucket_name': os.getenv('AWS_ARCHIVE_BUCKET_NAME', 'receipts-archive'),
+            # Infrequent-access tier that still serves reads immediately
+            'object_parameters': {
+                'StorageClass': os.getenv('AWS_ARCHIVE_STORAGE_CLASS', 'GLACIER_IR'),
+            },
+        },
+    }
+
+# WebP previews generated for every receipt: name -> longest edge in pixels
+RECEIPT_PREVIEW_SIZES = {
+    'thumb': int(os.getenv('RECEIPT_THUMB_EDGE', '240')),
+    'preview': int(os.getenv('RECEIPT_PREVIEW_EDGE', '1000')),
+}
+RECEIPT_PREVIEW_QUALITY = int(os.getenv('RECEIPT_PREVIEW_QUALITY', '75'))
+# How receipt files are handed to the client from filesystem storage:
+# '' streams through Django, 'x-accel' delegates to nginx (internal location at
+# MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT), 'x-sendfile' to Apache/lighttpd
+MEDIA_OFFLOAD = os.getenv('MEDIA_OFFLOAD', '')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Browser cache lifetime for receipt files and for redirects to signed S3 URLs
+MEDIA_CACHE_MAX_AGE = int(os.getenv('MEDIA_CACHE_MAX_AGE', str(365 * 24 * 3600)))
+MEDIA_REDIRECT_MAX_AGE = int(os.getenv('MEDIA_REDIRECT_MAX_AGE', '1800'))
+
+# Receipt retention (manage.py compact_receipts): originals older than this are
+# recompressed and moved to the archive storage; orphaned files younger than
+# the grace period are kept, as an upload may not have committed its row yet
+RECEIPT_ARCHIVE_AFTER_DAYS = int(os.getenv('RECEIPT_ARCHIVE_AFTER_DAYS', '365'))
+RECEIPT_ARCHIVE_MAX_EDGE = int(os.getenv('RECEIPT_ARCHIVE_MAX_EDGE', '2000'))
+RECEIPT_ARCHIVE_QUALITY = int(os.getenv('RECEIPT_ARCHIVE_QUALITY', '60'))
+RECEIPT_ORPHAN_GRACE_HOURS = int(os.getenv('RECEIPT_ORPHAN_GRACE_HOURS', '24'))
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -36,6 +100,13 @@ ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '').split(',')
 
 # Application definition
 
+# Application logs go out at INFO (LOG_LEVEL=DEBUG for local debugging: it
+# includes raw model responses). Per-request structured records (core.requests)
+# are sampled: errors and slow requests always, the rest at REQUEST_LOG_SAMPLE_RATE
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv('REQUEST_LOG_SAMPLE_RATE', '1.0' if DEBUG else '0.05'))
+REQUEST_LOG_SLOW_MS = float(os.getenv('REQUEST_LOG_SLOW_MS', '1000'))
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -43,6 +114,11 @@ LOGGING = {
         "console": {
             "level": "DEBUG",
             "class": "logging.StreamHandler",
+            "formatter": "verbose",
+        },
+        "requests": {
+            "class": "logging.StreamHandler",
+            "formatter": "message",
         },
     },
     "loggers": {
@@ -50,11 +126,16 @@ LOGGING = {
             "handlers": ["console"],
             "level": "INFO",
         },
-        "core.views": {
+        "core": {
             "handlers": ["console"],
-            "level": "DEBUG",
+            "level": LOG_LEVEL,
+            "propagate": False,
+        },
+        # One JSON line per request: view, status, timing and hot-path spans
+        "core.requests": {
+            "handlers": ["requests"],
+            "level": "INFO",
             "propagate": False,
-            "formatter": "verbose",
         },
     },
     "formatters": {
@@ -66,9 +147,36 @@ LOGGING = {
             "format": "{levelname} {message}",
             "style": "{",
         },
+        "message": {
+            "format": "{message}",
+            "style": "{",
+        },
     },
 }
 
+# Prometheus scrape endpoint (/metrics): open to these addresses, or to any
+# client sending "Authorization: Bearer <METRICS_TOKEN>" when a token is set.
+# Empty by default: behind a proxy on the same host (e.g. nginx for
+# MEDIA_OFFLOAD='x-accel') every request comes from 127.0.0.1, so loopback
+# addresses must only be listed when nothing proxies to Django locally
+METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip]
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Each web worker process keeps its own counters and a scrape reaches a random
+# one. With several workers (gunicorn/uwsgi), point METRICS_DIR at a directory
+# shared by them and emptied on every deploy: workers write their counters
+# there at most every METRICS_FLUSH_INTERVAL seconds and /metrics sums them.
+# Without it, run a single worker process, or the counters will jump back
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+# SQL query accounting per request (core.querybudget): views declare a budget
+# with @query_budget(n); going over it, repeating an identical query or running
+# one query shape QUERY_BUDGET_REPEAT_THRESHOLD+ times (N+1) logs a warning.
+# QUERY_BUDGET_STRICT turns an exceeded budget into an error (tests, CI)
+QUERY_BUDGET_ENABLED = os.getenv('QUERY_BUDGET_ENABLED', str(DEBUG)) == 'True'
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'
+QUERY_BUDGET_REPEAT_THRESHOLD = int(os.getenv('QUERY_BUDGET_REPEAT_THRESHOLD', '5'))
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -81,6 +189,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.RequestMetricsMiddleware',
+    'core.querybudget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,7 +200,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'budgetlens.urls'
+# budgetlens/asgi.py switches to budgetlens.asgi_urls (async upload and save views)
+ROOT_URLCONF = os.getenv('ROOT_URLCONF', 'budgetlens.urls')
 
 TEMPLATES = [
     {
@@ -124,6 +235,17 @@ DATABASES = {
     }
 }
 
+# Cache
+# File-based by default so that invalidation from the background worker
+# (manage.py process_receipts) reaches the web processes on the same host
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, '.cache')),
+    }
+}
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', str(24 * 60 * 60)))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -168,3 +290,93 @@ LOGOUT_REDIRECT_URL = 'home'
 LOGIN_URL = '/core/login/'
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+
+# Background receipt processing (python manage.py process_receipts)
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+JOB_RETRY_BASE_DELAY = float(os.getenv('JOB_RETRY_BASE_DELAY', '5'))
+JOB_RETRY_MAX_DELAY = float(os.getenv('JOB_RETRY_MAX_DELAY', '600'))
+JOB_LOCK_TIMEOUT = int(os.getenv('JOB_LOCK_TIMEOUT', '300'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1'))
+# Max concurrent jobs per external provider within one worker process
+PROVIDER_CONCURRENCY = {
+    'openai': int(os.getenv('OPENAI_CONCURRENCY', '4')),
+    # Recomputing a user's expenses after a target currency change
+    'rates': int(os.getenv('EXCHANGE_RATES_CONCURRENCY', '1')),
+}
+# Same limits for the asyncio worker (process_receipts --async): in-flight
+# requests there cost a socket, not a thread, so they can be much higher
+ASYNC_PROVIDER_CONCURRENCY = {
+    'openai': int(os.getenv('OPENAI_ASYNC_CONCURRENCY', '200')),
+    'rates': int(os.getenv('EXCHANGE_RATES_CONCURRENCY', '1')),
+}
+
+# Exchange rate tables: in-process LRU size and refresh interval for today's table
+EXCHANGE_RATES_CACHE_SIZE = int(os.getenv('EXCHANGE_RATES_CACHE_SIZE', '1024'))
+EXCHANGE_RATES_TODAY_TTL = int(os.getenv('EXCHANGE_RATES_TODAY_TTL', '3600'))
+OPEN_EXCHANGE_RATES_API_URL = os.getenv(
+    'OPEN_EXCHANGE_RATES_API_URL', 'https://openexchangerates.org/api/historical/'
+)
+# Rates provider client (core.providers): keep-alive pool size, connect/read
+# timeouts, retries with jittered backoff and the circuit breaker
+EXCHANGE_RATES_MAX_CONNECTIONS = int(os.getenv('EXCHANGE_RATES_MAX_CONNECTIONS', '20'))
+EXCHANGE_RATES_CONNECT_TIMEOUT = float(os.getenv('EXCHANGE_RATES_CONNECT_TIMEOUT', '3.05'))
+EXCHANGE_RATES_READ_TIMEOUT = float(os.getenv('EXCHANGE_RATES_READ_TIMEOUT', '5'))
+EXCHANGE_RATES_RETRIES = int(os.getenv('EXCHANGE_RATES_RETRIES', '2'))
+EXCHANGE_RATES_RETRY_BACKOFF = float(os.getenv('EXCHANGE_RATES_RETRY_BACKOFF', '0.5'))
+EXCHANGE_RATES_CIRCUIT_FAILURES = int(os.getenv('EXCHANGE_RATES_CIRCUIT_FAILURES', '5'))
+EXCHANGE_RATES_CIRCUIT_RESET = float(os.getenv('EXCHANGE_RATES_CIRCUIT_RESET', '60'))
+# When the provider is unavailable, use stored rates from up to this many days away
+EXCHANGE_RATES_FALLBACK_DAYS = int(os.getenv('EXCHANGE_RATES_FALLBACK_DAYS', '7'))
+
+# Batch receipt upload limits
+RECEIPT_BATCH_MAX_FILES = int(os.getenv('RECEIPT_BATCH_MAX_FILES', '200'))
+RECEIPT_BATCH_MAX_FILE_SIZE = int(os.getenv('RECEIPT_BATCH_MAX_FILE_SIZE', str(20 * 1024 * 1024)))
+
+# Receipt image preprocessing before recognition (originals stay in media/cheques/)
+RECEIPT_IMAGE_MAX_EDGE = int(os.getenv('RECEIPT_IMAGE_MAX_EDGE', '1600'))
+RECEIPT_IMAGE_FORMAT = os.getenv('RECEIPT_IMAGE_FORMAT', 'JPEG')  # JPEG or WEBP
+RECEIPT_IMAGE_QUALITY = int(os.getenv('RECEIPT_IMAGE_QUALITY', '80'))
+RECEIPT_IMAGE_GRAYSCALE = os.getenv('RECEIPT_IMAGE_GRAYSCALE', 'True') == 'True'
+
+# Receipt recognition backend: 'auto' tries the fiscal QR code, then local OCR
+# (pytesseract + tesseract binary), and escalates to OpenAI below the threshold;
+# 'openai' or 'tesseract' force a single backend
+RECEIPT_RECOGNIZER = os.getenv('RECEIPT_RECOGNIZER', 'auto')
+RECEIPT_LOCAL_MIN_CONFIDENCE = float(os.getenv('RECEIPT_LOCAL_MIN_CONFIDENCE', '0.85'))
+RECEIPT_OCR_LANG = os.getenv('RECEIPT_OCR_LANG', 'rus+eng')
+RECEIPT_OCR_MIN_EDGE = int(os.getenv('RECEIPT_OCR_MIN_EDGE', '1500'))
+# Fiscal QR codes (pyzbar or opencv-python) give date and total locally; with
+# RECEIPT_QR_DETAILS the model is still asked, briefly, for the place name
+RECEIPT_QR_DETAILS = os.getenv('RECEIPT_QR_DETAILS', 'True') == 'True'
+
+# Local place -> category classifier (core.classifier): minimum confidence to
+# use its prediction and how often each process picks up new corrections
+CATEGORY_MIN_CONFIDENCE = float(os.getenv('CATEGORY_MIN_CONFIDENCE', '0.6'))
+CATEGORY_CLASSIFIER_REFRESH = float(os.getenv('CATEGORY_CLASSIFIER_REFRESH', '30'))
+
+# Near-duplicate receipts: max differing bits of the 256-bit perceptual hash
+# and how many of the user's latest receipts are compared. A similar receipt is
+# only flagged as a possible duplicate; its recognized data is never reused
+RECEIPT_NEAR_DUPLICATE_DISTANCE = int(os.getenv('RECEIPT_NEAR_DUPLICATE_DISTANCE', '16'))
+RECEIPT_NEAR_DUPLICATE_WINDOW = int(os.getenv('RECEIPT_NEAR_DUPLICATE_WINDOW', '500'))
+
+# Expenses per page in the dashboard list (cursor pagination)
+EXPENSES_PAGE_SIZE = int(os.getenv('EXPENSES_PAGE_SIZE', '50'))
+# Rows fetched per database round trip while streaming an export
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+# Bank statement import: rows per bulk_create batch and max upload size
+STATEMENT_IMPORT_BATCH_SIZE = int(os.getenv('STATEMENT_IMPORT_BATCH_SIZE', '1000'))
+STATEMENT_MAX_FILE_SIZE = int(os.getenv('STATEMENT_MAX_FILE_SIZE', str(20 * 1024 * 1024)))
+
+# JSON API (/api/v1/): default and max expenses per list page, max objects per
+# bulk create/patch/delete request and brotli quality (0-11) when the optional
+# brotli package is installed
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', '200'))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', '1000'))
+API_MAX_BULK_SIZE = int(os.getenv('API_MAX_BULK_SIZE', '1000'))
+API_BROTLI_QUALITY = int(os.getenv('API_BROTLI_QUALITY', '5'))
+# Delta sync (/api/v1/sync/): how far a finished sync steps back to catch rows
+# from transactions that committed late, and how long deletion tombstones are
+# kept (older sync cursors get 410 and must resync from scratch)
+SYNC_OVERLAP_SECONDS = int(os.getenv('SYNC_OVERLAP_SECONDS', '5'))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv('SYNC_TOMBSTONE_RETENTION_DAYS', '90'))
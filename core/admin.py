@@ -1,5 +1,27 @@
 from django.contrib import admin
-from .models import Expense, UserProfile
+from .jobs import requeue_failed
+from .models import (
+    Expense, ExchangeRate, PlaceCategory, ProcessingJob, RecognizedReceipt, UserProfile,
+)
 
 admin.site.register(Expense)
 admin.site.register(UserProfile)
+admin.site.register(ExchangeRate)
+admin.site.register(RecognizedReceipt)
+admin.site.register(PlaceCategory)
+
+
+@admin.register(ProcessingJob)
+class ProcessingJobAdmin(admin.ModelAdmin):
+    """Админка очереди фоновых заданий с повторным запуском упавших"""
+    list_display = (
+        "id", "kind", "expense", "provider", "status", "attempts", "run_after",
+        "original_bytes", "payload_bytes", "recognition_ms", "recognizer", "confidence",
+    )
+    list_filter = ("status", "kind", "provider", "recognizer")
+    actions = ["requeue"]
+
+    @admin.action(description="Повторить обработку")
+    def requeue(self, request, queryset):
+        """Возвращает выбранные упавшие задания в очередь"""
+        self.message_user(request, f"Возвращено в очередь: {requeue_failed(queryset)}")
@@ -0,0 +1,508 @@
+"""Версионированный JSON API расходов (/api/v1/) для мобильного клиента.
+
+Список отдаётся курсорными страницами (core.pagination) до API_MAX_PAGE_SIZE
+расходов, поэтому месяц истории помещается в один запрос; sync отдаёт только
+изменения после курсора прошлой синхронизации (core.sync). Создание, изменение
+и удаление принимают пачку до API_MAX_BULK_SIZE расходов и пересчитывают
+сводку, классификатор и кэш дашборда один раз на пачку. Параметр fields
+оставляет в ответе только нужные поля; ответы на GET несут ETag по версии
+данных пользователя (304 при совпадении) и сжимаются gzip или brotli.
+"""
+
+from collections import Counter
+from functools import wraps
+import hashlib
+import json
+import logging
+import re
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.middleware.gzip import GZipMiddleware
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import decorator_from_middleware
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
+from .caching import dashboard_stamp, invalidate_dashboard
+from .dedup import forget_results
+from .forms import ApiAggregateForm, ApiExpenseForm, ApiExpenseListForm, ApiSyncForm
+from .models import Expense, MonthlySummary, PlaceCategory, UserProfile, deferred_delete_updates
+from .pagination import InvalidCursor, paginate_expenses
+from .querybudget import query_budget
+from .rates import convert_with_table, get_rates_table
+from .sync import InvalidSyncCursor, SyncCursorExpired, changes_since
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него ответы сжимаются только gzip
+    brotli = None
+
+
+log = logging.getLogger(__name__)
+
+API_VERSION = "v1"
+# Поля расхода, которые клиент задаёт сам (ApiExpenseForm)
+EDITABLE_FIELDS = ("place", "category", "expense_date", "amount", "currency")
+# Поля, при изменении которых сумма пересчитывается в целевую валюту
+CONVERSION_INPUTS = ("expense_date", "amount", "currency")
+
+
+def _decimal(value):
+    return str(value) if value is not None else None
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+# Поле ответа: (столбцы модели, значение для расхода)
+EXPENSE_FIELDS = {
+    "id": (("id",), lambda expense: expense.id),
+    "place": (("place",), lambda expense: expense.place),
+    "category": (("category",), lambda expense: expense.category),
+    "expense_date": (("expense_date",), lambda expense: _isoformat(expense.expense_date)),
+    "amount": (("amount",), lambda expense: _decimal(expense.amount)),
+    "currency": (("currency",), lambda expense: expense.currency),
+    "amount_in_target_currency": (
+        ("amount_in_target_currency",),
+        lambda expense: _decimal(expense.amount_in_target_currency),
+    ),
+    "converted_currency": (
+        ("converted_currency",),
+        lambda expense: expense.converted_currency or None,
+    ),
+    "status": (("status",), lambda expense: expense.status),
+    "source": (("source",), lambda expense: expense.source),
+    "receipt_url": (
+        ("receipt_image",),
+        lambda expense: (
+            reverse("receipt_image", args=[expense.id, "original"]) if expense.receipt_image else None
+        ),
+    ),
+    "created_at": (("created_at",), lambda expense: _isoformat(expense.created_at)),
+    "updated_at": (("updated_at",), lambda expense: _isoformat(expense.updated_at)),
+}
+
+
+class ApiError(ValueError):
+    """Некорректный запрос к API: ответ 400 с ошибками в JSON"""
+
+    def __init__(self, errors, status=400):
+        super().__init__(errors)
+        self.errors = errors
+        self.status = status
+
+
+def _errors(errors, status=400):
+    return JsonResponse({"errors": errors}, status=status)
+
+
+class _CsrfCheck(CsrfViewMiddleware):
+    """Проверка CSRF, которая возвращает причину отказа вместо HTML-страницы 403"""
+
+    def _reject(self, request, reason):
+        return reason
+
+
+def _csrf_failure(request):
+    """Причина отказа проверки CSRF или None"""
+    check = _CsrfCheck(lambda request: None)
+    check.process_request(request)
+    return check.process_view(request, None, (), {})
+
+
+def api_view(view):
+    """Вход обязателен (401 без перенаправления на страницу входа), ApiError — ответ с ошибками.
+
+    CSRF проверяется здесь, а не в CsrfViewMiddleware: отказ приходит тем же
+    JSON с ошибками, что и остальные ответы API, а не HTML-страницей.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _errors({"auth": ["Требуется вход"]}, status=401)
+        reason = _csrf_failure(request)
+        if reason:
+            return _errors({"csrf": [f"Проверка CSRF не пройдена: {reason}"]}, status=403)
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as e:
+            return _errors(e.errors, e.status)
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+def _is_id(value):
+    """id расхода из JSON: целое число, но не true/false (bool в Python — подкласс int)"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """GZipMiddleware, который отдаёт brotli клиентам с br в Accept-Encoding"""
+
+    def process_response(self, request, response):
+        accepts_brotli = re.search(r"\bbr\b", request.headers.get("Accept-Encoding", ""))
+        if (
+            brotli is None
+            or not accepts_brotli
+            or response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < 200
+        ):
+            return super().process_response(request, response)
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed = brotli.compress(response.content, quality=settings.API_BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        # Как в GZipMiddleware: у сжатого ответа ETag слабый
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = "br"
+        return response
+
+
+compress_response = decorator_from_middleware(CompressionMiddleware)
+
+
+def data_etag(request, *args, **kwargs):
+    """ETag ответа: версия API, пользователь, версия его данных и адрес запроса"""
+    if not request.user.is_authenticated:
+        return None
+    stamp = dashboard_stamp(request.user.pk)
+    raw = f"{API_VERSION}:{request.user.pk}:{stamp}:{request.get_full_path()}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def _requested_fields(request):
+    """Поля ответа из параметра fields (через запятую); без него — все"""
+    value = request.GET.get("fields")
+    if not value:
+        return list(EXPENSE_FIELDS)
+    fields = list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in EXPENSE_FIELDS]
+    if unknown:
+        raise ApiError({"fields": [f"Неизвестные поля: {', '.join(unknown)}"]})
+    return fields
+
+
+def _columns(fields):
+    """Столбцы модели, нужные для полей ответа и курсора страницы"""
+    return {"id", "expense_date", *(column for name in fields for column in EXPENSE_FIELDS[name][0])}
+
+
+def serialize(expense, fields):
+    """Расход как словарь только с запрошенными полями"""
+    return {name: EXPENSE_FIELDS[name][1](expense) for name in fields}
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body)
+    except ValueError as e:
+        raise ApiError({"body": ["Тело запроса должно быть JSON"]}) from e
+
+
+def _bulk_items(request, key):
+    """Непустой список из тела {key: [...]} не длиннее API_MAX_BULK_SIZE"""
+    body = _json_body(request)
+    items = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ApiError({key: ["Ожидается непустой список"]})
+    if len(items) > settings.API_MAX_BULK_SIZE:
+        raise ApiError({key: [f"Не больше {settings.API_MAX_BULK_SIZE} элементов за запрос"]})
+    return items
+
+
+def _form_data(expense):
+    """Текущие значения редактируемых полей расхода для ApiExpenseForm"""
+    return {name: getattr(expense, name) for name in EDITABLE_FIELDS}
+
+
+def _validate(items, expenses):
+    """Проверяет данные пачки; ApiError с ошибками по номерам элементов"""
+    errors = {}
+    for index, (item, expense) in enumerate(zip(items, expenses)):
+        unknown = [name for name in item if name not in EDITABLE_FIELDS and name != "id"]
+        form = ApiExpenseForm({**_form_data(expense), **item}, instance=expense)
+        if unknown:
+            errors[str(index)] = {name: ["Поле нельзя изменить"] for name in unknown}
+        elif not form.is_valid():
+            errors[str(index)] = form.errors
+    if errors:
+        raise ApiError(errors)
+
+
+def _convert(expenses, target_currency):
+    """Пересчитывает суммы в целевую валюту; таблица курсов берётся один раз на дату"""
+    tables = {}
+    for expense in expenses:
+        converted = None
+        if expense.amount is not None and expense.expense_date and expense.currency:
+            if expense.currency == target_currency:
+                table = None
+            elif expense.expense_date in tables:
+                table = tables[expense.expense_date]
+            else:
+                table = tables[expense.expense_date] = get_rates_table(expense.expense_date)
+            converted = convert_with_table(expense.amount, table, expense.currency, target_currency)
+        expense.amount_in_target_currency = converted
+        expense.converted_currency = target_currency if converted is not None else ""
+
+
+def _refresh_derived(user_id, buckets, pairs):
+    """Сводка, классификатор и кэш дашборда после пакетного изменения без сигналов"""
+    for bucket in buckets:
+        MonthlySummary.refresh(*bucket)
+    for (pair_user_id, place_key, category), delta in pairs.items():
+        if delta:
+            PlaceCategory.record(pair_user_id, place_key, category, delta)
+    transaction.on_commit(lambda: invalidate_dashboard(user_id))
+
+
+def create_expenses(user, items):
+    """Создаёт расходы пачкой через bulk_create"""
+    if not all(isinstance(item, dict) for item in items):
+        raise ApiError({"expenses": ["Каждый элемент должен быть объектом"]})
+    expenses = [Expense(user=user, source=Expense.SOURCE_MANUAL) for _ in items]
+    _validate(items, expenses)
+    _convert(expenses, UserProfile.currency_of(user.pk))
+    with transaction.atomic():
+        Expense.objects.bulk_create(expenses)
+        # bulk_create не отправляет сигналы: сводка, классификатор и кэш обновляются явно
+        _refresh_derived(
+            user.pk,
+            {MonthlySummary.bucket_of(expense) for expense in expenses},
+            Counter(filter(None, map(PlaceCategory.pair_of, expenses))),
+        )
+    return expenses
+
+
+def update_expenses(user, items):
+    """Изменяет расходы пачкой: каждый элемент — id и новые значения полей"""
+    if not all(isinstance(item, dict) for item in items):
+        raise ApiError({"expenses": ["Каждый элемент должен быть объектом"]})
+    ids = [item.get("id") for item in items]
+    invalid = {
+        str(index): {"id": ["Ожидается целый id"]}
+        for index, expense_id in enumerate(ids)
+        if not _is_id(expense_id)
+    }
+    if invalid:
+        raise ApiError(invalid)
+    if len(set(ids)) != len(ids):
+        raise ApiError({"expenses": ["Каждый расход можно указать только один раз"]})
+    found = Expense.objects.filter(user=user).in_bulk(ids)
+    missing = {
+        str(index): {"id": ["Расход не найден"]}
+        for index, expense_id in enumerate(ids)
+        if expense_id not in found
+    }
+    if missing:
+        raise ApiError(missing, status=404)
+    expenses = [found[expense_id] for expense_id in ids]
+    before = {
+        expense.id: {name: getattr(expense, name) for name in EDITABLE_FIELDS} for expense in expenses
+    }
+    _validate(items, expenses)
+    edited = [
+        expense for expense in expenses
+        if any(before[expense.id][name] != getattr(expense, name) for name in EDITABLE_FIELDS)
+    ]
+
+    target_currency = UserProfile.currency_of(user.pk)
+    _convert(
+        [
+            expense for expense in expenses
+            if any(before[expense.id][name] != getattr(expense, name) for name in CONVERSION_INPUTS)
+            or expense.converted_currency != target_currency
+        ],
+        target_currency,
+    )
+    buckets, pairs = set(), Counter()
+    now = timezone.now()
+    for expense in expenses:
+        # Исходные группа сводки и пара классификатора запомнены в Expense.from_db
+        buckets |= {expense._summary_bucket, MonthlySummary.bucket_of(expense)}
+        previous, pair = expense._category_pair, PlaceCategory.pair_of(expense)
+        if previous != pair:
+            if previous:
+                pairs[previous] -= 1
+            if pair:
+                pairs[pair] += 1
+        expense.updated_at = now
+    with transaction.atomic():
+        Expense.objects.bulk_update(
+            expenses,
+            [*EDITABLE_FIELDS, "amount_in_target_currency", "converted_currency", "updated_at"],
+        )
+        _refresh_derived(user.pk, buckets, pairs)
+        # Исправленный чек при повторной загрузке распознаётся заново, а не берётся из кэша
+        forget_results(user.pk, edited)
+    return expenses
+
+
+def delete_expenses(user, ids):
+    """Удаляет расходы пользователя; сводка и классификатор пересчитываются один раз"""
+    with transaction.atomic(), deferred_delete_updates():
+        _, deleted = Expense.objects.filter(user=user, id__in=ids).delete()
+    return deleted.get(Expense._meta.label, 0)
+
+
+def _list(request):
+    form = ApiExpenseListForm(request.GET)
+    if not form.is_valid():
+        raise ApiError(form.errors)
+    fields = _requested_fields(request)
+    try:
+        expenses, next_cursor = paginate_expenses(
+            form.filter(Expense.objects.filter(user=request.user)).only(*_columns(fields)),
+            cursor=form.cleaned_data["cursor"],
+            limit=form.cleaned_data["limit"],
+        )
+    except InvalidCursor as e:
+        raise ApiError({"cursor": ["Некорректный курсор"]}) from e
+    return JsonResponse(
+        {"results": [serialize(expense, fields) for expense in expenses], "next": next_cursor}
+    )
+
+
+@require_http_methods(["GET", "HEAD", "POST", "PATCH", "DELETE"])
+@api_view
+@compress_response
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_etag)
+@query_budget(3, methods=("GET", "HEAD"))
+def expenses(request):
+    """Список расходов (GET), создание (POST), изменение (PATCH) и удаление (DELETE) пачкой.
+
+    POST и PATCH принимают {"expenses": [...]}, DELETE — {"ids": [...]}.
+    """
+    if request.method in ("GET", "HEAD"):
+        return _list(request)
+    if request.method == "DELETE":
+        ids = _bulk_items(request, "ids")
+        if not all(map(_is_id, ids)):
+            raise ApiError({"ids": ["Ожидается список целых id"]})
+        return JsonResponse({"deleted": delete_expenses(request.user, ids)})
+    fields = _requested_fields(request)
+    items = _bulk_items(request, "expenses")
+    if request.method == "POST":
+        created = create_expenses(request.user, items)
+        log.info("API: пользователь %s создал расходов: %s", request.user.pk, len(created))
+        return JsonResponse({"results": [serialize(expense, fields) for expense in created]}, status=201)
+    updated = update_expenses(request.user, items)
+    log.info("API: пользователь %s изменил расходов: %s", request.user.pk, len(updated))
+    return JsonResponse({"results": [serialize(expense, fields) for expense in updated]})
+
+
+@require_http_methods(["GET", "HEAD", "PATCH", "DELETE"])
+@api_view
+@compress_response
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_etag)
+@query_budget(3, methods=("GET", "HEAD"))
+def expense(request, expense_id):
+    """Один расход: чтение (GET), изменение (PATCH) и удаление (DELETE)"""
+    fields = _requested_fields(request)
+    if request.method == "DELETE":
+        if not delete_expenses(request.user, [expense_id]):
+            raise ApiError({"id": ["Расход не найден"]}, status=404)
+        return JsonResponse({"deleted": 1})
+    if request.method == "PATCH":
+        item = _json_body(request)
+        if not isinstance(item, dict):
+            raise ApiError({"body": ["Ожидается объект"]})
+        try:
+            [updated] = update_expenses(request.user, [{**item, "id": expense_id}])
+        except ApiError as e:
+            # Ошибки единственного элемента — без номера элемента
+            raise ApiError(e.errors.get("0", e.errors), e.status) from e
+        return JsonResponse(serialize(updated, fields))
+    found = (
+        Expense.objects.filter(user=request.user, id=expense_id).only(*_columns(fields)).first()
+    )
+    if found is None:
+        raise ApiError({"id": ["Расход не найден"]}, status=404)
+    return JsonResponse(serialize(found, fields))
+
+
+@require_http_methods(["GET", "HEAD"])
+@api_view
+@compress_response
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_etag)
+@query_budget(4)
+def aggregates(request):
+    """Итоги в целевой валюте по месяцам и категориям из помесячной сводки"""
+    form = ApiAggregateForm(request.GET)
+    if not form.is_valid():
+        raise ApiError(form.errors)
+    summaries = MonthlySummary.objects.filter(user=request.user)
+    if form.cleaned_data["month_from"]:
+        summaries = summaries.filter(month__gte=form.cleaned_data["month_from"])
+    if form.cleaned_data["month_to"]:
+        summaries = summaries.filter(month__lte=form.cleaned_data["month_to"]).exclude(month="")
+    if form.cleaned_data["category"]:
+        summaries = summaries.filter(category=form.cleaned_data["category"])
+    group_by = form.cleaned_data["group_by"]
+    rows = (
+        summaries.values(*group_by)
+        .annotate(total=Sum("total"), count=Sum("count"))
+        .order_by(*group_by)
+    )
+    return JsonResponse(
+        {
+            "currency": UserProfile.currency_of(request.user.pk),
+            "group_by": group_by,
+            "results": [
+                {
+                    **{group: row[group] or None for group in group_by},
+                    # SQLite отдаёт сумму без дробной части: формат как у сумм расходов
+                    "total": f"{row['total']:.2f}",
+                    "count": row["count"],
+                }
+                for row in rows
+            ],
+        }
+    )
+
+
+@require_http_methods(["GET", "HEAD"])
+@api_view
+@compress_response
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_etag)
+@query_budget(4)
+def sync(request):
+    """Изменённые расходы и id удалённых после курсора since, курсор следующего запроса.
+
+    Пока has_more, запрос повторяют с курсором next; без since отдаётся вся
+    история. 410 — курсор старше хранимых удалений, нужна синхронизация с начала.
+    """
+    form = ApiSyncForm(request.GET)
+    if not form.is_valid():
+        raise ApiError(form.errors)
+    fields = _requested_fields(request)
+    try:
+        changes = changes_since(
+            request.user, form.cleaned_data["since"], form.cleaned_data["limit"], _columns(fields)
+        )
+    except InvalidSyncCursor as e:
+        raise ApiError({"since": ["Некорректный курсор"]}) from e
+    except SyncCursorExpired as e:
+        raise ApiError({"since": ["Курсор устарел: синхронизируйте без since"]}, status=410) from e
+    return JsonResponse(
+        {
+            "changed": [serialize(expense, fields) for expense in changes["changed"]],
+            "deleted": changes["deleted"],
+            "next": changes["cursor"],
+            "has_more": changes["has_more"],
+        }
+    )
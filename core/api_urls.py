@@ -0,0 +1,9 @@
+from django.urls import path
+from . import api
+
+urlpatterns = [
+    path('expenses/', api.expenses, name='api_expenses'),
+    path('expenses/<int:expense_id>/', api.expense, name='api_expense'),
+    path('aggregates/', api.aggregates, name='api_aggregates'),
+    path('sync/', api.sync, name='api_sync'),
+]
@@ -0,0 +1,300 @@
+"""Воспроизводимый бенчмарк основных страниц на синтетических расходах.
+
+Данные генерируются из seed, поэтому прогоны на одном размере истории
+сравнимы между собой. Внешние провайдеры заменяются заглушкой core.stubs
+с заданной задержкой; запросы идут через WSGIHandler (потоки) и
+ASGIHandler (корутины) тестовых клиентов Django, под ASGI — с маршрутами
+budgetlens.asgi_urls, как у настоящего ASGI-процесса.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+from decimal import Decimal
+import io
+import logging
+import os
+import random
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve
+from PIL import Image
+from .caching import invalidate_dashboard
+from .models import Expense, MonthlySummary, PlaceCategory
+from .querybudget import QueryReport, budget_of
+from .rates import aclose_async_client as aclose_rates_client
+from .receipts import aclose_async_client as aclose_openai_client
+from .stubs import STUB_RATES
+
+
+log = logging.getLogger(__name__)
+
+# Размеры истории: короткое имя -> число расходов
+SIZES = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+ENDPOINTS = ("dashboard", "dashboard_cold", "upload_receipt", "expense", "save_expense")
+
+# Места и их категории для синтетических расходов
+PLACES = [
+    ("Пятёрочка", "Продукты"), ("Магнит", "Продукты"), ("ВкусВилл", "Продукты"),
+    ("Перекрёсток", "Продукты"), ("Аптека 36,6", "Здравоохранение"),
+    ("Ригла", "Здравоохранение"), ("Яндекс Go", "Транспорт"), ("Метро", "Транспорт"),
+    ("Шоколадница", "Питание вне дома"), ("Теремок", "Питание вне дома"),
+    ("Спортмастер", "Одежда"), ("Zara", "Одежда"), ("Кинотеатр Октябрь", "Развлечения"),
+    ("Мосэнергосбыт", "Коммунальные услуги"), ("Яндекс Плюс", "Подписки"),
+    ("Детский мир", "Товары для детей"), ("Четыре лапы", "Уход за животными"),
+    ("Ингосстрах", "Страхование"), ("Skyeng", "Образование"), ("Ларёк у дома", "Прочее"),
+]
+CURRENCIES = [("RUB", 0.9), ("USD", 0.05), ("EUR", 0.05)]
+
+
+def parse_size(value):
+    """Размер истории: 1k, 100k, 1M или число"""
+    if value in SIZES:
+        return SIZES[value]
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = value[-1:].lower()
+    if suffix in multipliers:
+        return int(float(value[:-1]) * multipliers[suffix])
+    return int(value)
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу; None для пустого списка"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else None
+
+
+def random_receipt(rng=None):
+    """Случайное изображение чека: у каждого свой хэш, дедупликация не срабатывает"""
+    data = rng.randbytes(240 * 320) if rng else os.urandom(240 * 320)
+    image = Image.frombytes("L", (240, 320), data)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=70)
+    return buffer.getvalue()
+
+
+def upload_file(index, content):
+    """Файл для поля receipt_image формы загрузки"""
+    upload = io.BytesIO(content)
+    upload.name = f"loadtest-{index}.jpg"
+    return upload
+
+
+def _synthetic_expenses(user, rows, rng):
+    """Расходы за последние три года: места, суммы и валюты с правдоподобным разбросом"""
+    today = datetime.date.today()
+    currencies, weights = zip(*CURRENCIES)
+    for _ in range(rows):
+        place, category = rng.choice(PLACES)
+        currency = rng.choices(currencies, weights)[0]
+        rate = Decimal(str(STUB_RATES[currency])) / Decimal(str(STUB_RATES["RUB"]))
+        # Сумма в рублях с медианой около 400 ₽, пересчитанная в валюту расхода
+        converted = Decimal(str(round(rng.lognormvariate(6, 1.2), 2)))
+        amount = round(converted * rate, 2)
+        yield Expense(
+            user=user,
+            source=Expense.SOURCE_STATEMENT,
+            status=Expense.STATUS_DONE,
+            expense_date=today - datetime.timedelta(days=rng.randrange(3 * 365)),
+            amount=amount,
+            currency=currency,
+            place=place,
+            category=category,
+            amount_in_target_currency=converted,
+            converted_currency="RUB",
+        )
+
+
+def seed_user(rows, seed=0, batch_size=5000, progress=None):
+    """Пользователь bench-<rows>-<seed> ровно с rows синтетическими расходами.
+
+    Уже засеянный пользователь с тем же числом расходов используется повторно,
+    поэтому большие истории создаются один раз. Сводка, классификатор и кэш
+    дашборда пересобираются явно: bulk_create не отправляет сигналы.
+    """
+    user, _ = User.objects.get_or_create(username=f"bench-{rows}-{seed}")
+    expenses = Expense.objects.filter(user=user)
+    if expenses.count() == rows:
+        return user
+    # Неполный прошлый посев: строки без файлов, сигналы при удалении не нужны
+    expenses._raw_delete(expenses.db)  # pylint: disable=protected-access
+    rng = random.Random(seed)
+    batch = []
+    created = 0
+    for expense in _synthetic_expenses(user, rows, rng):
+        batch.append(expense)
+        if len(batch) == batch_size:
+            Expense.objects.bulk_create(batch)
+            created += len(batch)
+            batch.clear()
+            if progress:
+                progress(created, rows)
+    Expense.objects.bulk_create(batch)
+    MonthlySummary.rebuild([user.pk])
+    PlaceCategory.rebuild([user.pk])
+    invalidate_dashboard(user.pk)
+    return user
+
+
+class Workload:
+    """Запросы к страницам для засеянного пользователя: путь, данные и подготовка"""
+
+    def __init__(self, user, seed=0, sample_size=500):
+        self.user = user
+        self.rng = random.Random(seed)
+        expenses = Expense.objects.filter(user=user)
+        ids = list(expenses.values_list("id", flat=True))
+        self.last_seeded_id = max(ids)
+        sample = self.rng.sample(ids, min(sample_size, len(ids)))
+        # save_expense отправляет текущие значения расхода: прогон не меняет данные
+        self.forms = {
+            item["id"]: {
+                "place": item["place"],
+                "category": item["category"],
+                "expense_date": item["expense_date"].isoformat(),
+                "amount": str(item["amount"]),
+                "currency": item["currency"],
+            }
+            for item in expenses.filter(id__in=sample).values(
+                "id", "place", "category", "expense_date", "amount", "currency"
+            )
+        }
+        self.ids = sorted(self.forms)
+        self.receipts = []
+
+    def prepare(self, endpoint, count):
+        """Данные для count запросов; изображения для загрузки генерируются заранее"""
+        if endpoint == "upload_receipt":
+            self.receipts = [random_receipt(self.rng) for _ in range(count)]
+
+    def request(self, endpoint, index):
+        """(метод, путь, данные формы) index-го запроса к странице"""
+        expense_id = self.ids[index % len(self.ids)]
+        if endpoint in ("dashboard", "dashboard_cold"):
+            if endpoint == "dashboard_cold":
+                invalidate_dashboard(self.user.pk)
+            return "get", "/core/dashboard/", None
+        if endpoint == "upload_receipt":
+            receipt = self.receipts[index % len(self.receipts)]
+            return "post", "/core/upload/", {"receipt_image": upload_file(index, receipt)}
+        if endpoint == "expense":
+            return "get", f"/core/expense/{expense_id}/", None
+        if endpoint == "save_expense":
+            return "post", f"/core/save_expense/{expense_id}/", self.forms[expense_id]
+        raise ValueError(endpoint)
+
+    def cleanup(self):
+        """Удаляет расходы, созданные загрузками (с файлами, через сигналы)"""
+        for expense in Expense.objects.filter(user=self.user, id__gt=self.last_seeded_id):
+            expense.delete()
+
+
+def summarize(latencies, statuses, seconds):
+    """p50/p95/p99 и среднее в мс, пропускная способность и число ошибок"""
+    return {
+        "requests": len(latencies),
+        "errors": sum(1 for status in statuses if status >= 400),
+        "requests_per_second": round(len(latencies) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1),
+    }
+
+
+def count_queries(workload, endpoint, samples=5):
+    """SQL-запросов на запрос к странице и бюджет вьюшки: последовательно, после прогрева.
+
+    Считается отдельно от замера времени: при параллельных клиентах запросы
+    к БД разных потоков не разделить, а их число от параллельности не зависит.
+    """
+    client = Client()
+    client.force_login(workload.user)
+    workload.prepare(endpoint, samples + 1)
+    counts = []
+    for index in range(samples + 1):
+        method, path, data = workload.request(endpoint, index)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(path, data)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        if index:
+            # Считаются так же, как бюджет вьюшки: без BEGIN/SAVEPOINT и с запросами тела ответа
+            counts.append(QueryReport((query["sql"], None, 0) for query in queries).count)
+    return {
+        "mean": round(statistics.fmean(counts), 1),
+        "max": max(counts),
+        "budget": budget_of(resolve(path).func),
+    }
+
+
+def run_wsgi(workload, endpoint, count, concurrency):
+    """count запросов через WSGIHandler из concurrency потоков"""
+    workload.prepare(endpoint, count)
+    clients = []
+    for _ in range(concurrency):
+        client = Client()
+        client.force_login(workload.user)
+        clients.append(client)
+
+    def send(index):
+        method, path, data = workload.request(endpoint, index)
+        started = time.perf_counter()
+        response = getattr(clients[index % concurrency], method)(path, data)
+        return response.status_code, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(send, range(count)))
+    seconds = time.perf_counter() - started
+    return summarize([latency for _, latency in responses], [status for status, _ in responses], seconds)
+
+
+async def run_asgi(workload, endpoint, count, concurrency):
+    """count запросов через ASGIHandler из concurrency корутин одного loop"""
+    workload.prepare(endpoint, count)
+    indexes = iter(range(count))
+    responses = []
+
+    async def client_loop():
+        client = AsyncClient()
+        await client.aforce_login(workload.user)
+        for index in indexes:
+            method, path, data = workload.request(endpoint, index)
+            started = time.perf_counter()
+            response = await getattr(client, method)(path, data)
+            responses.append((response.status_code, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    finally:
+        # Клиенты провайдеров живут до конца loop: закрываем их вместе с ним
+        await aclose_openai_client()
+        await aclose_rates_client()
+    seconds = time.perf_counter() - started
+    return summarize([latency for _, latency in responses], [status for status, _ in responses], seconds)
+
+
+def run_benchmark(user, endpoints, servers, requests, concurrency, seed=0):
+    """Результаты по страницам: число SQL-запросов и задержки под каждым сервером"""
+    workload = Workload(user, seed)
+    results = {}
+    try:
+        for endpoint in endpoints:
+            results[endpoint] = {"queries": count_queries(workload, endpoint)}
+            if "wsgi" in servers:
+                results[endpoint]["wsgi"] = run_wsgi(workload, endpoint, requests, concurrency)
+            if "asgi" in servers:
+                with override_settings(ROOT_URLCONF="budgetlens.asgi_urls"):
+                    results[endpoint]["asgi"] = asyncio.run(
+                        run_asgi(workload, endpoint, requests, concurrency)
+                    )
+            log.info("Бенчмарк %s: %s", endpoint, results[endpoint])
+    finally:
+        workload.cleanup()
+    return results
@@ -0,0 +1,49 @@
+"""Кэш статистики на дашборде и её версия для условных запросов"""
+
+import datetime
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .metrics import cache_result
+
+
+def _stamp_key(user_id):
+    return f"dashboard:stamp:{user_id}"
+
+
+def dashboard_stamp(user_id):
+    """Момент последнего изменения данных пользователя (unix time)"""
+    return cache.get_or_set(_stamp_key(user_id), time.time(), timeout=None)
+
+
+def invalidate_dashboard(user_id):
+    """Сбрасывает кэш статистики пользователя, сдвигая её версию"""
+    cache.set(_stamp_key(user_id), time.time(), timeout=None)
+
+
+def get_dashboard_context(user_id, compute):
+    """Статистика пользователя из кэша; при промахе считается через compute()"""
+    key = f"dashboard:context:{user_id}:{dashboard_stamp(user_id)}"
+    context = cache.get(key)
+    cache_result("dashboard", context is not None)
+    if context is None:
+        context = compute()
+        cache.set(key, context, timeout=settings.DASHBOARD_CACHE_TIMEOUT)
+    return context
+
+
+def dashboard_etag(request, *args, **kwargs):
+    """ETag дашборда: пользователь, версия данных и CSRF-секрет из страницы"""
+    if not request.user.is_authenticated:
+        return None
+    csrf_secret = request.META.get("CSRF_COOKIE", "")
+    raw = f"{request.user.pk}:{dashboard_stamp(request.user.pk)}:{csrf_secret}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def dashboard_last_modified(request, *args, **kwargs):
+    """Last-Modified дашборда по версии данных пользователя"""
+    if not request.user.is_authenticated:
+        return None
+    return datetime.datetime.fromtimestamp(dashboard_stamp(request.user.pk), tz=datetime.timezone.utc)
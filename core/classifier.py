@@ -0,0 +1,179 @@
+"""Локальный классификатор категорий по названию места, обучаемый на расходах"""
+
+from collections import Counter, defaultdict
+import datetime
+import math
+import threading
+import time
+from django.conf import settings
+from django.utils import timezone
+from .models import PlaceCategory
+
+
+# Начальные знания для холодного старта: типичные слова в названиях мест
+SEED_PLACES = {
+    "Продукты": [
+        "магнит", "пятерочка", "перекресток", "лента", "ашан", "дикси", "вкусвилл",
+        "spar", "окей", "метро кэш энд керри", "супермаркет", "гипермаркет", "продукты",
+    ],
+    "Питание вне дома": [
+        "кафе", "ресторан", "кофейня", "кофе", "бар", "пиццерия", "столовая", "суши",
+        "вкусно и точка", "бургер кинг", "kfc", "шоколадница", "cafe", "coffee", "restaurant",
+    ],
+    "Здравоохранение": [
+        "аптека", "горздрав", "ригла", "клиника", "стоматология", "медицинский центр",
+        "лаборатория", "инвитро", "pharmacy",
+    ],
+    "Транспорт": [
+        "такси", "яндекс такси", "метрополитен", "азс", "лукойл", "газпромнефть",
+        "роснефть", "ржд", "аэрофлот", "парковка", "автобус",
+    ],
+    "Одежда": ["спортмастер", "глория джинс", "одежда", "обувь", "zara", "ostin"],
+    "Развлечения": ["кинотеатр", "кино", "театр", "музей", "боулинг", "квест"],
+    "Товары для детей": ["детский мир", "игрушки", "дочки сыночки"],
+    "Уход за животными": ["зоомагазин", "четыре лапы", "бетховен", "ветклиника", "зоотовары"],
+    "Образование": ["читай город", "книги", "буквоед", "школа", "курсы"],
+    "Коммунальные услуги": ["жкх", "энергосбыт", "водоканал", "мосэнергосбыт", "ростелеком"],
+    "Подписки": ["яндекс плюс", "spotify", "netflix", "подписка"],
+}
+
+# Перечитываем изменения счётчиков с запасом: запись могла закоммититься позже отметки
+SYNC_OVERLAP = datetime.timedelta(seconds=60)
+
+
+def place_features(place_key):
+    """Признаки названия места: слова и символьные триграммы слов"""
+    features = []
+    for word in place_key.split():
+        features.append(f"w:{word}")
+        padded = f"^{word}$"
+        features.extend(f"t:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return features
+
+
+class CategoryClassifier:
+    """Наивный байесовский классификатор по n-граммам с переопределениями пользователей.
+
+    Точное совпадение места у пользователя (его исправления) важнее общего
+    совпадения места у всех пользователей, а оно важнее модели по n-граммам.
+    Счётчики живут в памяти процесса и догружаются из PlaceCategory по updated_at.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.user_places = defaultdict(Counter)
+        self.places = defaultdict(Counter)
+        self.features = defaultdict(Counter)
+        self.feature_totals = Counter()
+        self.category_totals = Counter()
+        self.vocabulary = set()
+        self.predictions = {}
+        self.synced_at = None
+        self.checked_at = None
+        for category, places in SEED_PLACES.items():
+            for place in places:
+                self._learn(None, PlaceCategory.key_of(place), category, 1)
+
+    def _learn(self, user_id, place_key, category, delta):
+        if user_id is not None:
+            self.user_places[(user_id, place_key)][category] += delta
+        self.places[place_key][category] += delta
+        self.category_totals[category] += delta
+        for feature in place_features(place_key):
+            self.features[category][feature] += delta
+            self.feature_totals[category] += delta
+            self.vocabulary.add(feature)
+        self.predictions.clear()
+
+    def learn(self, user_id, place_key, category, count):
+        """Устанавливает счётчик пары (пользователь, место, категория)"""
+        with self.lock:
+            delta = count - self.rows.get((user_id, place_key, category), 0)
+            if delta:
+                self.rows[(user_id, place_key, category)] = count
+                self._learn(user_id, place_key, category, delta)
+
+    def sync(self):
+        """Догружает изменённые с прошлой синхронизации счётчики из БД"""
+        started = timezone.now()
+        counters = PlaceCategory.objects.all()
+        if self.synced_at is not None:
+            counters = counters.filter(updated_at__gte=self.synced_at - SYNC_OVERLAP)
+        for row in counters.values_list("user_id", "place_key", "category", "count").iterator():
+            self.learn(*row)
+        self.synced_at = started
+        self.checked_at = time.monotonic()
+
+    def is_stale(self):
+        """Пора догрузить изменения (раз в CATEGORY_CLASSIFIER_REFRESH секунд)"""
+        return (
+            self.checked_at is None
+            or time.monotonic() - self.checked_at > settings.CATEGORY_CLASSIFIER_REFRESH
+        )
+
+    @staticmethod
+    def _majority(categories):
+        total = sum(categories.values())
+        if total <= 0:
+            return None
+        category, count = categories.most_common(1)[0]
+        return category, count / total
+
+    def _naive_bayes(self, place_key):
+        features = place_features(place_key)
+        documents = sum(self.category_totals.values())
+        vocabulary = len(self.vocabulary) or 1
+        scores = {}
+        for category, category_count in self.category_totals.items():
+            if category_count <= 0:
+                continue
+            counts = self.features[category]
+            denominator = self.feature_totals[category] + vocabulary
+            scores[category] = math.log(category_count / documents) + sum(
+                math.log((counts[feature] + 1) / denominator) for feature in features
+            )
+        if not scores:
+            return None
+        best = max(scores, key=scores.get)
+        # Нормировка в вероятность (softmax по логарифмам правдоподобия)
+        norm = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / norm
+
+    def predict(self, user_id, place_key):
+        """(категория, уверенность 0..1) для места или (None, 0)"""
+        if not place_key:
+            return None, 0.0
+        with self.lock:
+            own = self._majority(self.user_places.get((user_id, place_key), Counter()))
+            if own:
+                return own
+            shared = self._majority(self.places.get(place_key, Counter()))
+            if shared:
+                return shared
+            if place_key not in self.predictions:
+                self.predictions[place_key] = self._naive_bayes(place_key) or (None, 0.0)
+            return self.predictions[place_key]
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier():
+    """Классификатор процесса; при первом обращении обучается на PlaceCategory"""
+    global _classifier  # pylint: disable=global-statement
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = CategoryClassifier()
+        if _classifier.is_stale():
+            _classifier.sync()
+    return _classifier
+
+
+def predict_category(user_id, place):
+    """Категория места, если классификатор уверен (CATEGORY_MIN_CONFIDENCE), иначе None"""
+    category, confidence = get_classifier().predict(user_id, PlaceCategory.key_of(place))
+    if category and confidence >= settings.CATEGORY_MIN_CONFIDENCE:
+        return category
+    return None
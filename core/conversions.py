@@ -0,0 +1,108 @@
+"""Пакетный пересчёт сумм расходов в целевую валюту"""
+
+from itertools import groupby
+import time
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+from .caching import invalidate_dashboard
+from .models import Expense, MonthlySummary
+from .rates import convert_with_table, get_rates_table
+
+
+CONVERSION_FIELDS = ("amount_in_target_currency", "converted_currency", "updated_at")
+
+
+def needs_conversion(expenses):
+    """Расходы с суммой, датой и валютой, не пересчитанные в валюту профиля владельца.
+
+    Целевая валюта доступна у каждого расхода как target_currency.
+    """
+    target = Coalesce(NullIf(F("user__userprofile__target_currency"), Value("")), Value("RUB"))
+    return (
+        expenses.exclude(amount=None)
+        .exclude(expense_date=None)
+        .exclude(currency=None)
+        .exclude(currency="")
+        .annotate(target_currency=target)
+        .filter(Q(amount_in_target_currency=None) | ~Q(converted_currency=F("target_currency")))
+    )
+
+
+def _convert_chunk(chunk):
+    """Пересчитывает порцию расходов; таблица курсов берётся один раз на дату.
+
+    Возвращает пересчитанные расходы и те, у которых курса нет: их прежняя
+    сумма в другой валюте сбрасывается, чтобы не попасть в итоги в смеси
+    валют, а сам расход остаётся в needs_conversion для следующего прогона.
+    """
+    converted, failed = [], []
+    for date, group in groupby(sorted(chunk, key=lambda e: e.expense_date), key=lambda e: e.expense_date):
+        group = list(group)
+        # Таблица нужна, только если в этот день есть расходы не в целевой валюте
+        table = None
+        if any(expense.currency != expense.target_currency for expense in group):
+            table = get_rates_table(date)
+        for expense in group:
+            amount = convert_with_table(
+                expense.amount, table, expense.currency, expense.target_currency
+            )
+            if amount is not None:
+                expense.amount_in_target_currency = amount
+                expense.converted_currency = expense.target_currency
+                converted.append(expense)
+            else:
+                failed.append(expense)
+    return converted, failed
+
+
+def convert_in_chunks(expenses, chunk_size=1000, after_id=0):
+    """Пересчитывает расходы порциями по возрастанию id и отдаёт статистику каждой порции.
+
+    Каждый расход пересчитывается в валюту профиля владельца: сумма в другой
+    валюте смешалась бы в сводке с остальными и сразу снова считалась устаревшей.
+
+    В памяти одновременно только одна порция; bulk_update не отправляет
+    сигналы, поэтому сводка и кэш дашборда обновляются явно. Прервать можно
+    в любой момент: продолжить — с after_id последней порции.
+    """
+    expenses = needs_conversion(expenses).only(
+        "id", "user_id", "expense_date", "amount", "currency", "category",
+        "amount_in_target_currency", "converted_currency",
+    )
+    while True:
+        started = time.perf_counter()
+        chunk = list(expenses.filter(id__gt=after_id).order_by("id")[:chunk_size])
+        if not chunk:
+            return
+        after_id = chunk[-1].id
+        converted, failed = _convert_chunk(chunk)
+        # Сбрасывать нужно только суммы, ещё пересчитанные в прежнюю валюту
+        reset = [
+            expense for expense in failed
+            if expense.amount_in_target_currency is not None or expense.converted_currency
+        ]
+        for expense in reset:
+            expense.amount_in_target_currency = None
+            expense.converted_currency = ""
+        changed = converted + reset
+        # Метка времени — после запросов курсов, перед самой записью: иначе порция
+        # могла бы закоммититься с updated_at старше запаса SYNC_OVERLAP_SECONDS,
+        # и клиенты дельта-синхронизации (core.sync) её пропустили бы
+        now = timezone.now()
+        for expense in changed:
+            expense.updated_at = now
+        with transaction.atomic():
+            Expense.objects.bulk_update(changed, CONVERSION_FIELDS, batch_size=chunk_size)
+            for bucket in {MonthlySummary.bucket_of(expense) for expense in changed}:
+                MonthlySummary.refresh(*bucket)
+        for user_id in {expense.user_id for expense in changed}:
+            invalidate_dashboard(user_id)
+        yield {
+            "scanned": len(chunk),
+            "converted": len(converted),
+            "failed": len(failed),
+            "last_id": after_id,
+            "seconds": time.perf_counter() - started,
+        }
@@ -0,0 +1,192 @@
+"""Поиск дублей чеков по хэшам изображения и кэш результатов распознавания"""
+
+import hashlib
+import logging
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+from .models import Expense, RecognizedReceipt
+
+
+log = logging.getLogger(__name__)
+
+# Сторона сетки разностного хэша: 16x16 сравнений дают 256 бит
+HASH_SIZE = 16
+
+
+def content_hash(receipt_file):
+    """SHA-256 содержимого загруженного файла"""
+    digest = hashlib.sha256()
+    receipt_file.seek(0)
+    for chunk in receipt_file.chunks():
+        digest.update(chunk)
+    receipt_file.seek(0)
+    return digest.hexdigest()
+
+
+def perceptual_hash(receipt_file):
+    """Разностный хэш (dHash): совпадает у пересжатых копий одного снимка"""
+    receipt_file.seek(0)
+    try:
+        with Image.open(receipt_file) as image:
+            image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+            pixels = list(
+                image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).getdata()
+            )
+    except (UnidentifiedImageError, OSError) as e:
+        log.error("Не удалось вычислить перцептивный хэш: %s", e)
+        return ""
+    finally:
+        receipt_file.seek(0)
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def fingerprint(expense, receipt_file):
+    """Записывает в расход хэши загруженного изображения"""
+    expense.content_hash = content_hash(receipt_file)
+    expense.perceptual_hash = perceptual_hash(receipt_file)
+
+
+def find_duplicate(user, expense):
+    """Ранее загруженный пользователем расход с тем же файлом (двойная отправка)"""
+    return (
+        Expense.objects.filter(user=user, content_hash=expense.content_hash)
+        .order_by("id")
+        .first()
+    )
+
+
+def hamming_distance(first, second):
+    """Число различающихся бит двух перцептивных хэшей"""
+    return (int(first, 16) ^ int(second, 16)).bit_count()
+
+
+def _recent_expenses(user_id):
+    """Последние расходы пользователя с перцептивным хэшем чека"""
+    return list(
+        Expense.objects.filter(user_id=user_id)
+        .exclude(perceptual_hash="")
+        .only("id", "perceptual_hash")
+        .order_by("-id")[: settings.RECEIPT_NEAR_DUPLICATE_WINDOW]
+    )
+
+
+def _nearest(candidates, perceptual_hash):
+    """Первый из чеков-кандидатов, похожий на снимок с этим перцептивным хэшем"""
+    for candidate in candidates:
+        distance = hamming_distance(candidate.perceptual_hash, perceptual_hash)
+        if distance <= settings.RECEIPT_NEAR_DUPLICATE_DISTANCE:
+            log.debug("Похожий чек %s, расстояние %s", candidate, distance)
+            return candidate
+    return None
+
+
+def find_cached_result(expense):
+    """Результат распознавания того же файла пользователя (точное совпадение хэша содержимого).
+
+    Похожие снимки результат не получают: у двух разных чеков одного магазина
+    перцептивные хэши почти совпадают, а сумма и дата — нет. Чеки других
+    пользователей не используются: их файл и данные не должны попасть в чужой расход.
+    """
+    return RecognizedReceipt.objects.filter(
+        user_id=expense.user_id, content_hash=expense.content_hash
+    ).first()
+
+
+def find_cached_results(user_id, expenses):
+    """find_cached_result для пачки расходов пользователя одним запросом"""
+    exact = {
+        cached.content_hash: cached
+        for cached in RecognizedReceipt.objects.filter(
+            user_id=user_id, content_hash__in={expense.content_hash for expense in expenses}
+        )
+    }
+    return [exact.get(expense.content_hash) for expense in expenses]
+
+
+def flag_similar(user_id, expenses):
+    """Отмечает расходы, похожие на ранее загруженные чеки, как возможные дубли.
+
+    Один запрос на пачку; данные похожего чека не копируются, распознавание
+    всё равно выполняется, а пользователь видит ссылку на похожий расход.
+    """
+    expenses = [expense for expense in expenses if expense.perceptual_hash]
+    if not expenses:
+        return
+    recent = _recent_expenses(user_id)
+    for expense in expenses:
+        expense.similar_to = _nearest(recent, expense.perceptual_hash)
+
+
+def reuse_stored_file(expense, cached):
+    """Ссылается на уже сохранённый файл вместо записи ещё одной копии.
+
+    Файл, удалённый или перенесённый в архив (compact_receipts), не переиспользуется.
+    """
+    storage = Expense._meta.get_field("receipt_image").storage
+    if (
+        cached is not None
+        and cached.content_hash == expense.content_hash
+        and storage.exists(cached.receipt_image)
+    ):
+        expense.receipt_image = cached.receipt_image
+        return True
+    return False
+
+
+def apply_cached_result(expense, cached):
+    """Заполняет расход результатом из кэша распознавания"""
+    expense.place = cached.place
+    expense.category = cached.category
+    expense.expense_date = cached.expense_date
+    expense.amount = cached.amount
+    expense.currency = cached.currency
+
+
+def remember_result(expense):
+    """Сохраняет результат распознавания расхода в кэш по его хэшам"""
+    if not expense.content_hash:
+        return
+    RecognizedReceipt.objects.update_or_create(
+        user_id=expense.user_id,
+        content_hash=expense.content_hash,
+        defaults={
+            "perceptual_hash": expense.perceptual_hash,
+            "receipt_image": expense.receipt_image.name,
+            "place": expense.place,
+            "category": expense.category,
+            "expense_date": expense.expense_date,
+            "amount": expense.amount,
+            "currency": expense.currency,
+        },
+    )
+
+
+def remember_correction(expense):
+    """Переносит в кэш распознавания данные, исправленные пользователем.
+
+    Иначе повторная загрузка того же чека снова получит ошибочный результат.
+    """
+    if not expense.content_hash:
+        return
+    RecognizedReceipt.objects.filter(
+        user_id=expense.user_id, content_hash=expense.content_hash
+    ).update(
+        place=expense.place,
+        category=expense.category,
+        expense_date=expense.expense_date,
+        amount=expense.amount,
+        currency=expense.currency,
+    )
+
+
+def forget_results(user_id, expenses):
+    """Удаляет из кэша распознавания результаты для изменённых пачкой расходов"""
+    hashes = {expense.content_hash for expense in expenses if expense.content_hash}
+    if hashes:
+        RecognizedReceipt.objects.filter(user_id=user_id, content_hash__in=hashes).delete()
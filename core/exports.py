@@ -0,0 +1,202 @@
+"""Потоковая выгрузка расходов в CSV, JSON Lines и XLSX без загрузки всей истории в память"""
+
+import csv
+import datetime
+from decimal import Decimal
+import json
+import re
+from xml.sax.saxutils import escape
+import zipfile
+from .pagination import EXPENSE_ORDERING
+
+
+EXPORT_COLUMNS = [
+    ("id", "ID"),
+    ("expense_date", "Дата"),
+    ("place", "Место покупки"),
+    ("category", "Категория"),
+    ("amount", "Сумма"),
+    ("currency", "Валюта"),
+    ("amount_in_target_currency", "Сумма в целевой валюте"),
+    ("converted_currency", "Целевая валюта"),
+    ("status", "Статус"),
+]
+
+# Символы, недопустимые в XML 1.0 (встречаются в распознанном тексте чеков)
+XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+EXCEL_EPOCH = datetime.date(1899, 12, 30)
+
+
+def export_rows(expenses, chunk_size):
+    """Кортежи полей расходов; строки читаются из БД порциями через iterator()"""
+    return (
+        expenses.order_by(*EXPENSE_ORDERING)
+        .values_list(*(field for field, _ in EXPORT_COLUMNS))
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: write() возвращает строку, а не копит её"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    """CSV с BOM, чтобы Excel открыл кириллицу в UTF-8"""
+    writer = csv.writer(_Echo())
+    yield "\ufeff" + writer.writerow([title for _, title in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow(["" if value is None else value for value in row])
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, Decimal)):
+        return str(value)
+    return value
+
+
+def stream_jsonl(rows):
+    """JSON Lines: по объекту расхода на строку"""
+    fields = [field for field, _ in EXPORT_COLUMNS]
+    for row in rows:
+        record = {field: _json_value(value) for field, value in zip(fields, row)}
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class _Sink:
+    """Буфер, в который zipfile пишет архив, а генератор забирает готовые байты.
+
+    У буфера нет seek(), поэтому zipfile пишет размеры файлов после данных
+    (data descriptor) и архив можно отдавать по мере формирования.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Расходы" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '<Relationship Id="rId2" Target="styles.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+        "</Relationships>"
+    ),
+    # Второй формат ячеек (s="1") — встроенный формат даты 14
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        "</cellXfs>"
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        "</styleSheet>"
+    ),
+}
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return "<c/>"
+    if isinstance(value, datetime.date):
+        return f'<c s="1"><v>{(value - EXCEL_EPOCH).days}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f"<c><v>{value}</v></c>"
+    text = escape(XML_ILLEGAL.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return "<row>" + "".join(_xlsx_cell(value) for value in values) + "</row>"
+
+
+def stream_xlsx(rows, flush_rows=500):
+    """XLSX (один лист, строки inline), собираемый и отдаваемый на лету"""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b"<sheetData>"
+            )
+            sheet.write(_xlsx_row(title for _, title in EXPORT_COLUMNS).encode())
+            for number, row in enumerate(rows, 1):
+                sheet.write(_xlsx_row(row).encode())
+                if number % flush_rows == 0:
+                    yield sink.drain()
+            sheet.write(b"</sheetData></worksheet>")
+        yield sink.drain()
+    yield sink.drain()
+
+
+# Формат выгрузки: (генератор частей, MIME-тип, расширение файла)
+EXPORT_FORMATS = {
+    "csv": (stream_csv, "text/csv; charset=utf-8", "csv"),
+    "jsonl": (stream_jsonl, "application/x-ndjson; charset=utf-8", "jsonl"),
+    "xlsx": (
+        stream_xlsx,
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "xlsx",
+    ),
+}
+
+
+def export_expenses(expenses, export_format, chunk_size):
+    """Части файла выгрузки в заданном формате"""
+    stream = EXPORT_FORMATS[export_format][0]
+    return stream(export_rows(expenses, chunk_size))
@@ -0,0 +1,93 @@
+"""Фискальный QR-код кассового чека (ФНС): дата, сумма и реквизиты без распознавания"""
+
+import datetime
+from decimal import Decimal, InvalidOperation
+import logging
+from urllib.parse import parse_qs
+from PIL import Image, ImageOps
+
+try:
+    from pyzbar import pyzbar
+except ImportError:  # декодеры QR необязательны: без них работает обычное распознавание
+    pyzbar = None
+
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = None
+
+
+log = logging.getLogger(__name__)
+
+FISCAL_CURRENCY = "RUB"
+FISCAL_DATETIME_FORMATS = ("%Y%m%dT%H%M", "%Y%m%dT%H%M%S")
+# Крупные фото уменьшаем: QR-код чека читается и на 1600 px, а декодирование быстрее
+MAX_DECODE_EDGE = 1600
+
+
+def qr_decoder_available():
+    """Установлен ли хотя бы один декодер QR-кодов (pyzbar или OpenCV)"""
+    return pyzbar is not None or cv2 is not None
+
+
+def parse_fiscal_qr(data):
+    """Разбирает строку QR-кода чека (t=...&s=...&fn=...&i=...&fp=...&n=...).
+
+    Возвращает словарь с датой-временем, суммой в рублях и реквизитами
+    или None, если это не фискальный QR-код.
+    """
+    params = {key: values[0] for key, values in parse_qs(data.strip()).items()}
+    if "t" not in params or "s" not in params:
+        return None
+    for datetime_format in FISCAL_DATETIME_FORMATS:
+        try:
+            issued_at = datetime.datetime.strptime(params["t"], datetime_format)
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    try:
+        amount = Decimal(params["s"].replace(",", "."))
+    except InvalidOperation:
+        return None
+    return {
+        "issued_at": issued_at,
+        "amount": amount,
+        "currency": FISCAL_CURRENCY,
+        "fn": params.get("fn", ""),
+        "fd": params.get("i", ""),
+        "fp": params.get("fp", ""),
+        "operation": params.get("n", ""),
+    }
+
+
+def _decode(image):
+    """Строки всех QR-кодов на изображении первым доступным декодером"""
+    if pyzbar is not None:
+        return [
+            symbol.data.decode("utf-8", "replace")
+            for symbol in pyzbar.decode(image, symbols=[pyzbar.ZBarSymbol.QRCODE])
+        ]
+    found, decoded, _, _ = cv2.QRCodeDetector().detectAndDecodeMulti(numpy.asarray(image))
+    return [data for data in decoded if data] if found else []
+
+
+def read_fiscal_qr(image_path):
+    """Фискальные данные из QR-кода на снимке чека или None"""
+    if not qr_decoder_available():
+        return None
+    try:
+        with Image.open(image_path) as image:
+            image = ImageOps.exif_transpose(image).convert("L")
+    except OSError as e:
+        log.error("Не удалось открыть изображение %s: %s", image_path, e)
+        return None
+    image.thumbnail((MAX_DECODE_EDGE, MAX_DECODE_EDGE))
+    for data in _decode(image):
+        fiscal = parse_fiscal_qr(data)
+        if fiscal:
+            log.debug("Фискальный QR-код: %s", fiscal)
+            return fiscal
+    return None
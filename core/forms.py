@@ -1,5 +1,19 @@
+import os
+import re
+import zipfile
 from django import forms
-from .models import Expense
+from django.conf import settings
+from django.core.files.base import ContentFile
+from .models import Expense, UserProfile
+from .statements import StatementError, decode_statement
+
+
+def clean_currency_code(value):
+    """Код валюты ISO 4217 в верхнем регистре"""
+    currency = (value or "").strip().upper()
+    if not re.fullmatch(r"[A-Z]{3}", currency):
+        raise forms.ValidationError("Укажите трёхбуквенный код валюты, например RUB")
+    return currency
 
 
 class ExpenseForm(forms.ModelForm):
@@ -36,4 +50,240 @@ class ExpenseEditForm(forms.ModelForm):
         fields = ["place", "category", "expense_date", "amount", "currency"]
         widgets = {
             "category": forms.Select(choices=Expense.CATEGORY_CHOICES),
-        }
\ No newline at end of file
+        }
+
+
+class ProfileForm(forms.ModelForm):
+    """Форма настроек профиля: целевая валюта для пересчёта расходов"""
+
+    target_currency = forms.CharField(label="Целевая валюта", max_length=3)
+
+    class Meta:
+        model = UserProfile
+        fields = ["target_currency"]
+
+    def clean_target_currency(self):
+        """Код валюты ISO 4217 в верхнем регистре"""
+        return clean_currency_code(self.cleaned_data["target_currency"])
+
+
+class ExpenseFilterForm(forms.Form):
+    """Форма фильтра списка расходов по датам и курсора страницы"""
+
+    date_from = forms.DateField(label="С", required=False, widget=forms.DateInput(attrs={"type": "date"}))
+    date_to = forms.DateField(label="По", required=False, widget=forms.DateInput(attrs={"type": "date"}))
+    cursor = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    def filter(self, expenses):
+        """Применяет фильтр по датам к набору расходов"""
+        if self.cleaned_data.get("date_from"):
+            expenses = expenses.filter(expense_date__gte=self.cleaned_data["date_from"])
+        if self.cleaned_data.get("date_to"):
+            expenses = expenses.filter(expense_date__lte=self.cleaned_data["date_to"])
+        return expenses
+
+
+class MultipleFileInput(forms.ClearableFileInput):
+    """Виджет выбора нескольких файлов"""
+
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    """Поле, принимающее список файлов"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("widget", MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(item, initial) for item in data]
+        return [single_file_clean(data, initial)]
+
+
+class ReceiptBatchForm(forms.Form):
+    """Форма пакетной загрузки чеков: несколько изображений или zip-архив"""
+
+    IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+
+    receipt_files = MultipleFileField(label="Чеки (изображения или zip-архив)")
+
+    def _unpack_zip(self, archive):
+        """Извлекает изображения из zip-архива"""
+        try:
+            with zipfile.ZipFile(archive) as zip_file:
+                for info in zip_file.infolist():
+                    name = os.path.basename(info.filename)
+                    extension = os.path.splitext(name)[1].lower()
+                    if info.is_dir() or name.startswith(".") or extension not in self.IMAGE_EXTENSIONS:
+                        continue
+                    if info.file_size > settings.RECEIPT_BATCH_MAX_FILE_SIZE:
+                        raise forms.ValidationError(f"Файл {name} в архиве слишком большой")
+                    yield ContentFile(zip_file.read(info), name=name)
+        except zipfile.BadZipFile as e:
+            raise forms.ValidationError(f"Повреждённый архив {archive.name}") from e
+
+    def clean_receipt_files(self):
+        """Разворачивает архивы и проверяет, что каждый файл — изображение"""
+        image_field = forms.ImageField()
+        images = []
+        for uploaded in self.cleaned_data["receipt_files"]:
+            if uploaded.name.lower().endswith(".zip"):
+                files = self._unpack_zip(uploaded)
+            else:
+                files = [uploaded]
+            for receipt_file in files:
+                try:
+                    images.append(image_field.clean(receipt_file))
+                except forms.ValidationError as e:
+                    raise forms.ValidationError(f"{receipt_file.name}: {e.messages[0]}") from e
+                if len(images) > settings.RECEIPT_BATCH_MAX_FILES:
+                    raise forms.ValidationError(
+                        f"Не больше {settings.RECEIPT_BATCH_MAX_FILES} чеков за одну загрузку"
+                    )
+        if not images:
+            raise forms.ValidationError("Не найдено ни одного изображения чека")
+        return images
+
+
+class ExportForm(ExpenseFilterForm):
+    """Форма выгрузки расходов: формат и фильтры по датам и категории"""
+
+    category = forms.ChoiceField(
+        label="Категория", required=False, choices=[("", "Все")] + Expense.CATEGORY_CHOICES
+    )
+    format = forms.ChoiceField(
+        label="Формат",
+        choices=[("csv", "CSV"), ("xlsx", "Excel (XLSX)"), ("jsonl", "JSON Lines")],
+        initial="csv",
+    )
+
+    def filter(self, expenses):
+        """Применяет фильтры по датам и категории"""
+        expenses = super().filter(expenses)
+        if self.cleaned_data.get("category"):
+            expenses = expenses.filter(category=self.cleaned_data["category"])
+        return expenses
+
+
+class StatementImportForm(forms.Form):
+    """Форма импорта CSV-выписки банка с необязательными названиями столбцов"""
+
+    statement_file = forms.FileField(label="Выписка (CSV)")
+    date_column = forms.CharField(label="Столбец даты", required=False)
+    amount_column = forms.CharField(label="Столбец суммы", required=False)
+    currency_column = forms.CharField(label="Столбец валюты", required=False)
+    place_column = forms.CharField(label="Столбец описания", required=False)
+    category_column = forms.CharField(label="Столбец категории", required=False)
+
+    def clean_statement_file(self):
+        """Проверяет размер выписки и возвращает её текст"""
+        statement = self.cleaned_data["statement_file"]
+        if statement.size > settings.STATEMENT_MAX_FILE_SIZE:
+            raise forms.ValidationError("Файл выписки слишком большой")
+        try:
+            return decode_statement(statement.read())
+        except StatementError as e:
+            raise forms.ValidationError(str(e)) from e
+
+    def column_overrides(self):
+        """Явно указанные названия столбцов по полям расхода"""
+        return {
+            "expense_date": self.cleaned_data.get("date_column"),
+            "amount": self.cleaned_data.get("amount_column"),
+            "currency": self.cleaned_data.get("currency_column"),
+            "place": self.cleaned_data.get("place_column"),
+            "category": self.cleaned_data.get("category_column"),
+        }
+
+
+class ApiExpenseForm(forms.ModelForm):
+    """Расход в JSON API: создание или изменение поверх текущих значений.
+
+    У нового расхода обязательны дата, сумма и валюта; при изменении
+    их можно не указывать — например, у ещё не распознанного чека.
+    """
+
+    place = forms.CharField(required=False, max_length=255, empty_value=None)
+    category = forms.CharField(required=False, max_length=100, empty_value=None)
+    expense_date = forms.DateField(required=False)
+    amount = forms.DecimalField(required=False, max_digits=10, decimal_places=2)
+    currency = forms.CharField(required=False, max_length=3, empty_value=None)
+
+    class Meta:
+        model = Expense
+        fields = ["place", "category", "expense_date", "amount", "currency"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is None:
+            for name in ("expense_date", "amount", "currency"):
+                self.fields[name].required = True
+
+    def clean_category(self):
+        """Категория из BASE_CATEGORIES или её прежнее название"""
+        return Expense.normalize_category(self.cleaned_data["category"])
+
+    def clean_currency(self):
+        """Код валюты ISO 4217 в верхнем регистре"""
+        currency = self.cleaned_data["currency"]
+        return clean_currency_code(currency) if currency else None
+
+
+def clean_page_limit(limit):
+    """Размер страницы API: по умолчанию API_PAGE_SIZE, не больше API_MAX_PAGE_SIZE"""
+    limit = limit or settings.API_PAGE_SIZE
+    if limit > settings.API_MAX_PAGE_SIZE:
+        raise forms.ValidationError(f"Не больше {settings.API_MAX_PAGE_SIZE} расходов на страницу")
+    return limit
+
+
+class ApiExpenseListForm(ExpenseFilterForm):
+    """Параметры списка расходов в API: фильтры, курсор и размер страницы"""
+
+    category = forms.ChoiceField(required=False, choices=[("", "Все")] + Expense.CATEGORY_CHOICES)
+    limit = forms.IntegerField(required=False, min_value=1)
+
+    def clean_limit(self):
+        """Размер страницы: по умолчанию API_PAGE_SIZE, не больше API_MAX_PAGE_SIZE"""
+        return clean_page_limit(self.cleaned_data["limit"])
+
+    def filter(self, expenses):
+        """Применяет фильтры по датам и категории"""
+        expenses = super().filter(expenses)
+        if self.cleaned_data.get("category"):
+            expenses = expenses.filter(category=self.cleaned_data["category"])
+        return expenses
+
+
+class ApiAggregateForm(forms.Form):
+    """Параметры итогов в API: диапазон месяцев, категория и группировка"""
+
+    GROUPS = ("month", "category")
+
+    month_from = forms.RegexField(r"^\d{4}-\d{2}$", required=False)
+    month_to = forms.RegexField(r"^\d{4}-\d{2}$", required=False)
+    category = forms.ChoiceField(required=False, choices=[("", "Все")] + Expense.CATEGORY_CHOICES)
+    group_by = forms.CharField(required=False)
+
+    def clean_group_by(self):
+        """Поля группировки через запятую; по умолчанию месяц и категория"""
+        value = self.cleaned_data["group_by"]
+        groups = [group.strip() for group in value.split(",") if group.strip()] if value else list(self.GROUPS)
+        unknown = [group for group in groups if group not in self.GROUPS]
+        if unknown:
+            raise forms.ValidationError(f"Неизвестная группировка: {', '.join(unknown)}")
+        return list(dict.fromkeys(groups))
+
+
+class ApiSyncForm(forms.Form):
+    """Параметры инкрементальной синхронизации: курсор прошлого ответа и размер страницы"""
+
+    since = forms.CharField(required=False)
+    limit = forms.IntegerField(required=False, min_value=1)
+
+    def clean_limit(self):
+        """Размер страницы: по умолчанию API_PAGE_SIZE, не больше API_MAX_PAGE_SIZE"""
+        return clean_page_limit(self.cleaned_data["limit"])
@@ -0,0 +1,79 @@
+"""Подготовка изображений чеков перед отправкой в модель распознавания"""
+
+import io
+import logging
+import os
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+log = logging.getLogger(__name__)
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+ORIENTATION_TAG = 0x0112
+
+
+def prepare_receipt_image(image_path):
+    """Уменьшает и перекодирует чек для модели; оригинал на диске не меняется.
+
+    Возвращает (байты, mime-тип, статистика). Если изображение не удалось
+    открыть, отправляется исходный файл как есть.
+    """
+    original_bytes = os.path.getsize(image_path)
+    max_edge = settings.RECEIPT_IMAGE_MAX_EDGE
+    image_format = settings.RECEIPT_IMAGE_FORMAT.upper()
+    try:
+        with Image.open(image_path) as image:
+            original_format = image.format
+            # Оригинал можно отправить как есть, если он не требует поворота и уменьшения
+            as_is = (
+                original_format in MIME_TYPES
+                and max(image.size) <= max_edge
+                and image.getexif().get(ORIENTATION_TAG, 1) == 1
+            )
+            # Для JPEG декодируем сразу в уменьшенном масштабе
+            image.draft("RGB", (max_edge, max_edge))
+            image = ImageOps.exif_transpose(image)
+            if settings.RECEIPT_IMAGE_GRAYSCALE:
+                image = ImageOps.autocontrast(image.convert("L"), cutoff=1)
+            elif image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format, quality=settings.RECEIPT_IMAGE_QUALITY)
+            size = image.size
+    except (UnidentifiedImageError, OSError) as e:
+        log.error("Не удалось подготовить изображение %s: %s", image_path, e)
+        with open(image_path, "rb") as image_file:
+            payload = image_file.read()
+        return payload, "image/jpeg", {"original_bytes": original_bytes, "payload_bytes": len(payload)}
+
+    payload = buffer.getvalue()
+    mime_type = MIME_TYPES[image_format]
+    if as_is and len(payload) >= original_bytes:
+        with open(image_path, "rb") as image_file:
+            payload = image_file.read()
+        mime_type = MIME_TYPES[original_format]
+    stats = {
+        "original_bytes": original_bytes,
+        "payload_bytes": len(payload),
+        "width": size[0],
+        "height": size[1],
+    }
+    log.debug("Изображение подготовлено: %s", stats)
+    return payload, mime_type, stats
+
+
+def load_ocr_image(image_path):
+    """Изображение чека для OCR: поворот по EXIF, оттенки серого и автоконтраст"""
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image = ImageOps.autocontrast(image.convert("L"), cutoff=1)
+    # Мелкие снимки увеличиваем: OCR плохо читает символы высотой в несколько пикселей
+    min_edge = settings.RECEIPT_OCR_MIN_EDGE
+    if max(image.size) < min_edge:
+        scale = min_edge / max(image.size)
+        image = image.resize(
+            (round(image.width * scale), round(image.height * scale)), Image.Resampling.LANCZOS
+        )
+    return image
@@ -0,0 +1,531 @@
+"""Фоновая очередь обработки чеков на базе БД (без внешнего брокера)"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import logging
+import random
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from .caching import invalidate_dashboard
+from .classifier import predict_category
+from .conversions import convert_in_chunks
+from .dedup import (
+    apply_cached_result,
+    find_cached_result,
+    find_cached_results,
+    fingerprint,
+    flag_similar,
+    remember_result,
+    reuse_stored_file,
+)
+from .media import alocal_path, local_path, make_previews, receipt_file
+from .metrics import cache_result, span
+from .models import Expense, MonthlySummary, ProcessingJob, ReceiptBatch, UserProfile
+from .rates import aclose_async_client as aclose_rates_client, aconvert_amount, convert_amount
+from .receipts import aclose_async_client as aclose_openai_client, parse_receipt_date
+from .recognizers import get_recognizer
+
+
+log = logging.getLogger(__name__)
+
+# Ошибки разбора ответа провайдера (json.JSONDecodeError — подкласс ValueError):
+# задание с ними сразу помечается упавшим, без повторов
+PERMANENT_ERRORS = (ValueError, TypeError)
+
+
+def convert_expense(expense, target_currency=None):
+    """Пересчитывает сумму расхода в целевую валюту (по умолчанию из профиля) и запоминает её"""
+    target_currency = target_currency or UserProfile.currency_of(expense.user_id)
+    expense.amount_in_target_currency = convert_amount(
+        expense.amount, expense.expense_date, expense.currency, target_currency
+    )
+    expense.converted_currency = (
+        target_currency if expense.amount_in_target_currency is not None else ""
+    )
+
+
+async def aconvert_expense(expense, target_currency=None):
+    """Асинхронная версия convert_expense"""
+    target_currency = target_currency or await sync_to_async(UserProfile.currency_of)(
+        expense.user_id
+    )
+    expense.amount_in_target_currency = await aconvert_amount(
+        expense.amount, expense.expense_date, expense.currency, target_currency
+    )
+    expense.converted_currency = (
+        target_currency if expense.amount_in_target_currency is not None else ""
+    )
+
+
+def prepare_receipt(expense, target_currency=None):
+    """Подставляет результат из кэша, если чек с такими хэшами уже распознавался.
+
+    Возвращает True, если распознавание не требуется.
+    """
+    cached = find_cached_result(expense)
+    if cached is None:
+        flag_similar(expense.user_id, [expense])
+    return _use_cached_result(expense, cached, target_currency)
+
+
+def _use_cached_result(expense, cached, target_currency=None):
+    cache_result("recognition", cached is not None)
+    if cached is None:
+        expense.status = Expense.STATUS_PENDING
+        return False
+    log.debug("Чек найден в кэше распознавания: %s", cached)
+    reuse_stored_file(expense, cached)
+    apply_cached_result(expense, cached)
+    convert_expense(expense, target_currency)
+    expense.status = Expense.STATUS_DONE
+    return True
+
+
+def enqueue_receipt(expense):
+    """Ставит чек в очередь на распознавание и помечает расход как ожидающий"""
+    # Только что сохранённый расход уже ожидающий (prepare_receipt): лишний UPDATE не нужен
+    if expense.status != Expense.STATUS_PENDING:
+        Expense.objects.filter(pk=expense.pk).update(
+            status=Expense.STATUS_PENDING, updated_at=timezone.now()
+        )
+        expense.status = Expense.STATUS_PENDING
+        invalidate_dashboard(expense.user_id)
+    return ProcessingJob.objects.create(
+        kind=ProcessingJob.KIND_RECEIPT,
+        expense=expense,
+        provider="openai",
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def create_receipt_batch(user, files):
+    """Сохраняет пачку чеков через bulk_create и ставит все в очередь распознавания"""
+    image_field = Expense._meta.get_field("receipt_image")
+    batch = ReceiptBatch.objects.create(user=user)
+    target_currency = UserProfile.currency_of(user.pk)
+    received = []
+    for upload in files:
+        expense = Expense(user=user, batch=batch)
+        fingerprint(expense, upload)
+        received.append((expense, upload))
+    # Дубли и кэш распознавания ищутся одним запросом на пачку, а не на каждый файл
+    seen = set(
+        Expense.objects.filter(
+            user=user, content_hash__in={expense.content_hash for expense, _ in received}
+        ).values_list("content_hash", flat=True)
+    )
+    unique = []
+    for expense, upload in received:
+        if expense.content_hash in seen:
+            log.debug("Пропущен дубль чека %s", upload.name)
+            batch.duplicates += 1
+            continue
+        seen.add(expense.content_hash)
+        unique.append((expense, upload))
+    if batch.duplicates:
+        batch.save(update_fields=["duplicates"])
+    cached_results = find_cached_results(user.pk, [expense for expense, _ in unique])
+    flag_similar(
+        user.pk, [expense for (expense, _), cached in zip(unique, cached_results) if cached is None]
+    )
+    expenses = []
+    for (expense, upload), cached in zip(unique, cached_results):
+        _use_cached_result(expense, cached, target_currency)
+        if not expense.receipt_image:
+            name = image_field.generate_filename(None, upload.name)
+            expense.receipt_image = image_field.storage.save(name, upload)
+        expenses.append(expense)
+    expenses = Expense.objects.bulk_create(expenses)
+    # bulk_create не отправляет сигналы, поэтому сводку обновляем явно
+    for bucket in {MonthlySummary.bucket_of(expense) for expense in expenses}:
+        MonthlySummary.refresh(*bucket)
+    invalidate_dashboard(user.pk)
+    ProcessingJob.objects.bulk_create(
+        ProcessingJob(
+            kind=ProcessingJob.KIND_RECEIPT,
+            expense=expense,
+            provider="openai",
+            max_attempts=settings.JOB_MAX_ATTEMPTS,
+        )
+        for expense in expenses
+        if expense.status == Expense.STATUS_PENDING
+    )
+    log.debug(
+        "Пакет %s: поставлено в очередь чеков %s, пропущено дублей %s",
+        batch.pk, len(expenses), batch.duplicates,
+    )
+    return batch
+
+
+def requeue_failed(jobs):
+    """Возвращает упавшие задания в очередь с обнулённым счётчиком попыток"""
+    jobs = jobs.filter(status=ProcessingJob.STATUS_FAILED)
+    expenses = Expense.objects.filter(jobs__in=jobs)
+    user_ids = set(expenses.values_list("user_id", flat=True))
+    # Без упавших чеков обновлять расходы нечего (упавший пересчёт валюты — без расхода)
+    if user_ids:
+        expenses.update(status=Expense.STATUS_PENDING, updated_at=timezone.now())
+    for user_id in user_ids:
+        invalidate_dashboard(user_id)
+    return jobs.update(
+        status=ProcessingJob.STATUS_QUEUED,
+        attempts=0,
+        run_after=timezone.now(),
+        locked_at=None,
+        last_error="",
+    )
+
+
+def retry_delay(attempt):
+    """Экспоненциальная задержка перед повтором с джиттером, в секундах"""
+    delay = min(settings.JOB_RETRY_BASE_DELAY * 2 ** (attempt - 1), settings.JOB_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _stale(now):
+    """Условие на выполняющееся задание, чей обработчик упал или завис, не освободив его"""
+    stale = now - datetime.timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    return Q(status=ProcessingJob.STATUS_RUNNING, locked_at__lt=stale)
+
+
+def _due_jobs(now):
+    """Задания, готовые к запуску, включая зависшие у упавшего обработчика.
+
+    Зависшее задание забирается снова, только пока у него остались попытки:
+    иначе чек, на котором падает сам обработчик, крутился бы бесконечно.
+    """
+    return ProcessingJob.objects.filter(
+        Q(status=ProcessingJob.STATUS_QUEUED, run_after__lte=now)
+        | (_stale(now) & Q(attempts__lt=F("max_attempts")))
+    )
+
+
+def _fail_exhausted(now, provider):
+    """Помечает упавшими зависшие задания провайдера, у которых не осталось попыток"""
+    exhausted = list(
+        ProcessingJob.objects.filter(_stale(now), provider=provider, attempts__gte=F("max_attempts"))
+        .values_list("pk", "expense_id", "expense__user_id")
+    )
+    if not exhausted:
+        return
+    # Повторная проверка условия: медленный, но живой обработчик мог успеть завершить задание
+    ProcessingJob.objects.filter(_stale(now), pk__in=[pk for pk, _, _ in exhausted]).update(
+        status=ProcessingJob.STATUS_FAILED,
+        locked_at=None,
+        last_error="Обработчик не завершил задание за все попытки",
+        updated_at=now,
+    )
+    Expense.objects.filter(pk__in=[expense_id for _, expense_id, _ in exhausted if expense_id]).update(
+        status=Expense.STATUS_FAILED, updated_at=now
+    )
+    for user_id in {user_id for _, _, user_id in exhausted if user_id}:
+        invalidate_dashboard(user_id)
+    log.error("Задания %s помечены упавшими: попытки исчерпаны", [pk for pk, _, _ in exhausted])
+
+
+def claim_jobs(provider, limit):
+    """Забирает до limit заданий провайдера; захват атомарен между процессами"""
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    _fail_exhausted(now, provider)
+    candidates = list(
+        _due_jobs(now)
+        .filter(provider=provider)
+        .order_by("run_after")
+        .values_list("pk", flat=True)[:limit]
+    )
+    claimed = []
+    for pk in candidates:
+        updated = _due_jobs(now).filter(pk=pk).update(
+            status=ProcessingJob.STATUS_RUNNING,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if updated:
+            claimed.append(pk)
+    return claimed
+
+
+def _apply_recognition(job, stats, recognized):
+    """Записывает статистику задания и распознанные поля расхода (без сохранения)"""
+    ProcessingJob.objects.filter(pk=job.pk).update(
+        original_bytes=stats.get("original_bytes"),
+        payload_bytes=stats.get("payload_bytes"),
+        recognition_ms=stats.get("recognition_ms"),
+        recognizer=recognized.recognizer,
+        confidence=stats.get("confidence"),
+    )
+    expense = job.expense
+    place, category, expense_date, amount, currency = recognized.fields
+    expense.place = place
+    # Категорию по месту подбирает локальный классификатор; модель её не определяет
+    expense.category = predict_category(expense.user_id, place) or category
+    expense.expense_date = parse_receipt_date(expense_date)
+    expense.amount = amount
+    expense.currency = currency
+    return expense
+
+
+def _finish_receipt(expense):
+    log.debug(
+        "Конвертированная сумма: %s %s",
+        expense.amount_in_target_currency, expense.converted_currency,
+    )
+    expense.status = Expense.STATUS_DONE
+    with span("db_save"):
+        expense.save()
+        remember_result(expense)
+
+
+def _start_receipt(job):
+    # update() не трогает auto_now и не отправляет сигналы: updated_at и версию
+    # данных для ETag сдвигаем сами, иначе синхронизация не увидит смену статуса
+    Expense.objects.filter(pk=job.expense_id).update(
+        status=Expense.STATUS_PROCESSING, updated_at=timezone.now()
+    )
+    invalidate_dashboard(job.expense.user_id)
+
+
+def handle_receipt(job):
+    """Создаёт превью чека, распознаёт его и конвертирует сумму в целевую валюту"""
+    _start_receipt(job)
+    # Превью для страниц создаются сразу после загрузки, вместе с распознаванием
+    with span("make_previews"):
+        make_previews(receipt_file(job.expense))
+    stats = {}
+    with local_path(receipt_file(job.expense)) as image_path, span("recognize"):
+        recognized = get_recognizer().recognize(image_path, stats)
+    expense = _apply_recognition(job, stats, recognized)
+    convert_expense(expense)
+    _finish_receipt(expense)
+
+
+async def ahandle_receipt(job):
+    """Асинхронная версия handle_receipt; работа с БД идёт через sync_to_async"""
+    await sync_to_async(_start_receipt)(job)
+    # Не через sync_to_async: он выполняет код в одном общем потоке, а превью не трогают БД
+    with span("make_previews"):
+        await asyncio.to_thread(make_previews, receipt_file(job.expense))
+    stats = {}
+    async with alocal_path(receipt_file(job.expense)) as image_path:
+        with span("recognize"):
+            recognized = await get_recognizer().arecognize(image_path, stats)
+    expense = await sync_to_async(_apply_recognition)(job, stats, recognized)
+    await aconvert_expense(expense)
+    await sync_to_async(_finish_receipt)(expense)
+
+
+def handle_reconvert(job):
+    """Пересчитывает все расходы пользователя в валюту из его профиля.
+
+    Курсы берутся из таблиц по датам (LRU и ExchangeRate), а не запросом
+    на каждый расход; уже пересчитанные расходы пропускаются, поэтому
+    повтор после сбоя продолжает с места остановки.
+    """
+    converted = failed = 0
+    for chunk in convert_in_chunks(Expense.objects.filter(user_id=job.user_id)):
+        converted += chunk["converted"]
+        failed += chunk["failed"]
+    log.info(
+        "Пересчёт расходов пользователя %s: пересчитано %s, без курса %s",
+        job.user_id, converted, failed,
+    )
+
+
+HANDLERS = {
+    ProcessingJob.KIND_RECEIPT: handle_receipt,
+    ProcessingJob.KIND_RECONVERT: handle_reconvert,
+}
+
+ASYNC_HANDLERS = {
+    ProcessingJob.KIND_RECEIPT: ahandle_receipt,
+    ProcessingJob.KIND_RECONVERT: sync_to_async(handle_reconvert),
+}
+
+
+def _load_job(pk):
+    return ProcessingJob.objects.select_related("expense").get(pk=pk)
+
+
+def _complete(job):
+    job.status = ProcessingJob.STATUS_DONE
+    job.last_error = ""
+    job.locked_at = None
+    job.save(update_fields=["status", "last_error", "locked_at", "updated_at"])
+
+
+def run_job(pk):
+    """Выполняет одно захваченное задание и фиксирует результат или повтор"""
+    close_old_connections()
+    try:
+        job = _load_job(pk)
+        try:
+            HANDLERS[job.kind](job)
+        except Exception as e:  # pylint: disable=broad-except
+            log.exception("Ошибка выполнения задания %s", job)
+            _fail(job, e)
+            return
+        _complete(job)
+    finally:
+        close_old_connections()
+
+
+async def arun_job(pk):
+    """Асинхронная версия run_job для AsyncWorkerPool"""
+    job = await sync_to_async(_load_job)(pk)
+    try:
+        await ASYNC_HANDLERS[job.kind](job)
+    except Exception as e:  # pylint: disable=broad-except
+        log.exception("Ошибка выполнения задания %s", job)
+        await sync_to_async(_fail)(job, e)
+        return
+    await sync_to_async(_complete)(job)
+
+
+def _is_permanent(error):
+    """Ошибка не пройдёт при повторе: например, ответ модели не разобран.
+
+    Повтор такого задания лишь оплатил бы ещё один запрос к провайдеру.
+    Причина проверяется по цепочке: RemoteStageError оборачивает ошибку движка.
+    """
+    while error is not None:
+        if isinstance(error, PERMANENT_ERRORS):
+            return True
+        error = error.__cause__
+    return False
+
+
+def _fail(job, error):
+    """Планирует повтор с задержкой или окончательно помечает задание упавшим"""
+    job.last_error = f"{type(error).__name__}: {error}"
+    job.locked_at = None
+    if job.attempts < job.max_attempts and not _is_permanent(error):
+        delay = retry_delay(job.attempts)
+        job.status = ProcessingJob.STATUS_QUEUED
+        job.run_after = timezone.now() + datetime.timedelta(seconds=delay)
+        log.warning("Повтор задания %s через %.1f с", job, delay)
+    else:
+        job.status = ProcessingJob.STATUS_FAILED
+        if job.expense_id:
+            Expense.objects.filter(pk=job.expense_id).update(
+                status=Expense.STATUS_FAILED, updated_at=timezone.now()
+            )
+            invalidate_dashboard(job.expense.user_id)
+    job.save(update_fields=["status", "last_error", "locked_at", "run_after", "updated_at"])
+
+
+class WorkerPool:
+    """Пул потоков, разбирающий очередь с лимитом параллельности на провайдера.
+
+    Лимит действует в пределах одного процесса обработчика.
+    """
+
+    def __init__(self, concurrency=None, poll_interval=None):
+        self.concurrency = dict(concurrency or settings.PROVIDER_CONCURRENCY)
+        self.poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+        self.in_flight = {provider: 0 for provider in self.concurrency}
+        self.lock = threading.Lock()
+        # Будит основной цикл, как только освобождается слот провайдера
+        self.wakeup = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=sum(self.concurrency.values()))
+
+    def _release(self, provider):
+        with self.lock:
+            self.in_flight[provider] -= 1
+        self.wakeup.set()
+
+    def tick(self):
+        """Запускает задания на свободные слоты; возвращает число запущенных"""
+        started = 0
+        for provider, limit in self.concurrency.items():
+            with self.lock:
+                free = limit - self.in_flight[provider]
+            for pk in claim_jobs(provider, free):
+                with self.lock:
+                    self.in_flight[provider] += 1
+                future = self.executor.submit(run_job, pk)
+                future.add_done_callback(lambda _, p=provider: self._release(p))
+                started += 1
+        return started
+
+    def idle(self):
+        """Нет выполняющихся заданий"""
+        with self.lock:
+            return not any(self.in_flight.values())
+
+    def run(self, once=False):
+        """Основной цикл; при once=True завершается, когда очередь опустела"""
+        try:
+            while True:
+                self.wakeup.clear()
+                started = self.tick()
+                close_old_connections()
+                if once and not started and self.idle():
+                    return
+                self.wakeup.wait(self.poll_interval)
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+class AsyncWorkerPool:
+    """Разбирает очередь в одном event loop: задание в работе — корутина, а не поток.
+
+    Запросы к провайдерам идут через асинхронные клиенты с пулом keep-alive
+    соединений, поэтому лимиты ASYNC_PROVIDER_CONCURRENCY могут быть в сотни
+    заданий. Запросы к БД выполняются в отдельном потоке через sync_to_async.
+    """
+
+    def __init__(self, concurrency=None, poll_interval=None):
+        self.concurrency = dict(concurrency or settings.ASYNC_PROVIDER_CONCURRENCY)
+        self.poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+        self.in_flight = {provider: 0 for provider in self.concurrency}
+        self.tasks = set()
+        self.wakeup = None
+
+    def _release(self, task, provider):
+        self.tasks.discard(task)
+        self.in_flight[provider] -= 1
+        self.wakeup.set()
+
+    async def tick(self):
+        """Запускает задания на свободные слоты; возвращает число запущенных"""
+        started = 0
+        for provider, limit in self.concurrency.items():
+            free = limit - self.in_flight[provider]
+            for pk in await sync_to_async(claim_jobs)(provider, free):
+                self.in_flight[provider] += 1
+                task = asyncio.create_task(arun_job(pk))
+                self.tasks.add(task)
+                task.add_done_callback(lambda t, p=provider: self._release(t, p))
+                started += 1
+        return started
+
+    def idle(self):
+        """Нет выполняющихся заданий"""
+        return not self.tasks
+
+    async def run(self, once=False):
+        """Основной цикл; при once=True завершается, когда очередь опустела"""
+        self.wakeup = asyncio.Event()
+        try:
+            while True:
+                self.wakeup.clear()
+                started = await self.tick()
+                await sync_to_async(close_old_connections)()
+                if once and not started and self.idle():
+                    return
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+            await aclose_openai_client()
+            await aclose_rates_client()
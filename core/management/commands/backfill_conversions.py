@@ -0,0 +1,51 @@
+"""Команда дозаполнения сумм расходов в целевой валюте"""
+
+import time
+from django.core.management.base import BaseCommand
+from core.conversions import convert_in_chunks
+from core.models import Expense
+
+
+class Command(BaseCommand):
+    """Пересчитывает расходы без суммы в валюте профиля или пересчитанные в другую валюту"""
+
+    help = (
+        "Находит расходы с пустой или устаревшей суммой в валюте профиля владельца и пересчитывает "
+        "их порциями через bulk_update; курсы загружаются один раз на дату. "
+        "Можно прервать и продолжить с --after-id"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="user_ids",
+            help="ID пользователя (можно указать несколько раз); по умолчанию все",
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Расходов в порции")
+        parser.add_argument(
+            "--after-id", type=int, default=0,
+            help="Продолжить с расходов, id которых больше указанного",
+        )
+
+    def handle(self, *args, **options):
+        expenses = Expense.objects.all()
+        if options["user_ids"]:
+            expenses = expenses.filter(user_id__in=options["user_ids"])
+
+        started = time.perf_counter()
+        totals = {"scanned": 0, "converted": 0, "failed": 0}
+        for chunk in convert_in_chunks(
+            expenses, chunk_size=options["chunk_size"], after_id=options["after_id"]
+        ):
+            for key in totals:
+                totals[key] += chunk[key]
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"Порция до id {chunk['last_id']}: пересчитано {chunk['converted']}, "
+                f"без курса {chunk['failed']}, {chunk['scanned'] / chunk['seconds']:.0f} строк/с; "
+                f"всего {totals['converted']}/{totals['scanned']}, "
+                f"{totals['scanned'] / elapsed:.0f} строк/с"
+            )
+        self.stdout.write(
+            f"Готово: просмотрено {totals['scanned']}, пересчитано {totals['converted']}, "
+            f"без курса {totals['failed']} за {time.perf_counter() - started:.1f} с"
+        )
@@ -0,0 +1,97 @@
+"""Команда воспроизводимого бенчмарка страниц на синтетических данных"""
+
+import datetime
+import json
+import platform
+import time
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from core.benchmarks import ENDPOINTS, parse_size, run_benchmark, seed_user
+from core.rates import rates_cache
+from core.stubs import stub_providers
+
+
+class Command(BaseCommand):
+    """Замеряет задержки и число SQL-запросов страниц под WSGI и ASGI"""
+
+    help = (
+        "Засевает пользователей синтетическими расходами (1k/100k/1M) и замеряет "
+        "p50/p95/p99 и число SQL-запросов на запрос для dashboard, upload_receipt, "
+        "expense и save_expense под WSGI и ASGI с заглушками OpenAI и курсов валют. "
+        "Результат — JSON для сравнения прогонов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", action="append", default=None,
+            help="Размер истории пользователя: 1k, 100k, 1M или число (можно несколько раз)",
+        )
+        parser.add_argument(
+            "--endpoint", action="append", dest="endpoints", choices=ENDPOINTS,
+            help="Страница для замера (можно несколько раз); по умолчанию все",
+        )
+        parser.add_argument(
+            "--server", action="append", dest="servers", choices=("wsgi", "asgi"),
+            help="Обработчик запросов (можно несколько раз); по умолчанию оба",
+        )
+        parser.add_argument("--requests", type=int, default=200, help="Запросов к каждой странице")
+        parser.add_argument("--concurrency", type=int, default=8, help="Одновременных клиентов")
+        parser.add_argument(
+            "--latency", type=float, default=0.05,
+            help="Задержка ответа заглушки провайдера, секунды",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed синтетических данных")
+        parser.add_argument("--output", "-o", help="Файл результата; по умолчанию стандартный вывод")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [parse_size(value) for value in options["rows"] or ["1k"]]
+        except ValueError as e:
+            raise CommandError(f"Некорректный размер истории: {e}") from e
+        endpoints = options["endpoints"] or list(ENDPOINTS)
+        servers = options["servers"] or ["wsgi", "asgi"]
+        report = {
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "cache": settings.CACHES["default"]["BACKEND"],
+            },
+            "config": {
+                key: options[key]
+                for key in ("requests", "concurrency", "latency", "seed")
+            },
+            "results": {},
+        }
+        with stub_providers(options["latency"]) as server, override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+        ):
+            for rows in sizes:
+                started = time.perf_counter()
+                user = seed_user(rows, options["seed"], progress=self._progress)
+                seed_seconds = round(time.perf_counter() - started, 1)
+                self.stderr.write(f"История {rows} расходов готова за {seed_seconds} с")
+                rates_cache.clear()
+                report["results"][str(rows)] = {
+                    "rows": rows,
+                    "seed_seconds": seed_seconds,
+                    "endpoints": run_benchmark(
+                        user, endpoints, servers,
+                        options["requests"], options["concurrency"], options["seed"],
+                    ),
+                }
+            report["provider_calls"] = dict(server.calls)
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def _progress(self, created, total):
+        self.stderr.write(f"Засеяно {created}/{total}", ending="\r")
@@ -0,0 +1,82 @@
+"""Команда переноса старых чеков в архив и удаления файлов-сирот"""
+
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.retention import archive_receipts, delete_orphans
+
+
+def _megabytes(size):
+    return f"{size / 1024 / 1024:.1f} МБ"
+
+
+class Command(BaseCommand):
+    """Сжимает хранилище изображений чеков"""
+
+    help = (
+        "Пересжимает оригиналы чеков старше RECEIPT_ARCHIVE_AFTER_DAYS и переносит их "
+        "в архивное хранилище, затем удаляет файлы и превью, на которые не ссылается "
+        "ни один расход. Работает порциями; архивирование можно продолжить с --after-id"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days", type=int, default=settings.RECEIPT_ARCHIVE_AFTER_DAYS,
+            help="Переносить в архив чеки, загруженные раньше этого числа дней назад",
+        )
+        parser.add_argument("--batch-size", type=int, default=200, help="Расходов или файлов в порции")
+        parser.add_argument(
+            "--after-id", type=int, default=0,
+            help="Продолжить архивирование с расходов, id которых больше указанного",
+        )
+        parser.add_argument(
+            "--grace-hours", type=int, default=settings.RECEIPT_ORPHAN_GRACE_HOURS,
+            help="Не удалять файлы-сироты моложе этого числа часов",
+        )
+        parser.add_argument("--skip-archive", action="store_true", help="Не переносить чеки в архив")
+        parser.add_argument("--skip-orphans", action="store_true", help="Не удалять файлы-сироты")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Только посчитать, что будет перенесено и удалено",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        dry_run = options["dry_run"]
+        freed = 0
+
+        if not options["skip_archive"]:
+            totals = {"archived": 0, "skipped": 0, "freed": 0, "written": 0}
+            for chunk in archive_receipts(
+                options["older_than_days"], options["batch_size"], options["after_id"], dry_run
+            ):
+                for key in totals:
+                    totals[key] += chunk[key]
+                self.stdout.write(
+                    f"Порция до id {chunk['last_id']}: в архив {chunk['archived']}, "
+                    f"пропущено {chunk['skipped']}, освобождено {_megabytes(chunk['freed'])}, "
+                    f"записано в архив {_megabytes(chunk['written'])}"
+                )
+            freed += totals["freed"] - totals["written"]
+            self.stdout.write(
+                f"Архив: перенесено {totals['archived']} файлов, пропущено {totals['skipped']}, "
+                f"{_megabytes(totals['freed'])} → {_megabytes(totals['written'])}"
+            )
+
+        if not options["skip_orphans"]:
+            totals = {"scanned": 0, "deleted": 0, "freed": 0}
+            for chunk in delete_orphans(options["batch_size"], dry_run, options["grace_hours"]):
+                for key in totals:
+                    totals[key] += chunk[key]
+                self.stdout.write(
+                    f"Порция до {chunk['last_name']}: удалено {chunk['deleted']} "
+                    f"из {chunk['scanned']}, {_megabytes(chunk['freed'])}"
+                )
+            freed += totals["freed"]
+            self.stdout.write(
+                f"Сироты: удалено {totals['deleted']} из {totals['scanned']} файлов, "
+                f"{_megabytes(totals['freed'])}"
+            )
+
+        prefix = "Пробный запуск: можно освободить" if dry_run else "Готово: освобождено"
+        self.stdout.write(f"{prefix} {_megabytes(freed)} за {time.perf_counter() - started:.1f} с")
@@ -0,0 +1,141 @@
+"""Команда сравнения движков распознавания на наборе чеков из media/"""
+
+import json
+from pathlib import Path
+import statistics
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.models import Expense
+from core.receipts import parse_receipt_date
+from core.recognizers import OpenAIRecognizer, TesseractRecognizer
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def _median(values):
+    return round(statistics.median(values), 1) if values else None
+
+
+def _reference(path):
+    """Поля уже проверенного расхода с этим файлом чека, если он есть в БД"""
+    try:
+        name = Path(path).resolve().relative_to(Path(settings.MEDIA_ROOT).resolve()).as_posix()
+    except ValueError:
+        return None
+    expense = (
+        Expense.objects.filter(receipt_image=name, status=Expense.STATUS_DONE)
+        .exclude(amount=None)
+        .first()
+    )
+    if expense is None:
+        return None
+    return {
+        "amount": expense.amount,
+        "expense_date": expense.expense_date,
+        "currency": expense.currency,
+    }
+
+
+def _matches(result, reference):
+    """Совпадение суммы, даты и валюты с эталоном"""
+    return {
+        "amount": result.amount is not None
+        and round(float(result.amount), 2) == round(float(reference["amount"]), 2),
+        "expense_date": result.expense_date == reference["expense_date"],
+        "currency": result.currency == reference["currency"],
+    }
+
+
+class Command(BaseCommand):
+    """Прогоняет чеки через локальный OCR и (по флагу) модель OpenAI"""
+
+    help = (
+        "Сравнивает локальное распознавание с моделью на чеках из media/: "
+        "время, уверенность, доля обращений к модели и точность полей. "
+        "Эталон — сохранённые расходы с тем же файлом чека или ответ модели"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="*",
+            help="Файлы или каталоги с чеками; по умолчанию MEDIA_ROOT",
+        )
+        parser.add_argument(
+            "--remote", action="store_true",
+            help="Распознавать также моделью OpenAI (платные запросы)",
+        )
+        parser.add_argument(
+            "--min-confidence", type=float, default=settings.RECEIPT_LOCAL_MIN_CONFIDENCE,
+            help="Порог уверенности, ниже которого чек уходит в модель",
+        )
+
+    def _images(self, paths):
+        for path in map(Path, paths or [settings.MEDIA_ROOT]):
+            files = path.rglob("*") if path.is_dir() else [path]
+            yield from sorted(f for f in files if f.suffix.lower() in IMAGE_SUFFIXES)
+
+    def handle(self, *args, **options):
+        local = TesseractRecognizer(settings.RECEIPT_OCR_LANG)
+        remote = OpenAIRecognizer() if options["remote"] else None
+        threshold = options["min_confidence"]
+        if not local.available():
+            self.stderr.write("Tesseract недоступен: установите pytesseract и tesseract-ocr")
+
+        rows = []
+        for path in self._images(options["paths"]):
+            row = {"file": str(path)}
+            reference = _reference(path)
+            local_result = None
+            if local.available():
+                started = time.perf_counter()
+                local_result = local.recognize(str(path), {})
+                row["local_ms"] = (time.perf_counter() - started) * 1000
+                row["confidence"] = local_result.confidence
+                row["escalated"] = local_result.confidence < threshold
+            if remote:
+                started = time.perf_counter()
+                remote_result = remote.recognize(str(path), {})
+                row["remote_ms"] = (time.perf_counter() - started) * 1000
+                reference = reference or {
+                    "amount": remote_result.amount,
+                    "expense_date": parse_receipt_date(remote_result.expense_date),
+                    "currency": remote_result.currency,
+                }
+            if local_result and reference:
+                row["local_match"] = _matches(local_result, reference)
+            rows.append(row)
+
+        self.stdout.write(json.dumps(self._summary(rows, threshold), ensure_ascii=False, indent=2))
+
+    def _summary(self, rows, threshold):
+        local_ms = [row["local_ms"] for row in rows if "local_ms" in row]
+        remote_ms = [row["remote_ms"] for row in rows if "remote_ms" in row]
+        escalated = [row for row in rows if row.get("escalated")]
+        accepted = [row for row in rows if "escalated" in row and not row["escalated"]]
+        summary = {
+            "receipts": len(rows),
+            "min_confidence": threshold,
+            "local_median_ms": _median(local_ms),
+            "remote_median_ms": _median(remote_ms),
+            "escalated": len(escalated),
+            "remote_calls_saved": len(accepted),
+        }
+        if remote_ms and local_ms:
+            # Время маршрутизации: локальный OCR всегда, модель — только для эскалированных
+            routed = [
+                row["local_ms"] + (row["remote_ms"] if row["escalated"] else 0)
+                for row in rows if "local_ms" in row and "remote_ms" in row
+            ]
+            summary["routed_median_ms"] = _median(routed)
+        checked = [row for row in accepted if "local_match" in row]
+        if checked:
+            summary["accepted_local_accuracy"] = {
+                field: round(sum(row["local_match"][field] for row in checked) / len(checked), 2)
+                for field in ("amount", "expense_date", "currency")
+            }
+        summary["rows"] = [
+            {key: round(value, 1) if isinstance(value, float) else value for key, value in row.items()}
+            for row in rows
+        ]
+        return summary
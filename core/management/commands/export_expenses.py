@@ -0,0 +1,61 @@
+"""Команда потоковой выгрузки расходов пользователя в файл"""
+
+import sys
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from core.exports import EXPORT_FORMATS, export_expenses
+from core.forms import ExportForm
+from core.models import Expense
+
+
+class Command(BaseCommand):
+    """Выгружает расходы пользователя в CSV, JSON Lines или XLSX"""
+
+    help = (
+        "Выгружает расходы пользователя потоково: строки читаются из БД порциями "
+        "и сразу пишутся в файл, поэтому память не зависит от длины истории"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="Имя пользователя")
+        parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+        parser.add_argument("--date-from", help="Начало периода, ГГГГ-ММ-ДД")
+        parser.add_argument("--date-to", help="Конец периода, ГГГГ-ММ-ДД")
+        parser.add_argument("--category", help="Только расходы этой категории")
+        parser.add_argument(
+            "--output", "-o",
+            help="Файл выгрузки; по умолчанию стандартный вывод",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=settings.EXPORT_CHUNK_SIZE,
+            help="Строк за одно обращение к БД",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist as e:
+            raise CommandError(f"Пользователь {options['username']} не найден") from e
+        form = ExportForm({
+            "date_from": options["date_from"],
+            "date_to": options["date_to"],
+            "category": options["category"],
+            "format": options["format"],
+        })
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+
+        chunks = export_expenses(
+            form.filter(Expense.objects.filter(user=user)), options["format"], options["chunk_size"]
+        )
+        if options["output"]:
+            output = open(options["output"], "wb")  # pylint: disable=consider-using-with
+        else:
+            output = sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        finally:
+            if options["output"]:
+                output.close()
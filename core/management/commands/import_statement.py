@@ -0,0 +1,56 @@
+"""Команда импорта расходов из CSV-выписки банка"""
+
+import json
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from core.statements import StatementError, decode_statement, import_statement
+
+
+class Command(BaseCommand):
+    """Импортирует расходы пользователя из CSV-выписки банка или карты"""
+
+    help = (
+        "Импортирует CSV-выписку: определяет столбцы, пропускает дубли уже сохранённых "
+        "расходов, подбирает категории, сохраняет пачками через bulk_create "
+        "и ставит пересчёт сумм в других валютах в фоновую очередь"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="Имя пользователя")
+        parser.add_argument("path", help="Файл выписки (CSV)")
+        for field, option in [
+            ("expense_date", "--date-column"),
+            ("amount", "--amount-column"),
+            ("currency", "--currency-column"),
+            ("place", "--place-column"),
+            ("category", "--category-column"),
+        ]:
+            parser.add_argument(option, dest=field, help="Название столбца в заголовке выписки")
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.STATEMENT_IMPORT_BATCH_SIZE,
+            help="Расходов в одной пачке bulk_create",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist as e:
+            raise CommandError(f"Пользователь {options['username']} не найден") from e
+        overrides = {
+            field: options[field]
+            for field in ("expense_date", "amount", "currency", "place", "category")
+        }
+        try:
+            with open(options["path"], "rb") as statement:
+                text = decode_statement(statement.read())
+            stats = import_statement(
+                user,
+                text,
+                overrides=overrides,
+                batch_size=options["batch_size"],
+                progress=lambda done, total: self.stdout.write(f"Сохранено {done} из {total}"),
+            )
+        except (OSError, StatementError) as e:
+            raise CommandError(str(e)) from e
+        self.stdout.write(json.dumps(stats, ensure_ascii=False))
@@ -0,0 +1,160 @@
+"""Команда сравнения пропускной способности загрузки чеков под WSGI и ASGI"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+import uuid
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from core.benchmarks import percentile, random_receipt, upload_file
+from core.jobs import AsyncWorkerPool, WorkerPool
+from core.media import preview_name
+from core.models import Expense
+from core.rates import rates_cache
+from core.stubs import stub_providers
+
+
+def _report(upload_seconds, latencies, statuses, recognition_seconds, count):
+    return {
+        "upload_seconds": round(upload_seconds, 3),
+        "uploads_per_second": round(count / upload_seconds, 1),
+        "upload_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "upload_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "errors": sum(1 for status in statuses if status != 302),
+        "recognition_seconds": round(recognition_seconds, 3),
+        "receipts_per_second": round(count / recognition_seconds, 1),
+    }
+
+
+class Command(BaseCommand):
+    """Загружает чеки через WSGI- и ASGI-обработчики Django с заглушкой провайдеров"""
+
+    help = (
+        "Нагрузочный тест загрузки и распознавания чеков: WSGI (потоки) против "
+        "ASGI (корутины) с локальной заглушкой OpenAI и курсов валют. "
+        "Создаёт временного пользователя и удаляет его данные после прогона"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--uploads", type=int, default=200, help="Чеков на каждый прогон")
+        parser.add_argument(
+            "--concurrency", type=int, default=20,
+            help="Одновременных запросов загрузки",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0.2,
+            help="Задержка ответа заглушки провайдера, секунды",
+        )
+        parser.add_argument(
+            "--threads", type=int, default=settings.PROVIDER_CONCURRENCY["openai"],
+            help="Потоков обработчика очереди в прогоне WSGI",
+        )
+        parser.add_argument(
+            "--tasks", type=int, default=settings.ASYNC_PROVIDER_CONCURRENCY["openai"],
+            help="Корутин обработчика очереди в прогоне ASGI",
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(f"loadtest-{uuid.uuid4().hex[:12]}")
+        count = options["uploads"]
+        results = {
+            "uploads": count,
+            "concurrency": options["concurrency"],
+            "provider_latency": options["latency"],
+        }
+        try:
+            with stub_providers(options["latency"]) as server, override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+            ):
+                rates_cache.clear()
+                results["wsgi"] = self._run_wsgi(user, count, options)
+                results["wsgi"]["recognition_workers"] = options["threads"]
+                rates_cache.clear()
+                with override_settings(ROOT_URLCONF="budgetlens.asgi_urls"):
+                    results["asgi"] = asyncio.run(self._run_asgi(user, count, options))
+                results["asgi"]["recognition_workers"] = options["tasks"]
+                results["provider_calls"] = dict(server.calls)
+        finally:
+            self._cleanup(user)
+        self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+
+    def _run_wsgi(self, user, count, options):
+        """Загрузка через WSGIHandler в потоках, распознавание пулом потоков"""
+        receipts = [random_receipt() for _ in range(count)]
+        clients = []
+        for _ in range(options["concurrency"]):
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+
+        def upload(index):
+            client = clients[index % len(clients)]
+            started = time.perf_counter()
+            response = client.post(
+                "/core/upload/", {"receipt_image": upload_file(index, receipts[index])}
+            )
+            return response.status_code, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            responses = list(executor.map(upload, range(count)))
+        upload_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        WorkerPool(concurrency={"openai": options["threads"]}, poll_interval=0.05).run(once=True)
+        recognition_seconds = time.perf_counter() - started
+        return _report(
+            upload_seconds,
+            [latency for _, latency in responses],
+            [status for status, _ in responses],
+            recognition_seconds,
+            count,
+        )
+
+    async def _run_asgi(self, user, count, options):
+        """Загрузка через ASGIHandler в одном loop, распознавание корутинами"""
+        receipts = [random_receipt() for _ in range(count)]
+        indexes = iter(range(count))
+        responses = []
+
+        async def uploader():
+            client = AsyncClient()
+            await client.aforce_login(user)
+            for index in indexes:
+                started = time.perf_counter()
+                response = await client.post(
+                    "/core/upload/", {"receipt_image": upload_file(index, receipts[index])}
+                )
+                responses.append((response.status_code, time.perf_counter() - started))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(uploader() for _ in range(options["concurrency"])))
+        upload_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await AsyncWorkerPool(concurrency={"openai": options["tasks"]}, poll_interval=0.05).run(
+            once=True
+        )
+        recognition_seconds = time.perf_counter() - started
+        return _report(
+            upload_seconds,
+            [latency for _, latency in responses],
+            [status for status, _ in responses],
+            recognition_seconds,
+            count,
+        )
+
+    def _cleanup(self, user):
+        """Удаляет файлы и расходы временного пользователя"""
+        expenses = Expense.objects.filter(user=user)
+        storage = Expense._meta.get_field("receipt_image").storage
+        for name in expenses.exclude(receipt_image="").values_list("receipt_image", flat=True):
+            storage.delete(name)
+            for size in settings.RECEIPT_PREVIEW_SIZES:
+                storage.delete(preview_name(name, size))
+        expenses.delete()
+        user.delete()
@@ -0,0 +1,48 @@
+"""Команда запуска фонового обработчика очереди чеков"""
+
+import asyncio
+from django.core.management.base import BaseCommand
+from core.jobs import AsyncWorkerPool, WorkerPool, requeue_failed
+from core.metrics import start_metrics_server
+from core.models import ProcessingJob
+
+
+class Command(BaseCommand):
+    """Разбирает очередь заданий распознавания чеков пулом потоков или в event loop"""
+
+    help = "Запускает фоновую обработку чеков из очереди в БД"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Обработать готовые задания и завершиться",
+        )
+        parser.add_argument(
+            "--requeue-failed", action="store_true",
+            help="Вернуть упавшие задания в очередь перед запуском",
+        )
+        parser.add_argument(
+            "--async", action="store_true", dest="use_async",
+            help="Обрабатывать задания корутинами (лимиты ASYNC_PROVIDER_CONCURRENCY)",
+        )
+        parser.add_argument(
+            "--metrics-port", type=int,
+            help="Отдавать метрики обработчика в формате Prometheus на этом порту",
+        )
+        parser.add_argument(
+            "--metrics-address", default="127.0.0.1",
+            help="Адрес сервера метрик; доступ извне — по METRICS_ALLOWED_IPS или METRICS_TOKEN",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_failed"]:
+            count = requeue_failed(ProcessingJob.objects.all())
+            self.stdout.write(f"Возвращено в очередь заданий: {count}")
+        if options["metrics_port"]:
+            start_metrics_server(options["metrics_port"], options["metrics_address"])
+        pool = AsyncWorkerPool() if options["use_async"] else WorkerPool()
+        self.stdout.write(f"Обработчик запущен, лимиты: {pool.concurrency}")
+        if options["use_async"]:
+            asyncio.run(pool.run(once=options["once"]))
+        else:
+            pool.run(once=options["once"])
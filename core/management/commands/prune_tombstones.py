@@ -0,0 +1,24 @@
+"""Команда очистки старых отметок об удалённых расходах"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    """Удаляет отметки об удалении старше срока хранения"""
+
+    help = (
+        "Удаляет отметки об удалённых расходах старше срока хранения; клиенты "
+        "с более старым курсором синхронизации получат 410 и синхронизируются заново"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days", type=int, default=settings.SYNC_TOMBSTONE_RETENTION_DAYS,
+            help="Срок хранения отметок в днях (по умолчанию SYNC_TOMBSTONE_RETENTION_DAYS)",
+        )
+
+    def handle(self, *args, **options):
+        count = prune_tombstones(options["older_than_days"])
+        self.stdout.write(f"Удалено отметок: {count}")
@@ -0,0 +1,20 @@
+"""Команда пересборки обучающей выборки классификатора категорий"""
+
+from django.core.management.base import BaseCommand
+from core.models import PlaceCategory
+
+
+class Command(BaseCommand):
+    """Пересчитывает счётчики место → категория по сохранённым расходам"""
+
+    help = "Пересобирает обучающую выборку локального классификатора категорий"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="user_ids",
+            help="ID пользователя (можно указать несколько раз); по умолчанию все",
+        )
+
+    def handle(self, *args, **options):
+        count = PlaceCategory.rebuild(options["user_ids"])
+        self.stdout.write(f"Пар место → категория: {count}")
@@ -0,0 +1,20 @@
+"""Команда пересборки помесячной сводки расходов"""
+
+from django.core.management.base import BaseCommand
+from core.models import MonthlySummary
+
+
+class Command(BaseCommand):
+    """Пересобирает сводку по расходам с нуля"""
+
+    help = "Пересобирает помесячную сводку расходов по категориям"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="user_ids",
+            help="ID пользователя (можно указать несколько раз); по умолчанию все",
+        )
+
+    def handle(self, *args, **options):
+        count = MonthlySummary.rebuild(options["user_ids"])
+        self.stdout.write(f"Записей сводки: {count}")
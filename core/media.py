@@ -0,0 +1,166 @@
+"""Хранилище изображений чеков: превью, локальные копии и отдача файлов"""
+
+from contextlib import asynccontextmanager, contextmanager
+import io
+import logging
+import mimetypes
+import os
+import posixpath
+import shutil
+import tempfile
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, storages
+from django.db.models.fields.files import FieldFile
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+log = logging.getLogger(__name__)
+
+PREVIEW_DIR = "previews"
+# Скорость кодирования WebP (0–6): 2 вдвое быстрее умолчания при файле на 3–5% больше
+WEBP_METHOD = 2
+
+
+def has_local_path(storage):
+    """Файлы хранилища лежат на локальном диске (FileSystemStorage), а не только в потоке"""
+    return isinstance(storage, FileSystemStorage)
+
+
+@contextmanager
+def local_path(field_file):
+    """Путь к файлу чека на диске; из удалённого хранилища файл скачивается во временный"""
+    if has_local_path(field_file.storage):
+        yield field_file.path
+        return
+    suffix = os.path.splitext(field_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as local_copy:
+        with field_file.storage.open(field_file.name, "rb") as remote:
+            shutil.copyfileobj(remote, local_copy)
+        local_copy.flush()
+        yield local_copy.name
+
+
+@asynccontextmanager
+async def alocal_path(field_file):
+    """Асинхронная версия local_path: скачивание идёт в отдельном потоке"""
+    manager = local_path(field_file)
+    path = await sync_to_async(manager.__enter__)()
+    try:
+        yield path
+    finally:
+        await sync_to_async(manager.__exit__)(None, None, None)
+
+
+def receipt_file(expense):
+    """Файл чека расхода в его хранилище: основном или архивном"""
+    image = expense.receipt_image
+    if expense.archived_at and image:
+        image = FieldFile(expense, image.field, image.name)
+        image.storage = storages["archive"]
+    return image
+
+
+def delete_receipt(field_file):
+    """Удаляет файл чека и его превью; возвращает число освобождённых байт"""
+    hot = field_file.field.storage
+    names = [(field_file.storage, field_file.name)] + [
+        (hot, preview_name(field_file.name, size)) for size in settings.RECEIPT_PREVIEW_SIZES
+    ]
+    freed = 0
+    for storage, name in names:
+        try:
+            size = storage.size(name)
+            storage.delete(name)
+        except (FileNotFoundError, OSError):
+            continue
+        freed += size
+    log.debug("Удалён файл чека %s: %s байт", field_file.name, freed)
+    return freed
+
+
+def preview_name(image_name, size):
+    """Имя превью в хранилище: previews/<размер>/<путь оригинала>.webp"""
+    stem = os.path.splitext(image_name)[0]
+    return posixpath.join(PREVIEW_DIR, size, f"{stem}.webp")
+
+
+def _render_preview(image, edge):
+    """Уменьшает изображение до edge×edge (на месте) и кодирует его в WebP"""
+    image.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=settings.RECEIPT_PREVIEW_QUALITY, method=WEBP_METHOD)
+    return buffer.getvalue()
+
+
+def make_previews(field_file, sizes=None):
+    """Создаёт недостающие превью чека всех (или указанных) размеров; возвращает их имена.
+
+    Превью всегда лежат в основном хранилище, даже если оригинал уже в архиве.
+    """
+    storage = field_file.field.storage
+    sizes = sizes or list(settings.RECEIPT_PREVIEW_SIZES)
+    names = {size: preview_name(field_file.name, size) for size in sizes}
+    missing = [size for size, name in names.items() if not storage.exists(name)]
+    if not missing:
+        return names
+    largest = max(settings.RECEIPT_PREVIEW_SIZES[size] for size in missing)
+    try:
+        with field_file.storage.open(field_file.name, "rb") as original, Image.open(original) as image:
+            # JPEG декодируется сразу в уменьшенном масштабе
+            image.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            # От большего к меньшему: каждое превью уменьшается из предыдущего
+            for size in sorted(missing, key=settings.RECEIPT_PREVIEW_SIZES.get, reverse=True):
+                content = _render_preview(image, settings.RECEIPT_PREVIEW_SIZES[size])
+                storage.save(names[size], ContentFile(content))
+    except (UnidentifiedImageError, OSError) as e:
+        log.error("Не удалось создать превью %s: %s", field_file.name, e)
+        return {}
+    log.debug("Превью чека %s: %s", field_file.name, missing)
+    return names
+
+
+def ensure_preview(field_file, size):
+    """Имя превью нужного размера; при отсутствии превью создаётся"""
+    name = preview_name(field_file.name, size)
+    if field_file.field.storage.exists(name):
+        return name
+    return make_previews(field_file, [size]).get(size)
+
+
+def serve_media(storage, name):
+    """Ответ с файлом из хранилища: через веб-сервер, редиректом или потоком из Django.
+
+    MEDIA_OFFLOAD='x-accel' отдаёт файл nginx-у (X-Accel-Redirect на
+    MEDIA_ACCEL_PREFIX), 'x-sendfile' — Apache/lighttpd по пути на диске.
+    Для удалённого хранилища (S3) — редирект на подписанную ссылку.
+    """
+    if not storage.exists(name):
+        raise Http404(name)
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    local = has_local_path(storage)
+    # Внутренний location nginx смотрит в MEDIA_ROOT: архив отдаётся иначе
+    in_media_root = local and os.path.abspath(storage.location) == os.path.abspath(
+        settings.MEDIA_ROOT
+    )
+    if in_media_root and settings.MEDIA_OFFLOAD == "x-accel":
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX.rstrip("/") + "/" + name
+    elif local and settings.MEDIA_OFFLOAD == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = storage.path(name)
+    elif not local:
+        response = HttpResponseRedirect(storage.url(name))
+        # Подписанная ссылка истекает, поэтому редирект кэшируется ненадолго
+        response["Cache-Control"] = f"private, max-age={settings.MEDIA_REDIRECT_MAX_AGE}"
+        return response
+    else:
+        response = FileResponse(storage.open(name, "rb"), content_type=content_type)
+    # Имя файла не меняется при правке расхода, поэтому содержимое можно кэшировать надолго
+    response["Cache-Control"] = f"private, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable"
+    return response
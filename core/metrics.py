@@ -0,0 +1,357 @@
+"""Метрики горячего пути в формате Prometheus и структурированные логи запросов.
+
+Счётчики и гистограммы живут в памяти процесса: веб-процесс отдаёт их на
+/metrics, обработчик очереди — на своём порту (process_receipts --metrics-port).
+Несколько веб-процессов складывают метрики через файлы в METRICS_DIR.
+Участки кода, выполненные во время запроса, попадают и в его запись в логе.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import contextvars
+import hmac
+import http.server
+import json
+import logging
+import os
+import random
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+log = logging.getLogger(__name__)
+request_log = logging.getLogger("core.requests")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Имя метрики: (тип, описание)
+METRICS = {
+    "budgetlens_span_seconds": ("histogram", "Длительность участков горячего пути"),
+    "budgetlens_request_seconds": ("histogram", "Длительность HTTP-запросов по вьюшкам"),
+    "budgetlens_provider_errors_total": ("counter", "Ошибки внешних провайдеров"),
+    "budgetlens_cache_total": ("counter", "Обращения к кэшам: попадания и промахи"),
+    "budgetlens_openai_tokens_total": ("counter", "Токены, израсходованные на запросы к OpenAI"),
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class Registry:
+    """Потокобезопасное хранилище счётчиков и гистограмм процесса"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = defaultdict(float)
+        # (имя, метки) -> [счётчики по корзинам, сумма, количество]
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """Увеличивает счётчик"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, **labels):
+        """Добавляет наблюдение в гистограмму"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        """Все метрики в виде, пригодном для JSON"""
+        with self.lock:
+            return {
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+                "histograms": [
+                    [name, labels, list(counts), total, number]
+                    for (name, labels), (counts, total, number) in self.histograms.items()
+                ],
+            }
+
+    def merge(self, snapshot):
+        """Прибавляет метрики из snapshot() другого процесса"""
+        with self.lock:
+            for name, labels, value in snapshot["counters"]:
+                self.counters[(name, tuple(map(tuple, labels)))] += value
+            for name, labels, counts, total, number in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+                histogram[0] = [mine + theirs for mine, theirs in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] += number
+
+    def clear(self):
+        """Сбрасывает все метрики"""
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(counts), total, number))
+                                for key, (counts, total, number) in self.histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described and name in METRICS:
+                kind, description = METRICS[name]
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_labels(labels)} {_value(value)}")
+        for (name, labels), (counts, total, number) in histograms:
+            describe(name)
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{name}_bucket{_labels(labels, ('le', f'{bound:g}'))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels, ('le', '+Inf'))} {number}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {number}")
+        return "\n".join(lines) + "\n"
+
+
+def _value(value):
+    """Значение счётчика без потери точности: {:g} округлил бы 1234567 до 1.23457e+06"""
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def authorized(remote_addr, authorization):
+    """Клиенту можно читать метрики: адрес из METRICS_ALLOWED_IPS или токен METRICS_TOKEN"""
+    token = settings.METRICS_TOKEN
+    return remote_addr in settings.METRICS_ALLOWED_IPS or bool(
+        token
+        and authorization
+        and hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+    )
+
+
+registry = Registry()
+# Участки и счётчики текущего запроса; None вне запроса (например, в обработчике очереди)
+_current = contextvars.ContextVar("request_metrics", default=None)
+_flushed_at = 0.0
+_flush_lock = threading.Lock()
+
+
+def flush(force=False):
+    """Записывает метрики процесса в METRICS_DIR, не чаще METRICS_FLUSH_INTERVAL"""
+    global _flushed_at  # pylint: disable=global-statement
+    directory = settings.METRICS_DIR
+    if not directory:
+        return
+    with _flush_lock:
+        now = time.monotonic()
+        if not force and now - _flushed_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        _flushed_at = now
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        try:
+            with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(registry.snapshot(), file)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            log.error("Не удалось записать метрики в %s: %s", directory, e)
+
+
+def render():
+    """Метрики веб-процессов в текстовом формате Prometheus.
+
+    Без METRICS_DIR — только текущего процесса. С ним — сумма файлов всех
+    процессов, включая завершившиеся: иначе при каждом опросе случайного
+    процесса счётчики шли бы назад. Текущий процесс тоже читается из своего
+    только что записанного файла, поэтому ни один процесс не показывает свои
+    метрики новее, чем их увидят соседи.
+    """
+    directory = settings.METRICS_DIR
+    if not directory:
+        return registry.render()
+    flush(force=True)
+    combined = Registry(registry.buckets)
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as file:
+                combined.merge(json.load(file))
+        except (OSError, ValueError) as e:
+            log.warning("Пропущен файл метрик %s: %s", name, e)
+    return combined.render()
+
+
+@contextmanager
+def span(name):
+    """Замеряет участок кода: гистограмма budgetlens_span_seconds и запись запроса"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe("budgetlens_span_seconds", elapsed, span=name)
+        current = _current.get()
+        if current is not None:
+            current["spans"][name] = round(current["spans"].get(name, 0) + elapsed * 1000, 2)
+
+
+def count(name, value=1, **labels):
+    """Увеличивает счётчик и отмечает его в записи текущего запроса"""
+    registry.inc(name, value, **labels)
+    current = _current.get()
+    if current is not None:
+        key = ":".join([name.removeprefix("budgetlens_").removesuffix("_total"), *labels.values()])
+        current["counters"][key] = current["counters"].get(key, 0) + value
+
+
+def cache_result(cache_name, hit):
+    """Попадание или промах кэша"""
+    count("budgetlens_cache_total", cache=cache_name, result="hit" if hit else "miss")
+
+
+def provider_error(provider, kind):
+    """Ошибка провайдера: сеть, статус ответа, разомкнутый предохранитель, разбор ответа"""
+    count("budgetlens_provider_errors_total", provider=provider, kind=kind)
+
+
+def record_tokens(response):
+    """Учитывает токены из usage ответа OpenAI"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    model = getattr(response, "model", "") or ""
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if tokens:
+            count("budgetlens_openai_tokens_total", tokens, model=model, kind=kind)
+
+
+def _should_log(status, elapsed_ms):
+    """Ошибки и медленные запросы пишутся всегда, остальные — с долей REQUEST_LOG_SAMPLE_RATE"""
+    return (
+        status >= 500
+        or elapsed_ms >= settings.REQUEST_LOG_SLOW_MS
+        or random.random() < settings.REQUEST_LOG_SAMPLE_RATE
+    )
+
+
+class RequestMetricsMiddleware:
+    """Время запросов по вьюшкам и структурированная запись запроса в лог core.requests"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token, started = self._begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            current = _current.get()
+            _current.reset(token)
+        self._finish(request, response, current, started)
+        return response
+
+    async def __acall__(self, request):
+        token, started = self._begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current = _current.get()
+            _current.reset(token)
+        self._finish(request, response, current, started)
+        return response
+
+    @staticmethod
+    def _begin():
+        return _current.set({"spans": {}, "counters": {}}), time.perf_counter()
+
+    @staticmethod
+    def _finish(request, response, current, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        # Имя маршрута, а не путь: у путей с id неограниченное число значений
+        view = (match.view_name if match else "") or "unresolved"
+        registry.observe(
+            "budgetlens_request_seconds", elapsed,
+            view=view, method=request.method, status=response.status_code,
+        )
+        flush()
+        elapsed_ms = round(elapsed * 1000, 1)
+        if not _should_log(response.status_code, elapsed_ms):
+            return
+        # Только уже загруженный вьюшкой пользователь: лишний запрос к БД (и из
+        # async-контекста) ради лога не нужен
+        user = getattr(request, "_cached_user", None) or getattr(request, "_acached_user", None)
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": response.status_code,
+            "ms": elapsed_ms,
+            "user": user.pk if user is not None and user.is_authenticated else None,
+            "spans": current["spans"],
+            "counters": current["counters"],
+        }
+        request_log.info(json.dumps(record, ensure_ascii=False), extra={"request_metrics": record})
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        # Те же правила доступа, что у вьюшки /metrics
+        if not authorized(self.client_address[0], self.headers.get("Authorization")):
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def start_metrics_server(port, address="127.0.0.1"):
+    """HTTP-сервер метрик в фоновом потоке для процессов без Django-вьюшек.
+
+    По умолчанию слушает только локальный адрес; на других интерфейсах
+    метрики получат адреса из METRICS_ALLOWED_IPS или клиенты с METRICS_TOKEN.
+    """
+    server = http.server.ThreadingHTTPServer((address, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("Метрики доступны на http://%s:%s/metrics", address, port)
+    return server
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-17 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_receiptbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='original_bytes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='payload_bytes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='recognition_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.2 on 2026-10-17 19:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def build_summaries(apps, schema_editor):
+    """Заполняет сводку по уже существующим расходам"""
+    Expense = apps.get_model("core", "Expense")
+    MonthlySummary = apps.get_model("core", "MonthlySummary")
+    groups = (
+        Expense.objects.annotate(month_start=TruncMonth("expense_date"))
+        .values("user_id", "month_start", "category")
+        .annotate(total=Sum("amount_in_target_currency"), count=Count("id"))
+        .order_by()
+    )
+    buckets = {}
+    for group in groups.iterator():
+        month = group["month_start"].strftime("%Y-%m") if group["month_start"] else ""
+        key = (group["user_id"], month, (group["category"] or "").strip().lower())
+        total, count = buckets.get(key, (0, 0))
+        buckets[key] = (total + (group["total"] or 0), count + group["count"])
+    MonthlySummary.objects.bulk_create(
+        (
+            MonthlySummary(user_id=user_id, month=month, category=category, total=total, count=count)
+            for (user_id, month, category), (total, count) in buckets.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_receipt_hashes_recognizedreceipt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.CharField(blank=True, default='', max_length=7)),
+                ('category', models.CharField(blank=True, default='', max_length=100)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'month', 'category'), name='unique_monthly_summary')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
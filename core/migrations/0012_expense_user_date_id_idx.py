@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-17 19:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_monthlysummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'expense_date', 'id'], name='expense_user_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.1.2 on 2026-10-17 19:58
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+BASE_CATEGORIES = [
+    "Жилищные расходы", "Коммунальные услуги", "Транспорт", "Продукты", "Питание вне дома",
+    "Здравоохранение", "Погашение долгов", "Страхование", "Одежда", "Развлечения", "Образование",
+    "Товары для детей", "Уход за животными", "Подписки", "Прочее"
+]
+
+CATEGORY_ALIASES = {
+    "жилье": "Жилищные расходы",
+    "рестораны": "Питание вне дома",
+    "платежи по долгам": "Погашение долгов",
+    "уход за детьми": "Товары для детей",
+    "уход за питомцами": "Уход за животными",
+    "housing": "Жилищные расходы",
+    "utilities": "Коммунальные услуги",
+    "transportation": "Транспорт",
+    "groceries": "Продукты",
+    "dining out": "Питание вне дома",
+    "healthcare": "Здравоохранение",
+    "debt payments": "Погашение долгов",
+    "insurance": "Страхование",
+    "clothing": "Одежда",
+    "entertainment": "Развлечения",
+    "education": "Образование",
+    "childcare": "Товары для детей",
+    "pet care": "Уход за животными",
+    "subscriptions": "Подписки",
+    "miscellaneous": "Прочее",
+}
+
+
+def normalize_category(category):
+    """Копия Expense.normalize_category на момент миграции"""
+    key = " ".join((category or "").split()).casefold()
+    if not key:
+        return None
+    for base_category in BASE_CATEGORIES:
+        if base_category.casefold() == key:
+            return base_category
+    return CATEGORY_ALIASES.get(key, "Прочее")
+
+
+def normalize_categories(apps, schema_editor):
+    """Приводит категории расходов и кэша распознавания к BASE_CATEGORIES и пересобирает сводку"""
+    Expense = apps.get_model("core", "Expense")
+    RecognizedReceipt = apps.get_model("core", "RecognizedReceipt")
+    MonthlySummary = apps.get_model("core", "MonthlySummary")
+    for model in (Expense, RecognizedReceipt):
+        for category in model.objects.values_list("category", flat=True).distinct().order_by():
+            normalized = normalize_category(category)
+            if normalized != category:
+                model.objects.filter(category=category).update(category=normalized)
+
+    groups = (
+        Expense.objects.annotate(month_start=TruncMonth("expense_date"))
+        .values("user_id", "month_start", "category")
+        .annotate(total=Sum("amount_in_target_currency"), count=Count("id"))
+        .order_by()
+    )
+    buckets = {}
+    for group in groups.iterator():
+        month = group["month_start"].strftime("%Y-%m") if group["month_start"] else ""
+        key = (group["user_id"], month, group["category"] or "")
+        total, count = buckets.get(key, (0, 0))
+        buckets[key] = (total + (group["total"] or 0), count + group["count"])
+    MonthlySummary.objects.all().delete()
+    MonthlySummary.objects.bulk_create(
+        (
+            MonthlySummary(user_id=user_id, month=month, category=category, total=total, count=count)
+            for (user_id, month, category), (total, count) in buckets.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_expense_user_date_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_categories, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'category'], name='expense_user_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'created_at'], name='expense_user_created_idx'),
+        ),
+    ]
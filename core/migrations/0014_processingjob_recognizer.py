@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_normalize_category_expense_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='recognizer',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.2 on 2026-10-17 20:15
+
+import django.db.models.deletion
+from django.conf import settings
+import re
+from django.db import migrations, models
+
+PLACE_NOISE = re.compile(r"\b(?:ооо|оао|зао|пао|ао|ип|llc|ltd|inc|gmbh)\b|[\W\d_]+")
+
+
+def build_place_categories(apps, schema_editor):
+    """Заполняет обучающую выборку классификатора по распознанным расходам"""
+    Expense = apps.get_model("core", "Expense")
+    PlaceCategory = apps.get_model("core", "PlaceCategory")
+    counts = {}
+    expenses = (
+        Expense.objects.filter(status="done")
+        .exclude(place=None)
+        .exclude(category=None)
+        .exclude(category="")
+        .values_list("user_id", "place", "category")
+    )
+    for user_id, place, category in expenses.iterator():
+        place_key = " ".join(PLACE_NOISE.sub(" ", place.casefold().replace("ё", "е")).split())[:255]
+        if place_key:
+            key = (user_id, place_key, category)
+            counts[key] = counts.get(key, 0) + 1
+    PlaceCategory.objects.bulk_create(
+        (
+            PlaceCategory(user_id=user_id, place_key=place_key, category=category, count=count)
+            for (user_id, place_key, category), count in counts.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_processingjob_recognizer'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('place_key', models.CharField(max_length=255)),
+                ('category', models.CharField(max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'place_key', 'category'), name='unique_place_category')],
+            },
+        ),
+        migrations.RunPython(build_place_categories, migrations.RunPython.noop),
+    ]
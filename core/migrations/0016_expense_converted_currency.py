@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-17 20:16
+
+from django.db import migrations, models
+
+
+def mark_converted(apps, schema_editor):
+    """До этой миграции суммы всегда пересчитывались в RUB"""
+    Expense = apps.get_model("core", "Expense")
+    Expense.objects.exclude(amount_in_target_currency=None).update(converted_currency="RUB")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_placecategory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='converted_currency',
+            field=models.CharField(blank=True, default='', max_length=3),
+        ),
+        migrations.RunPython(mark_converted, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-17 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_processingjob_user_reconvert'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='source',
+            field=models.CharField(choices=[('receipt', 'Чек'), ('statement', 'Выписка')], default='receipt', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt_image',
+            field=models.ImageField(blank=True, upload_to='cheques/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_expense_source_statement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_expense_archived_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expense',
+            name='source',
+            field=models.CharField(choices=[('receipt', 'Чек'), ('statement', 'Выписка'), ('manual', 'Вручную')], default='receipt', max_length=16),
+        ),
+    ]
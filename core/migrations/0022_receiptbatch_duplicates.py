@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_expensetombstone_expense_user_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receiptbatch',
+            name='duplicates',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
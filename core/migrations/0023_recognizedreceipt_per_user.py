@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_receiptbatch_duplicates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recognizedreceipt',
+            name='content_hash',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='recognizedreceipt',
+            constraint=models.UniqueConstraint(fields=('user', 'content_hash'), name='unique_recognized_receipt'),
+        ),
+    ]
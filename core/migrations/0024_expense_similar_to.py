@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_recognizedreceipt_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='similar_to',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.expense'),
+        ),
+    ]
@@ -1,24 +1,95 @@
 """Этот модуль содержит модели для основного приложения."""
-from django.db import models
+from collections import Counter
+from contextlib import contextmanager
+import contextvars
+import datetime
+import re
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.utils import timezone
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from .caching import invalidate_dashboard
+from .media import delete_receipt, receipt_file
+
+class ReceiptBatch(models.Model):
+    """Пакетная загрузка нескольких чеков за один запрос"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Файлы пачки, пропущенные как уже загруженные чеки
+    duplicates = models.PositiveIntegerField(default=0)
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"Пакет #{self.pk} от {self.created_at:%d.%m.%Y %H:%M}"
+
 
 class Expense(models.Model):
     """Модель для хранения данных о расходах"""
+    # Статусы фоновой обработки чека
+    STATUS_PENDING = "pending"
+    STATUS_PROCESSING = "processing"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "В очереди"),
+        (STATUS_PROCESSING, "Обрабатывается"),
+        (STATUS_DONE, "Обработан"),
+        (STATUS_FAILED, "Ошибка обработки"),
+    ]
+
+    # Откуда расход: снимок чека, импорт выписки или ввод через API (у двух последних нет изображения)
+    SOURCE_RECEIPT = "receipt"
+    SOURCE_STATEMENT = "statement"
+    SOURCE_MANUAL = "manual"
+    SOURCE_CHOICES = [
+        (SOURCE_RECEIPT, "Чек"),
+        (SOURCE_STATEMENT, "Выписка"),
+        (SOURCE_MANUAL, "Вручную"),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    receipt_image = models.ImageField(upload_to="cheques/")
+    receipt_image = models.ImageField(upload_to="cheques/", blank=True)
+    source = models.CharField(max_length=16, choices=SOURCE_CHOICES, default=SOURCE_RECEIPT)
     expense_date = models.DateField(blank=True, null=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     currency = models.CharField(max_length=3, blank=True, null=True)
     amount_in_target_currency = models.DecimalField(
         max_digits=10, decimal_places=2, blank=True, null=True
     )
+    # Валюта, в которую пересчитана amount_in_target_currency; пусто — не пересчитана
+    converted_currency = models.CharField(max_length=3, blank=True, default="")
     place = models.CharField(max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_DONE)
+    batch = models.ForeignKey(
+        ReceiptBatch, on_delete=models.SET_NULL, related_name="expenses", null=True, blank=True
+    )
+    # Когда оригинал чека перенесён в архивное хранилище (storages["archive"])
+    archived_at = models.DateTimeField(blank=True, null=True)
+    # Хэш содержимого и перцептивный хэш изображения чека для поиска дублей
+    content_hash = models.CharField(max_length=64, blank=True, default="", db_index=True)
+    perceptual_hash = models.CharField(max_length=64, blank=True, default="")
+    # Ранее загруженный похожий чек (перцептивный хэш): возможный дубль, данные из него не берутся
+    similar_to = models.ForeignKey(
+        "self", on_delete=models.SET_NULL, related_name="+", null=True, blank=True
+    )
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            # Курсорная пагинация списка расходов (core.pagination); её префикс
+            # (user, expense_date) обслуживает и фильтры по датам
+            models.Index(fields=["user", "expense_date", "id"], name="expense_user_date_id_idx"),
+            models.Index(fields=["user", "category"], name="expense_user_category_idx"),
+            models.Index(fields=["user", "created_at"], name="expense_user_created_idx"),
+            # Инкрементальная синхронизация (core.sync): изменения после (updated_at, id)
+            models.Index(fields=["user", "updated_at", "id"], name="expense_user_updated_idx"),
+        ]
+
     # Основные категории расходов
     BASE_CATEGORIES = [
         "Жилищные расходы", "Коммунальные услуги", "Транспорт", "Продукты", "Питание вне дома",
@@ -26,6 +97,30 @@ class Expense(models.Model):
         "Товары для детей", "Уход за животными", "Подписки", "Прочее"
     ]
 
+    # Прежние названия категорий (старые версии промпта и миграция 0004)
+    CATEGORY_ALIASES = {
+        "жилье": "Жилищные расходы",
+        "рестораны": "Питание вне дома",
+        "платежи по долгам": "Погашение долгов",
+        "уход за детьми": "Товары для детей",
+        "уход за питомцами": "Уход за животными",
+        "housing": "Жилищные расходы",
+        "utilities": "Коммунальные услуги",
+        "transportation": "Транспорт",
+        "groceries": "Продукты",
+        "dining out": "Питание вне дома",
+        "healthcare": "Здравоохранение",
+        "debt payments": "Погашение долгов",
+        "insurance": "Страхование",
+        "clothing": "Одежда",
+        "entertainment": "Развлечения",
+        "education": "Образование",
+        "childcare": "Товары для детей",
+        "pet care": "Уход за животными",
+        "subscriptions": "Подписки",
+        "miscellaneous": "Прочее",
+    }
+
     # Создание выбора для поля категории
     CATEGORY_CHOICES = [(category, category) for category in BASE_CATEGORIES]
 
@@ -40,12 +135,373 @@ class Expense(models.Model):
     def __str__(self):
         return f"{self.category} - {self.amount} {self.currency} на {self.expense_date}"
 
+    @classmethod
+    def normalize_category(cls, category):
+        """Приводит категорию к одному из BASE_CATEGORIES; пустая остаётся None"""
+        key = " ".join((category or "").split()).casefold()
+        if not key:
+            return None
+        for base_category in cls.BASE_CATEGORIES:
+            if base_category.casefold() == key:
+                return base_category
+        return cls.CATEGORY_ALIASES.get(key, "Прочее")
+
+    def save(self, *args, **kwargs):
+        self.category = self.normalize_category(self.category)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходную группу сводки, чтобы пересчитать её после изменения
+        if {"user_id", "expense_date", "category"} <= set(field_names):
+            instance._summary_bucket = MonthlySummary.bucket_of(instance)
+        # И исходную пару место → категория, чтобы переобучить классификатор после правки
+        if {"user_id", "place", "category", "status"} <= set(field_names):
+            instance._category_pair = PlaceCategory.pair_of(instance)
+        return instance
+
+    @property
+    def is_processing(self):
+        """Чек еще не распознан фоновым обработчиком"""
+        return self.status in (self.STATUS_PENDING, self.STATUS_PROCESSING)
+
+
+class ExpenseTombstone(models.Model):
+    """Отметка об удалённом расходе: клиенты синхронизации удаляют его у себя"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Не внешний ключ: самого расхода уже нет
+    expense_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+    objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "deleted_at", "id"], name="tombstone_user_deleted_idx"),
+            # Очистка старых отметок (prune_tombstones) по всем пользователям
+            models.Index(fields=["deleted_at"], name="tombstone_deleted_idx"),
+        ]
+
+    def __str__(self):
+        return f"Расход #{self.expense_id} удалён {self.deleted_at:%d.%m.%Y %H:%M}"
+
+
+class ProcessingJob(models.Model):
+    """Задание фоновой обработки: распознавание чека и конвертация суммы"""
+    KIND_RECEIPT = "receipt"
+    KIND_RECONVERT = "reconvert"
+    KIND_CHOICES = [
+        (KIND_RECEIPT, "Распознавание чека"),
+        (KIND_RECONVERT, "Пересчёт расходов в новую валюту"),
+    ]
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "В очереди"),
+        (STATUS_RUNNING, "Выполняется"),
+        (STATUS_DONE, "Выполнено"),
+        (STATUS_FAILED, "Ошибка"),
+    ]
+
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES, default=KIND_RECEIPT)
+    expense = models.ForeignKey(
+        Expense, on_delete=models.CASCADE, related_name="jobs", null=True, blank=True
+    )
+    # Пользователь для заданий по всем его расходам (пересчёт в новую валюту)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    # Внешний провайдер, по которому ограничивается число параллельных заданий
+    provider = models.CharField(max_length=32, default="openai")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+    # Размер чека до и после подготовки и время ответа модели распознавания
+    original_bytes = models.PositiveIntegerField(blank=True, null=True)
+    payload_bytes = models.PositiveIntegerField(blank=True, null=True)
+    recognition_ms = models.PositiveIntegerField(blank=True, null=True)
+    # Движок, чей результат принят, и уверенность локального распознавания
+    recognizer = models.CharField(max_length=32, blank=True, default="")
+    confidence = models.FloatField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    objects = models.Manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status}, попыток: {self.attempts})"
+
+    @classmethod
+    def enqueue_reconvert(cls, user_id):
+        """Ставит в очередь пересчёт расходов пользователя в валюту профиля.
+
+        Задание берёт валюту из профиля при запуске и пересчитывает всё, что
+        ещё не пересчитано, поэтому одного в очереди достаточно.
+        """
+        queued = cls.objects.filter(
+            kind=cls.KIND_RECONVERT, user_id=user_id, status=cls.STATUS_QUEUED
+        )
+        if not queued.exists():
+            cls.objects.create(kind=cls.KIND_RECONVERT, user_id=user_id, provider="rates")
+
+
+class RecognizedReceipt(models.Model):
+    """Кэш результата распознавания чека по хэшу изображения; у каждого пользователя свой"""
+    content_hash = models.CharField(max_length=64)
+    perceptual_hash = models.CharField(max_length=64, blank=True, default="")
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    receipt_image = models.CharField(max_length=255)
+    place = models.CharField(max_length=255, null=True, blank=True)
+    category = models.CharField(max_length=100, null=True, blank=True)
+    expense_date = models.DateField(blank=True, null=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    currency = models.CharField(max_length=3, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    objects = models.Manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "created_at"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "content_hash"], name="unique_recognized_receipt"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.place} - {self.amount} {self.currency} ({self.content_hash[:12]})"
+
+
+class MonthlySummary(models.Model):
+    """Сумма и число расходов пользователя за месяц по категории для статистики"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Месяц в формате ГГГГ-ММ; пустая строка — расходы без даты
+    month = models.CharField(max_length=7, blank=True, default="")
+    # Категория из Expense.BASE_CATEGORIES; пустая строка — без категории
+    category = models.CharField(max_length=100, blank=True, default="")
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+    objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "month", "category"], name="unique_monthly_summary"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.month or 'без даты'} {self.category}: {self.total} ({self.count})"
+
+    @staticmethod
+    def bucket_of(expense):
+        """Группа сводки, в которую попадает расход"""
+        month = expense.expense_date.strftime("%Y-%m") if expense.expense_date else ""
+        return expense.user_id, month, expense.category or ""
+
+    @classmethod
+    def refresh(cls, user_id, month, category):
+        """Пересчитывает одну группу сводки по расходам за этот месяц"""
+        expenses = Expense.objects.filter(user_id=user_id)
+        if month:
+            # Диапазон дат, а не __year/__month, чтобы работал индекс по (user, expense_date)
+            year, month_number = map(int, month.split("-"))
+            month_start = datetime.date(year, month_number, 1)
+            next_month = (month_start + datetime.timedelta(days=32)).replace(day=1)
+            expenses = expenses.filter(expense_date__gte=month_start, expense_date__lt=next_month)
+        else:
+            expenses = expenses.filter(expense_date__isnull=True)
+        if category:
+            expenses = expenses.filter(category=category)
+        else:
+            expenses = expenses.filter(Q(category__isnull=True) | Q(category=""))
+        totals = expenses.aggregate(total=Sum("amount_in_target_currency"), count=Count("id"))
+        if totals["count"]:
+            cls.objects.update_or_create(
+                user_id=user_id,
+                month=month,
+                category=category,
+                defaults={"total": totals["total"] or 0, "count": totals["count"]},
+            )
+        else:
+            cls.objects.filter(user_id=user_id, month=month, category=category).delete()
+
+    @classmethod
+    def rebuild(cls, user_ids=None):
+        """Полностью пересобирает сводку для указанных пользователей (или всех)"""
+        expenses = Expense.objects.all()
+        summaries = cls.objects.all()
+        if user_ids is not None:
+            expenses = expenses.filter(user_id__in=user_ids)
+            summaries = summaries.filter(user_id__in=user_ids)
+        groups = (
+            expenses.annotate(month_start=TruncMonth("expense_date"))
+            .values("user_id", "month_start", "category")
+            .annotate(total=Sum("amount_in_target_currency"), count=Count("id"))
+            .order_by()
+        )
+        buckets = {}
+        for group in groups.iterator():
+            month = group["month_start"].strftime("%Y-%m") if group["month_start"] else ""
+            key = (group["user_id"], month, group["category"] or "")
+            total, count = buckets.get(key, (0, 0))
+            buckets[key] = (total + (group["total"] or 0), count + group["count"])
+        with transaction.atomic():
+            summaries.delete()
+            cls.objects.bulk_create(
+                (
+                    cls(user_id=user_id, month=month, category=category, total=total, count=count)
+                    for (user_id, month, category), (total, count) in buckets.items()
+                ),
+                batch_size=1000,
+            )
+        return len(buckets)
+
+
+class PlaceCategory(models.Model):
+    """Сколько расходов пользователя в месте отнесено к категории.
+
+    Обучающая выборка локального классификатора категорий (core.classifier);
+    счётчики не удаляются при обнулении, чтобы классификатор видел изменение.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Название места без организационно-правовой формы, цифр и знаков (key_of)
+    place_key = models.CharField(max_length=255)
+    category = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "place_key", "category"], name="unique_place_category"
+            )
+        ]
+
+    PLACE_NOISE = re.compile(r"\b(?:ооо|оао|зао|пао|ао|ип|llc|ltd|inc|gmbh)\b|[\W\d_]+")
+
+    def __str__(self):
+        return f"{self.place_key} → {self.category} ({self.count})"
+
+    @classmethod
+    def key_of(cls, place):
+        """Нормализованное название места: «ООО "Пятёрочка-123"» → «пятерочка»"""
+        place = (place or "").casefold().replace("ё", "е")
+        return " ".join(cls.PLACE_NOISE.sub(" ", place).split())[:255]
+
+    @classmethod
+    def pair_of(cls, expense):
+        """(пользователь, место, категория) распознанного расхода или None"""
+        key = cls.key_of(expense.place)
+        if expense.status != Expense.STATUS_DONE or not key or not expense.category:
+            return None
+        return expense.user_id, key, expense.category
+
+    @classmethod
+    def record(cls, user_id, place_key, category, delta):
+        """Изменяет счётчик пары место → категория на delta"""
+        rows = cls.objects.filter(user_id=user_id, place_key=place_key, category=category)
+        if delta < 0:
+            rows.filter(count__gte=-delta).update(count=F("count") + delta, updated_at=timezone.now())
+            return
+        _, created = cls.objects.get_or_create(
+            user_id=user_id, place_key=place_key, category=category, defaults={"count": delta}
+        )
+        if not created:
+            rows.update(count=F("count") + delta, updated_at=timezone.now())
+
+    @classmethod
+    def rebuild(cls, user_ids=None):
+        """Пересобирает счётчики по сохранённым расходам указанных пользователей (или всех)"""
+        expenses = Expense.objects.filter(status=Expense.STATUS_DONE).exclude(place=None)
+        counters = cls.objects.all()
+        if user_ids is not None:
+            expenses = expenses.filter(user_id__in=user_ids)
+            counters = counters.filter(user_id__in=user_ids)
+        counts = {}
+        for expense in expenses.only("user_id", "place", "category", "status").iterator():
+            pair = cls.pair_of(expense)
+            if pair:
+                counts[pair] = counts.get(pair, 0) + 1
+        with transaction.atomic():
+            # Обнуляем, а не удаляем: классификаторы в других процессах увидят изменение
+            counters.update(count=0, updated_at=timezone.now())
+            for (user_id, place_key, category), count in counts.items():
+                cls.objects.update_or_create(
+                    user_id=user_id, place_key=place_key, category=category,
+                    defaults={"count": count},
+                )
+        return len(counts)
+
+
+class ExchangeRate(models.Model):
+    """Таблица курсов всех валют к USD на дату (openexchangerates)"""
+    date = models.DateField(unique=True)
+    base = models.CharField(max_length=3, default="USD")
+    rates = models.JSONField()
+    fetched_at = models.DateTimeField(auto_now=True)
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"{self.base} на {self.date}"
+
+
 class UserProfile(models.Model):
     """Модель для хранения данных профиля пользователя"""
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     target_currency = models.CharField(max_length=3, blank=True, null=True, default="RUB")
     objects = models.Manager()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходную валюту, чтобы после смены пересчитать расходы
+        instance._target_currency = instance.__dict__.get("target_currency")
+        return instance
+
+    @classmethod
+    def currency_of(cls, user_id):
+        """Целевая валюта пользователя; RUB, если она не задана"""
+        currency = (
+            cls.objects.filter(user_id=user_id).values_list("target_currency", flat=True).first()
+        )
+        return currency or "RUB"
+
+# Пересчёты из сигналов удаления, отложенные до конца пакетного удаления
+_deferred = contextvars.ContextVar("deferred_delete_updates", default=None)
+
+
+@contextmanager
+def deferred_delete_updates():
+    """Сводка, классификатор, кэш и отметки об удалении — один раз после удаления пачки расходов.
+
+    Без этого каждый удалённый расход пересчитывает свою группу сводки
+    и счётчик классификатора и пишет отметку об удалении отдельными запросами.
+    """
+    pending = {
+        "buckets": set(), "pairs": Counter(), "users": set(), "tombstones": [], "receipts": [],
+    }
+    token = _deferred.set(pending)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+    for bucket in pending["buckets"]:
+        MonthlySummary.refresh(*bucket)
+    for pair, count in pending["pairs"].items():
+        PlaceCategory.record(*pair, -count)
+    ExpenseTombstone.objects.bulk_create(pending["tombstones"])
+    _delete_unshared_receipts(pending["receipts"])
+    for user_id in pending["users"]:
+        transaction.on_commit(lambda user_id=user_id: invalidate_dashboard(user_id))
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Сигнал для создания профиля пользователя при регистрации нового пользователя"""
@@ -56,3 +512,121 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     """Сигнал для сохранения профиля пользователя при обновлении данных пользователя"""
     instance.userprofile.save()
+
+
+@receiver(post_save, sender=UserProfile)
+def reconvert_on_currency_change(sender, instance, created, **kwargs):
+    """Сигнал для фонового пересчёта расходов после смены целевой валюты"""
+    previous = getattr(instance, "_target_currency", None)
+    instance._target_currency = instance.target_currency
+    if created or previous == instance.target_currency:
+        return
+    ProcessingJob.enqueue_reconvert(instance.user_id)
+
+
+@receiver(post_save, sender=Expense)
+def update_summary_on_save(sender, instance, **kwargs):
+    """Сигнал для пересчёта сводки по старой и новой группе сохранённого расхода"""
+    buckets = {MonthlySummary.bucket_of(instance)}
+    previous = getattr(instance, "_summary_bucket", None)
+    if previous:
+        buckets.add(previous)
+    for bucket in buckets:
+        MonthlySummary.refresh(*bucket)
+    instance._summary_bucket = MonthlySummary.bucket_of(instance)
+
+
+@receiver(post_delete, sender=Expense)
+def update_summary_on_delete(sender, instance, **kwargs):
+    """Сигнал для пересчёта сводки после удаления расхода"""
+    pending = _deferred.get()
+    if pending is not None:
+        pending["buckets"].add(MonthlySummary.bucket_of(instance))
+        return
+    MonthlySummary.refresh(*MonthlySummary.bucket_of(instance))
+
+
+@receiver(post_save, sender=Expense)
+def train_category_on_save(sender, instance, **kwargs):
+    """Сигнал для обучения классификатора категорий на сохранённом (или исправленном) расходе"""
+    pair = PlaceCategory.pair_of(instance)
+    previous = getattr(instance, "_category_pair", None)
+    if pair == previous:
+        return
+    if previous:
+        PlaceCategory.record(*previous, -1)
+    if pair:
+        PlaceCategory.record(*pair, 1)
+    instance._category_pair = pair
+
+
+@receiver(post_delete, sender=Expense)
+def untrain_category_on_delete(sender, instance, **kwargs):
+    """Сигнал для исключения удалённого расхода из обучающей выборки"""
+    pair = getattr(instance, "_category_pair", PlaceCategory.pair_of(instance))
+    pending = _deferred.get()
+    if pair and pending is not None:
+        pending["pairs"][pair] += 1
+    elif pair:
+        PlaceCategory.record(*pair, -1)
+
+
+@receiver(post_delete, sender=Expense)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    """Сигнал для отметки об удалении расхода, которую заберёт инкрементальная синхронизация"""
+    if isinstance(origin, User) or getattr(origin, "model", None) is User:
+        # Расходы удаляются вместе с пользователем: синхронизировать некому
+        return
+    tombstone = ExpenseTombstone(user_id=instance.user_id, expense_id=instance.pk)
+    pending = _deferred.get()
+    if pending is not None:
+        pending["tombstones"].append(tombstone)
+        return
+    tombstone.save()
+
+
+@receiver(post_delete, sender=Expense)
+def delete_receipt_files(sender, instance, **kwargs):
+    """Сигнал для удаления файла чека и его превью, если на файл больше не ссылаются"""
+    if not instance.receipt_image.name:
+        return
+    pending = _deferred.get()
+    if pending is not None:
+        pending["receipts"].append(instance)
+        return
+    _delete_unshared_receipts([instance])
+
+
+def _delete_unshared_receipts(expenses):
+    """Удаляет после коммита файлы удалённых расходов, на которые больше не ссылаются.
+
+    Оставшиеся ссылки на все файлы проверяются одним запросом; файл в архиве
+    и в основном хранилище — разные файлы, даже если имя совпадает.
+    """
+    if not expenses:
+        return
+    names = {expense.receipt_image.name for expense in expenses}
+    shared = {
+        (name, archived_at is None)
+        for name, archived_at in Expense.objects.filter(receipt_image__in=names)
+        .values_list("receipt_image", "archived_at")
+    }
+    receipts = {}
+    for expense in expenses:
+        key = (expense.receipt_image.name, expense.archived_at is None)
+        if key not in shared and key not in receipts:
+            receipts[key] = receipt_file(expense)
+    for receipt in receipts.values():
+        transaction.on_commit(lambda receipt=receipt: delete_receipt(receipt))
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=UserProfile)
+def invalidate_dashboard_cache(sender, instance, **kwargs):
+    """Сигнал для сброса кэша дашборда после изменения расходов или целевой валюты"""
+    pending = _deferred.get()
+    if pending is not None:
+        pending["users"].add(instance.user_id)
+        return
+    transaction.on_commit(lambda: invalidate_dashboard(instance.user_id))
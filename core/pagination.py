@@ -0,0 +1,52 @@
+"""Курсорная (keyset) пагинация расходов по (expense_date, id)"""
+
+import base64
+import datetime
+from django.db.models import F, Q
+
+
+# Сначала расходы без даты (ещё не распознанные чеки), затем новые сверху.
+# DESC NULLS FIRST — обратный обход индекса (user, expense_date, id) на Expense
+EXPENSE_ORDERING = (F("expense_date").desc(nulls_first=True), F("id").desc())
+
+
+class InvalidCursor(ValueError):
+    """Курсор не удалось разобрать"""
+
+
+def encode_cursor(expense):
+    """Курсор, указывающий на позицию сразу после расхода"""
+    date = expense.expense_date.isoformat() if expense.expense_date else ""
+    return base64.urlsafe_b64encode(f"{date}|{expense.id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор в пару (дата или None, id)"""
+    try:
+        date, expense_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return (datetime.date.fromisoformat(date) if date else None), int(expense_id)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def paginate_expenses(expenses, cursor=None, limit=50):
+    """Возвращает страницу расходов после курсора и курсор следующей страницы.
+
+    Условие на курсор сравнивает только (expense_date, id), поэтому запрос
+    остаётся ограниченным при любой длине истории.
+    """
+    expenses = expenses.order_by(*EXPENSE_ORDERING)
+    if cursor:
+        date, expense_id = decode_cursor(cursor)
+        if date is None:
+            expenses = expenses.filter(
+                Q(expense_date__isnull=True, id__lt=expense_id)
+                | Q(expense_date__isnull=False)
+            )
+        else:
+            expenses = expenses.filter(
+                Q(expense_date__lt=date) | Q(expense_date=date, id__lt=expense_id)
+            )
+    page = list(expenses[: limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
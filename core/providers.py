@@ -0,0 +1,216 @@
+"""HTTP-клиент внешних JSON-провайдеров: пул соединений, повторы и предохранитель"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from .metrics import provider_error
+
+
+log = logging.getLogger(__name__)
+
+# Ответы, после которых имеет смысл повторить запрос
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ProviderError(Exception):
+    """Провайдер не вернул корректный ответ"""
+
+
+class ProviderUnavailable(ProviderError):
+    """Предохранитель разомкнут: провайдер недавно отказывал, запрос не отправлялся"""
+
+
+class CircuitBreaker:
+    """Потокобезопасный предохранитель.
+
+    После failure_threshold отказов подряд размыкается на reset_timeout
+    секунд; затем пропускает один пробный запрос и по его результату
+    замыкается или снова размыкается.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Можно ли отправить запрос сейчас"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        """Успешный ответ замыкает предохранитель"""
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        """Отказ; при достижении порога (или неудачной пробе) размыкает предохранитель"""
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def abandon(self):
+        """Запрос прерван без ответа (отмена, непредвиденная ошибка).
+
+        Если это была проба, предохранитель снова размыкается до следующей
+        пробы; иначе проба осталась бы занятой и провайдер — недоступным
+        до перезапуска процесса.
+        """
+        with self.lock:
+            if self.probing:
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    @property
+    def is_open(self):
+        """Предохранитель разомкнут"""
+        with self.lock:
+            return self.opened_at is not None
+
+
+class ProviderClient:
+    """Клиент провайдера с общим пулом keep-alive соединений для sync и async кода.
+
+    Раздельные таймауты подключения и чтения, повторы с экспоненциальной
+    задержкой и джиттером при сетевых ошибках и 429/5xx, общий для sync и
+    async запросов предохранитель.
+    """
+
+    def __init__(
+        self,
+        name,
+        connect_timeout,
+        read_timeout,
+        retries,
+        backoff,
+        pool_size,
+        failure_threshold,
+        reset_timeout,
+    ):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Асинхронные клиенты по event loop: пул соединений нельзя делить между loop
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def __str__(self):
+        return self.name
+
+    def retry_delay(self, attempt):
+        """Экспоненциальная задержка перед повтором с джиттером, в секундах"""
+        return self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.0)
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            provider_error(self.name, "circuit_open")
+            raise ProviderUnavailable(f"{self.name}: провайдер недоступен, запрос пропущен")
+
+    def _handle_status(self, status_code, text):
+        """True, если ответ успешный; False — можно повторить; иначе ProviderError"""
+        if status_code == 200:
+            self.breaker.record_success()
+            return True
+        provider_error(self.name, f"http_{status_code}")
+        if status_code in RETRY_STATUSES:
+            self.breaker.record_failure()
+            log.warning("%s: ответ %s, повторим запрос", self.name, status_code)
+            return False
+        # Ошибка запроса (ключ, параметры), а не отказ провайдера
+        self.breaker.record_success()
+        raise ProviderError(f"{self.name}: ответ {status_code}: {text[:200]}")
+
+    def get_json(self, url, params=None):
+        """GET с повторами; возвращает разобранный JSON или бросает ProviderError"""
+        last_error = None
+        for attempt in range(1, self.retries + 2):
+            self._check_breaker()
+            try:
+                response = self.session.get(
+                    url, params=params, timeout=(self.connect_timeout, self.read_timeout)
+                )
+            except requests.RequestException as e:
+                self.breaker.record_failure()
+                provider_error(self.name, type(e).__name__)
+                log.warning("%s: ошибка запроса (попытка %s): %s", self.name, attempt, e)
+                last_error = e
+            except BaseException:
+                self.breaker.abandon()
+                raise
+            else:
+                if self._handle_status(response.status_code, response.text):
+                    return response.json()
+                last_error = ProviderError(f"{self.name}: ответ {response.status_code}")
+            if attempt <= self.retries:
+                time.sleep(self.retry_delay(attempt))
+        raise ProviderError(f"{self.name}: попытки исчерпаны: {last_error}") from last_error
+
+    def get_async_client(self):
+        """httpx-клиент с keep-alive пулом для текущего event loop"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def aclose(self):
+        """Закрывает httpx-клиент текущего event loop и его соединения"""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def aget_json(self, url, params=None):
+        """Асинхронная версия get_json"""
+        last_error = None
+        for attempt in range(1, self.retries + 2):
+            self._check_breaker()
+            try:
+                response = await self.get_async_client().get(url, params=params)
+            except httpx.HTTPError as e:
+                self.breaker.record_failure()
+                provider_error(self.name, type(e).__name__)
+                log.warning("%s: ошибка запроса (попытка %s): %s", self.name, attempt, e)
+                last_error = e
+            except BaseException:
+                # В том числе asyncio.CancelledError и httpx.InvalidURL
+                self.breaker.abandon()
+                raise
+            else:
+                if self._handle_status(response.status_code, response.text):
+                    return response.json()
+                last_error = ProviderError(f"{self.name}: ответ {response.status_code}")
+            if attempt <= self.retries:
+                await asyncio.sleep(self.retry_delay(attempt))
+        raise ProviderError(f"{self.name}: попытки исчерпаны: {last_error}") from last_error
@@ -0,0 +1,235 @@
+"""Учёт SQL-запросов на HTTP-запрос: бюджеты вьюшек, дубли и N+1.
+
+Вьюшка объявляет бюджет декоратором query_budget(n). QueryBudgetMiddleware
+считает запросы к БД за время обработки (включая выполненные в потоках
+sync_to_async) и пишет предупреждение, если бюджет превышен, один и тот же
+запрос повторяется с теми же параметрами или один шаблон запроса
+выполняется много раз с разными (признак N+1). В тестах QueryBudgetTestMixin
+проверяет бюджет по ответу тестового клиента.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+import contextvars
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+log = logging.getLogger(__name__)
+
+# Запросы текущего HTTP-запроса: список (sql, params, секунды) или None
+_queries = contextvars.ContextVar("request_queries", default=None)
+# Управление транзакциями повторяется законно и в дубли не попадает
+TRANSACTION_STATEMENTS = ("BEGIN", "SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Вьюшка выполнила больше запросов к БД, чем объявлено (QUERY_BUDGET_STRICT)"""
+
+
+def query_budget(limit, methods=None):
+    """Декоратор вьюшки: не больше limit SQL-запросов на HTTP-запрос.
+
+    methods — HTTP-методы, к которым относится бюджет (по умолчанию все):
+    например, только чтение у вьюшки, которая ещё и меняет данные пачкой.
+    """
+    def decorator(view):
+        view.query_budget = limit
+        view.query_budget_methods = methods
+        return view
+    return decorator
+
+
+def budget_of(view, method=None):
+    """Объявленный бюджет вьюшки для HTTP-метода или None"""
+    methods = getattr(view, "query_budget_methods", None)
+    if method and methods and method not in methods:
+        return None
+    return getattr(view, "query_budget", None)
+
+
+def _record_query(execute, sql, params, many, context):
+    queries = _queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.append((sql, params, time.perf_counter() - started))
+
+
+def _install(connection, **kwargs):
+    """Подключает учёт запросов к соединению (сигнал connection_created)"""
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def install_query_recorder():
+    """Учёт запросов во всех соединениях: уже открытых в этом потоке и будущих"""
+    connection_created.connect(_install, dispatch_uid="core.querybudget")
+    for connection in connections.all(initialized_only=True):
+        _install(connection)
+
+
+class QueryReport:
+    """Запросы одного HTTP-запроса: число, время, дубли и повторы шаблона"""
+
+    def __init__(self, queries, budget=None):
+        self.queries = list(queries)
+        self.budget = budget
+        self.seconds = sum(seconds for _, _, seconds in self.queries)
+        statements = [
+            (sql, params) for sql, params, _ in self.queries
+            if not sql.startswith(TRANSACTION_STATEMENTS)
+        ]
+        # Бюджет считается без управления транзакциями: SQLite шлёт BEGIN отдельным
+        # запросом, PostgreSQL — нет, а в тестах atomic() даёт SAVEPOINT вместо BEGIN.
+        # Так число запросов одинаково на обеих СУБД и в тестах
+        self.count = len(statements)
+        exact = Counter((sql, repr(params)) for sql, params in statements)
+        self.duplicates = [(sql, count) for (sql, _), count in exact.items() if count > 1]
+        templates = Counter(sql for sql, _ in statements)
+        threshold = settings.QUERY_BUDGET_REPEAT_THRESHOLD
+        self.repeated = [(sql, count) for sql, count in templates.items() if count >= threshold]
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.count > self.budget
+
+    def problems(self):
+        """Описания нарушений: превышение бюджета, дубли и N+1"""
+        problems = []
+        if self.over_budget:
+            problems.append(f"{self.count} запросов при бюджете {self.budget}")
+        problems += [f"дубль ×{count}: {sql[:300]}" for sql, count in self.duplicates]
+        problems += [
+            f"возможный N+1 ×{count}: {sql[:300]}"
+            for sql, count in self.repeated
+            if (sql, count) not in self.duplicates
+        ]
+        return problems
+
+
+@contextmanager
+def record_queries():
+    """Собирает SQL-запросы блока кода, в том числе из потоков sync_to_async"""
+    install_query_recorder()
+    queries = []
+    token = _queries.set(queries)
+    try:
+        yield queries
+    finally:
+        _queries.reset(token)
+
+
+class QueryBudgetMiddleware:
+    """Считает SQL-запросы HTTP-запроса и сверяет их с бюджетом вьюшки.
+
+    Включается QUERY_BUDGET_ENABLED (по умолчанию при DEBUG). Число запросов
+    отдаётся в заголовке X-Query-Count (у потокового ответа его нет: запросы
+    идут и после отправки заголовков), отчёт — в response.query_report;
+    при QUERY_BUDGET_STRICT превышение бюджета — ошибка, а не предупреждение.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_BUDGET_ENABLED:
+            raise MiddlewareNotUsed
+        install_query_recorder()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        queries = []
+        token = _queries.set(queries)
+        try:
+            response = self.get_response(request)
+        finally:
+            _queries.reset(token)
+        return self._finish(request, response, queries)
+
+    async def __acall__(self, request):
+        queries = []
+        token = _queries.set(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _queries.reset(token)
+        return self._finish(request, response, queries)
+
+    def _finish(self, request, response, queries):
+        if response.streaming and not response.is_async:
+            # Запросы потокового ответа выполняются при отдаче тела, уже после
+            # вьюшки: они считаются по мере чтения, а бюджет сверяется в конце
+            response.streaming_content = self._counted(
+                request, response, response.streaming_content, queries
+            )
+            return response
+        report = self._check(request, response, queries)
+        response["X-Query-Count"] = str(report.count)
+        return response
+
+    def _counted(self, request, response, content, queries):
+        iterator, done = iter(content), object()
+        while True:
+            token = _queries.set(queries)
+            try:
+                chunk = next(iterator, done)
+            finally:
+                _queries.reset(token)
+            if chunk is done:
+                break
+            yield chunk
+        self._check(request, response, queries)
+
+    @staticmethod
+    def _check(request, response, queries):
+        match = request.resolver_match
+        report = QueryReport(queries, budget_of(match.func, request.method) if match else None)
+        response.query_report = report
+        problems = report.problems()
+        if problems:
+            view = match.view_name if match else request.path
+            log.warning("SQL-запросы %s %s: %s", request.method, view, "; ".join(problems))
+            if report.over_budget and settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(f"{view}: {problems[0]}")
+        return report
+
+
+class QueryBudgetTestMixin:
+    """Проверки для TestCase: запросы ответа укладываются в бюджет вьюшки, без N+1.
+
+    Требует QueryBudgetMiddleware в MIDDLEWARE и QUERY_BUDGET_ENABLED=True
+    на момент создания тестового клиента.
+    """
+
+    def assertQueryBudget(self, response, budget=None):  # pylint: disable=invalid-name
+        """Ответ тестового клиента уложился в бюджет (объявленный у вьюшки или budget).
+
+        Тело потокового ответа дочитывается: его запросы тоже входят в бюджет.
+        """
+        if response.streaming:
+            response.streaming_content = [b"".join(response.streaming_content)]
+        report = getattr(response, "query_report", None)
+        if report is None:
+            self.fail("Нет отчёта о запросах: QueryBudgetMiddleware не включён")
+        if budget is not None:
+            report.budget = budget
+        if report.budget is None:
+            self.fail(f"У вьюшки {response.resolver_match.view_name} не объявлен бюджет запросов")
+        problems = report.problems()
+        if problems:
+            queries = "\n".join(sql for sql, _, _ in report.queries)
+            self.fail("; ".join(problems) + f"\nЗапросы:\n{queries}")
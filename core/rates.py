@@ -0,0 +1,278 @@
+"""Курсы валют и конвертация сумм расходов"""
+
+from collections import OrderedDict
+import datetime
+from decimal import Decimal
+import logging
+import os
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .metrics import cache_result, span
+from .models import ExchangeRate
+from .providers import ProviderClient, ProviderError
+
+
+OPEN_EXCHANGE_RATES_API_KEY = os.getenv("OPEN_EXCHANGE_RATES_API_KEY")
+
+log = logging.getLogger(__name__)
+
+exchange_rates = ProviderClient(
+    "openexchangerates",
+    connect_timeout=settings.EXCHANGE_RATES_CONNECT_TIMEOUT,
+    read_timeout=settings.EXCHANGE_RATES_READ_TIMEOUT,
+    retries=settings.EXCHANGE_RATES_RETRIES,
+    backoff=settings.EXCHANGE_RATES_RETRY_BACKOFF,
+    pool_size=settings.EXCHANGE_RATES_MAX_CONNECTIONS,
+    failure_threshold=settings.EXCHANGE_RATES_CIRCUIT_FAILURES,
+    reset_timeout=settings.EXCHANGE_RATES_CIRCUIT_RESET,
+)
+
+
+def _as_date(date):
+    """Приводит дату (date или строку ISO) к datetime.date"""
+    if isinstance(date, datetime.datetime):
+        return date.date()
+    if isinstance(date, datetime.date):
+        return date
+    return datetime.date.fromisoformat(str(date))
+
+
+def _is_final(date):
+    """Курсы за прошедшие сутки (по UTC) больше не меняются"""
+    return date < timezone.now().date()
+
+
+class RatesTableCache:
+    """Потокобезопасный LRU-кэш таблиц курсов по дате"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.tables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, date):
+        """Таблица курсов на дату или None"""
+        with self.lock:
+            table = self.tables.get(date)
+            if table is not None:
+                self.tables.move_to_end(date)
+            return table
+
+    def put(self, date, table):
+        """Сохраняет таблицу, вытесняя самую давно использованную"""
+        with self.lock:
+            self.tables[date] = table
+            self.tables.move_to_end(date)
+            while len(self.tables) > self.maxsize:
+                self.tables.popitem(last=False)
+
+    def clear(self):
+        """Очищает кэш"""
+        with self.lock:
+            self.tables.clear()
+
+
+rates_cache = RatesTableCache(settings.EXCHANGE_RATES_CACHE_SIZE)
+
+
+def _rates_url(date):
+    return f"{settings.OPEN_EXCHANGE_RATES_API_URL}{date.isoformat()}.json"
+
+
+def fetch_rates_table(date):
+    """Загружает таблицу курсов к USD на дату из openexchangerates"""
+    log.debug("rates : fetch_rates_table()")
+    url = _rates_url(date)
+    log.debug("URL: %s", url)
+    try:
+        return exchange_rates.get_json(url, {"app_id": OPEN_EXCHANGE_RATES_API_KEY})["rates"]
+    except (ProviderError, ValueError, KeyError) as e:
+        log.error("Ошибка при получении курса обмена: %s", e)
+        return None
+
+
+async def aclose_async_client():
+    """Закрывает HTTP-клиент курсов текущего event loop"""
+    await exchange_rates.aclose()
+
+
+async def afetch_rates_table(date):
+    """Асинхронная версия fetch_rates_table"""
+    log.debug("rates : afetch_rates_table()")
+    try:
+        data = await exchange_rates.aget_json(
+            _rates_url(date), {"app_id": OPEN_EXCHANGE_RATES_API_KEY}
+        )
+        return data["rates"]
+    except (ProviderError, ValueError, KeyError) as e:
+        log.error("Ошибка при получении курса обмена: %s", e)
+        return None
+
+
+def _stored_rates(date):
+    """Сохранённая запись курсов на дату и признак, что её можно не обновлять"""
+    stored = ExchangeRate.objects.filter(date=date).first()
+    fresh = bool(stored) and (
+        _is_final(date)
+        or timezone.now() - stored.fetched_at
+        < datetime.timedelta(seconds=settings.EXCHANGE_RATES_TODAY_TTL)
+    )
+    return stored, fresh
+
+
+def _store_rates(date, table):
+    ExchangeRate.objects.update_or_create(date=date, defaults={"rates": table})
+
+
+def _nearest_stored(date):
+    """Сохранённые курсы на ближайшую дату в пределах EXCHANGE_RATES_FALLBACK_DAYS"""
+    window = datetime.timedelta(days=settings.EXCHANGE_RATES_FALLBACK_DAYS)
+    rates = ExchangeRate.objects.filter(date__gte=date - window, date__lte=date + window)
+    before = rates.filter(date__lte=date).order_by("-date").first()
+    after = rates.filter(date__gt=date).order_by("date").first()
+    candidates = [stored for stored in (before, after) if stored]
+    return min(candidates, key=lambda stored: abs(stored.date - date), default=None)
+
+
+def _fallback_table(date, stored):
+    """Таблица, если провайдер не ответил: сохранённая на эту дату или ближайшую"""
+    if stored:
+        log.warning("Используем сохранённые курсы на %s", date)
+        return stored.rates
+    nearest = _nearest_stored(date)
+    if nearest:
+        log.warning("Курсы на %s недоступны, используем курсы на %s", date, nearest.date)
+        return nearest.rates
+    return None
+
+
+def _resolve_table(date, table):
+    """Кладёт в LRU таблицу, полученную для этой даты, если она окончательная"""
+    if table and _is_final(date):
+        rates_cache.put(date, table)
+    return table
+
+
+def get_rates_table(date):
+    """Таблица курсов на дату: сначала LRU в памяти, затем БД, затем API.
+
+    Таблица за прошедшую дату загружается один раз и дальше обслуживает
+    все пары валют; таблица за сегодня обновляется не чаще EXCHANGE_RATES_TODAY_TTL.
+    """
+    date = _as_date(date)
+    table = rates_cache.get(date)
+    cache_result("rates_lru", table is not None)
+    if table is not None:
+        return table
+
+    stored, fresh = _stored_rates(date)
+    cache_result("rates_db", fresh)
+    if fresh:
+        return _resolve_table(date, stored.rates)
+    table = fetch_rates_table(date)
+    if not table:
+        return _fallback_table(date, stored)
+    _store_rates(date, table)
+    return _resolve_table(date, table)
+
+
+async def aget_rates_table(date):
+    """Асинхронная версия get_rates_table; запрос к API не занимает поток"""
+    date = _as_date(date)
+    table = rates_cache.get(date)
+    cache_result("rates_lru", table is not None)
+    if table is not None:
+        return table
+
+    stored, fresh = await sync_to_async(_stored_rates)(date)
+    cache_result("rates_db", fresh)
+    if fresh:
+        return _resolve_table(date, stored.rates)
+    table = await afetch_rates_table(date)
+    if not table:
+        return await sync_to_async(_fallback_table)(date, stored)
+    await sync_to_async(_store_rates)(date, table)
+    return _resolve_table(date, table)
+
+
+def _rates_pair(table, from_currency, to_currency):
+    if not table:
+        return None, None
+    return table.get(from_currency), table.get(to_currency)
+
+
+def get_exchange_rate(date, from_currency, to_currency):
+    """Получить курс обмена для указанной даты и валют"""
+
+    if from_currency == to_currency:
+        return 1, 1
+
+    try:
+        with span("exchange_rate"):
+            table = get_rates_table(date)
+    except ValueError:
+        log.error("Некорректная дата для курса обмена: %s", date)
+        return None, None
+    return _rates_pair(table, from_currency, to_currency)
+
+
+async def aget_exchange_rate(date, from_currency, to_currency):
+    """Асинхронная версия get_exchange_rate"""
+
+    if from_currency == to_currency:
+        return 1, 1
+
+    try:
+        with span("exchange_rate"):
+            table = await aget_rates_table(date)
+    except ValueError:
+        log.error("Некорректная дата для курса обмена: %s", date)
+        return None, None
+    return _rates_pair(table, from_currency, to_currency)
+
+
+def _convert(amount, exchange_rate_to_usd, exchange_rate_to_target):
+    """Пересчёт суммы через USD по паре курсов; None, если курса нет"""
+    log.debug(
+        "Курсы обмена: к USD %s, к целевой валюте %s",
+        exchange_rate_to_usd,
+        exchange_rate_to_target,
+    )
+
+    if not (exchange_rate_to_usd and exchange_rate_to_target):
+        log.error("Не удалось конвертировать сумму в целевую валюту")
+        return None
+
+    exchange_rate_to_usd = Decimal(str(exchange_rate_to_usd))
+    exchange_rate_to_target = Decimal(str(exchange_rate_to_target))
+    amount_decimal = Decimal(str(amount))
+
+    converted_amount_to_usd = amount_decimal / exchange_rate_to_usd
+    converted_amount_to_target = converted_amount_to_usd * exchange_rate_to_target
+    return round(converted_amount_to_target, 2)
+
+
+def convert_with_table(amount, table, from_currency, to_currency):
+    """Конвертирует сумму по уже загруженной таблице курсов; None, если курса нет"""
+    if from_currency == to_currency:
+        return round(Decimal(str(amount)), 2)
+    exchange_rate_to_usd, exchange_rate_to_target = _rates_pair(table, from_currency, to_currency)
+    if not (exchange_rate_to_usd and exchange_rate_to_target):
+        return None
+    return _convert(amount, exchange_rate_to_usd, exchange_rate_to_target)
+
+
+def convert_amount(amount, date, from_currency, to_currency):
+    """Конвертирует сумму в целевую валюту через USD; None, если курс недоступен"""
+    if amount is None or not date or not from_currency:
+        return None
+    return _convert(amount, *get_exchange_rate(date, from_currency, to_currency))
+
+
+async def aconvert_amount(amount, date, from_currency, to_currency):
+    """Асинхронная версия convert_amount"""
+    if amount is None or not date or not from_currency:
+        return None
+    return _convert(amount, *await aget_exchange_rate(date, from_currency, to_currency))
@@ -0,0 +1,285 @@
+"""Распознавание чеков с помощью API OpenAI"""
+
+import asyncio
+import base64
+import datetime
+import json
+import logging
+import threading
+import time
+import weakref
+from openai import AsyncOpenAI, OpenAI, OpenAIError
+from .imaging import prepare_receipt_image
+from .metrics import provider_error, record_tokens, span
+from .models import Expense
+
+
+log = logging.getLogger(__name__)
+# Синхронный клиент создаётся при первом запросе (get_client), а не при импорте:
+# модуль импортируется и без OPENAI_API_KEY, например в миграциях и тестах
+_client = None
+_client_lock = threading.Lock()
+# Асинхронные клиенты по event loop: пул соединений нельзя делить между loop
+_async_clients = weakref.WeakKeyDictionary()
+
+# Форматы дат, которые встречаются в ответах модели
+RECEIPT_DATE_FORMATS = ["%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y", "%d-%m-%y", "%d.%m.%y"]
+
+
+def encode_image(image_bytes):
+    """Кодирует изображение в строку base64"""
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+
+def parse_receipt_date(value):
+    """Приводит дату из ответа модели к datetime.date, если формат распознан"""
+    if not value or isinstance(value, datetime.date):
+        return value or None
+    value = str(value).strip().replace("/", "-")
+    for date_format in RECEIPT_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    log.error("Не удалось распознать дату: %s", value)
+    return None
+
+
+# Категорию модель не определяет: её по месту подбирает локальный классификатор
+# (core.classifier), а промпт без списка категорий короче
+RECEIPT_PROMPT = (
+    "Проанализируйте предоставленный чек и извлеките следующие данные: "
+    "1. Дата: Определите дату транзакции. "
+    "2. Сумма: Извлеките сумму расхода как десятичное число. Обратите внимание: "
+    "- Запятая может быть разделителем тысяч или десятичным разделителем. "
+    "3. Валюта: Определите валюту, использованную в расходе "
+    "(трехсимвольный код валюты по ISO 4217). "
+    "4. Место покупки (например, название магазина, аптеки, ресторана). "
+    "Ответьте строго в формате JSON, "
+    "заканчивая фигурными скобками, без дополнительного языка разметки "
+    'или объяснений. Пример ответа: { "place": "<place>",'
+    ' "date": "<date>", "amount": <amount>,'
+    ' "currency": "<currency>"}'
+)
+
+# Дата и сумма уже известны (например, из фискального QR-кода): нужно только место
+DETAILS_PROMPT = (
+    "Определите по чеку место покупки (название магазина, аптеки, ресторана). "
+    'Ответьте строго в формате JSON без разметки и объяснений: { "place": "<place>"}'
+)
+
+
+def _recognition_request(image_bytes, mime_type, prompt=RECEIPT_PROMPT, max_tokens=None):
+    """Параметры запроса к модели распознавания для подготовленного изображения"""
+    with span("encode_image"):
+        base64_image = encode_image(image_bytes)
+    request = {
+        "model": "gpt-4.1-mini",
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{mime_type};base64,{base64_image}"},
+                    },
+                ],
+            }
+        ],
+        "temperature": 0.2,
+    }
+    if max_tokens:
+        request["max_tokens"] = max_tokens
+    return request
+
+
+def _prepare_image(image_path):
+    with span("prepare_image"):
+        return prepare_receipt_image(image_path)
+
+
+def _complete(request):
+    """Запрос к модели с замером времени, учётом токенов и ошибок"""
+    with span("openai_request"):
+        try:
+            response = get_client().chat.completions.create(**request)
+        except OpenAIError as e:
+            provider_error("openai", type(e).__name__)
+            raise
+    record_tokens(response)
+    return response
+
+
+async def _acomplete(request):
+    """Асинхронная версия _complete"""
+    with span("openai_request"):
+        try:
+            response = await get_async_client().chat.completions.create(**request)
+        except OpenAIError as e:
+            provider_error("openai", type(e).__name__)
+            raise
+    record_tokens(response)
+    return response
+
+
+def _record_stats(image_stats, started, stats):
+    """Записывает время ответа модели и размеры изображения в stats"""
+    image_stats["recognition_ms"] = round((time.perf_counter() - started) * 1000)
+    log.info(
+        "Чек распознан: %s -> %s байт за %s мс",
+        image_stats["original_bytes"],
+        image_stats["payload_bytes"],
+        image_stats["recognition_ms"],
+    )
+    if stats is not None:
+        stats.update(image_stats)
+
+
+def _response_json(response):
+    """JSON из ответа модели, без обёртки ```json"""
+    if (
+        not response
+        or not response.choices
+        or not response.choices[0].message.content
+    ):
+        raise ValueError("Пустой или неверный ответ от API OpenAI")
+
+    content = response.choices[0].message.content.strip()
+    log.debug("Ответ от OpenAI: %s", content)
+
+    if content.startswith("```json") and content.endswith("```"):
+        content = content[7:-3].strip()
+
+    with span("parse_json"):
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            provider_error("openai", "invalid_json")
+            raise
+    if not isinstance(data, dict):
+        provider_error("openai", "invalid_json")
+        raise ValueError("Ответ модели не является JSON-объектом")
+    return data
+
+
+def _parse_response(response):
+    """Разбирает ответ модели в (место, категория, дата, сумма, валюта)"""
+    try:
+        response_data = _response_json(response)
+
+        category = Expense.normalize_category(response_data.get("category")) or "Прочее"
+
+        # Поля, которые модель не нашла на чеке, приходят как null;
+        # дату с «/» приводит parse_receipt_date
+        place = response_data.get("place") or "Неизвестное место"
+        expense_date = response_data.get("date")
+        amount = response_data.get("amount")
+        currency = str(response_data.get("currency") or "").strip().upper() or None
+
+        return place, category, expense_date, amount, currency
+    except json.JSONDecodeError as e:
+        log.error("Ошибка декодирования JSON: %s", e)
+        raise
+    except ValueError as e:
+        log.error("Ошибка значения: %s", e)
+        raise
+    except Exception as e:
+        log.error("Неожиданная ошибка: %s", e)
+        raise
+
+
+def _parse_details(response):
+    """Разбирает ответ модели на DETAILS_PROMPT в (место, категория)"""
+    try:
+        response_data = _response_json(response)
+    except ValueError as e:  # в том числе json.JSONDecodeError
+        log.error("Ошибка разбора ответа: %s", e)
+        raise
+    place = response_data.get("place") or "Неизвестное место"
+    category = Expense.normalize_category(response_data.get("category")) or "Прочее"
+    return place, category
+
+
+def process_receipt(image_path, stats=None):
+    """Обрабатывает изображение чека с помощью API OpenAI.
+
+    Если передан словарь stats, в него записываются размеры изображения
+    до и после подготовки и время ответа модели.
+    """
+    log.debug("receipts : process_receipt()")
+    image_bytes, mime_type, image_stats = _prepare_image(image_path)
+    started = time.perf_counter()
+    response = _complete(_recognition_request(image_bytes, mime_type))
+    _record_stats(image_stats, started, stats)
+    return _parse_response(response)
+
+
+def get_client():
+    """Синхронный клиент OpenAI процесса.
+
+    Создаётся один раз при первом обращении и держит пул keep-alive
+    соединений, общий для всех потоков.
+    """
+    global _client  # pylint: disable=global-statement
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI()
+    return _client
+
+
+def get_async_client():
+    """Асинхронный клиент OpenAI для текущего event loop.
+
+    Клиент держит пул keep-alive соединений и создаётся один раз на loop,
+    с теми же адресом и ключом, что и синхронный клиент get_client().
+    """
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        sync_client = get_client()
+        async_client = AsyncOpenAI(api_key=sync_client.api_key, base_url=sync_client.base_url)
+        _async_clients[loop] = async_client
+    return async_client
+
+
+async def aclose_async_client():
+    """Закрывает асинхронный клиент текущего event loop и его соединения"""
+    async_client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if async_client is not None:
+        await async_client.close()
+
+
+async def aprocess_receipt(image_path, stats=None):
+    """Асинхронная версия process_receipt: запрос к модели не занимает поток"""
+    log.debug("receipts : aprocess_receipt()")
+    image_bytes, mime_type, image_stats = await asyncio.to_thread(_prepare_image, image_path)
+    started = time.perf_counter()
+    response = await _acomplete(_recognition_request(image_bytes, mime_type))
+    _record_stats(image_stats, started, stats)
+    return _parse_response(response)
+
+
+def process_receipt_details(image_path, stats=None):
+    """Определяет по чеку только место (и категорию, если модель её вернула) — короткий запрос"""
+    log.debug("receipts : process_receipt_details()")
+    image_bytes, mime_type, image_stats = _prepare_image(image_path)
+    started = time.perf_counter()
+    response = _complete(
+        _recognition_request(image_bytes, mime_type, DETAILS_PROMPT, max_tokens=60)
+    )
+    _record_stats(image_stats, started, stats)
+    return _parse_details(response)
+
+
+async def aprocess_receipt_details(image_path, stats=None):
+    """Асинхронная версия process_receipt_details"""
+    log.debug("receipts : aprocess_receipt_details()")
+    image_bytes, mime_type, image_stats = await asyncio.to_thread(_prepare_image, image_path)
+    started = time.perf_counter()
+    response = await _acomplete(
+        _recognition_request(image_bytes, mime_type, DETAILS_PROMPT, max_tokens=60)
+    )
+    _record_stats(image_stats, started, stats)
+    return _parse_details(response)
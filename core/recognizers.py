@@ -0,0 +1,384 @@
+"""Движки распознавания чеков и маршрутизация между локальными движками и моделью"""
+
+import asyncio
+from collections import namedtuple
+import datetime
+from decimal import Decimal, InvalidOperation
+import logging
+import os
+import re
+import time
+from django.conf import settings
+from .fiscal import qr_decoder_available, read_fiscal_qr
+from .imaging import load_ocr_image
+from .receipts import (
+    aprocess_receipt,
+    aprocess_receipt_details,
+    parse_receipt_date,
+    process_receipt,
+    process_receipt_details,
+)
+
+try:
+    import pytesseract
+except ImportError:  # локальный OCR необязателен: без него чеки распознаёт модель
+    pytesseract = None
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CATEGORY = "Прочее"
+
+# Вклад каждого найденного поля в уверенность локального распознавания
+CONFIDENCE_WEIGHTS = {"amount": 0.45, "date": 0.25, "currency": 0.15, "place": 0.15}
+
+AMOUNT = r"(\d{1,3}(?:[  ]?\d{3})*[.,]\d{2}|\d+[.,]\d{2})"
+TOTAL_PATTERN = re.compile(
+    r"(?:ИТОГО?|К\s+ОПЛАТЕ|ВСЕГО|TOTAL|AMOUNT\s+DUE)\b[^\d\n]{0,20}" + AMOUNT,
+    re.IGNORECASE,
+)
+AMOUNT_PATTERN = re.compile(AMOUNT)
+DATE_PATTERNS = [
+    re.compile(r"\b(\d{4}-\d{2}-\d{2})\b"),
+    re.compile(r"\b(\d{2}[./-]\d{2}[./-]\d{4})\b"),
+    re.compile(r"\b(\d{2}[./-]\d{2}[./-]\d{2})\b"),
+]
+CURRENCY_CODES = ("RUB", "USD", "EUR", "KZT", "BYN", "GEL", "AMD", "TRY", "UZS", "CNY", "GBP")
+CURRENCY_CODE_PATTERN = re.compile(r"\b(" + "|".join(CURRENCY_CODES) + r")\b")
+CURRENCY_SIGNS = [
+    (re.compile(r"₽|\bруб\b|\bр\.", re.IGNORECASE), "RUB"),
+    (re.compile(r"€"), "EUR"),
+    (re.compile(r"\$"), "USD"),
+    (re.compile(r"₸|\bтенге\b", re.IGNORECASE), "KZT"),
+]
+# Служебные строки в шапке чека, которые не являются названием места
+NOT_PLACE_PATTERN = re.compile(
+    r"КАССОВЫЙ|ЧЕК|ИНН|КАССИР|СМЕНА|ПРИХОД|ДОБРО ПОЖАЛОВАТЬ|WELCOME|RECEIPT",
+    re.IGNORECASE,
+)
+
+
+class RemoteStageError(Exception):
+    """Локальный движок упал на запросе к платному провайдеру.
+
+    Передавать такой чек следующим движкам нельзя: полный запрос к модели
+    оплатил бы тот же чек ещё раз. Ошибка уходит в очередь заданий,
+    которая повторит распознавание позже.
+    """
+
+
+class Recognition(
+    namedtuple(
+        "Recognition",
+        "place category expense_date amount currency confidence recognizer",
+    )
+):
+    """Результат распознавания: поля расхода, уверенность (0..1) и имя движка"""
+
+    __slots__ = ()
+
+    @property
+    def fields(self):
+        """(место, категория, дата, сумма, валюта) как у process_receipt"""
+        return tuple(self[:5])
+
+
+def _parse_amount(value):
+    try:
+        return Decimal(value.replace(" ", "").replace(" ", "").replace(",", "."))
+    except InvalidOperation:
+        return None
+
+
+def _find_amount(text):
+    """Итог по чеку и признак, что он найден по ключевому слову"""
+    totals = [_parse_amount(match) for match in TOTAL_PATTERN.findall(text)]
+    totals = [amount for amount in totals if amount]
+    if totals:
+        # Промежуточные итоги и скидки не больше итоговой суммы
+        return max(totals), True
+    amounts = [_parse_amount(match) for match in AMOUNT_PATTERN.findall(text)]
+    amounts = [amount for amount in amounts if amount]
+    return (max(amounts), False) if amounts else (None, False)
+
+
+def _find_date(text):
+    """Первая правдоподобная дата чека: не в будущем и не раньше 2000 года"""
+    today = datetime.date.today()
+    for pattern in DATE_PATTERNS:
+        for match in pattern.findall(text):
+            date = parse_receipt_date(match)
+            if date and datetime.date(2000, 1, 1) <= date <= today:
+                return date
+    return None
+
+
+def _find_currency(text):
+    match = CURRENCY_CODE_PATTERN.search(text.upper())
+    if match:
+        return match.group(1)
+    for pattern, currency in CURRENCY_SIGNS:
+        if pattern.search(text):
+            return currency
+    return None
+
+
+def _find_place(lines):
+    """Название места: первая содержательная строка шапки чека"""
+    for line in lines[:8]:
+        letters = sum(1 for char in line if char.isalpha())
+        if (
+            letters >= 3
+            and not NOT_PLACE_PATTERN.search(line)
+            and not AMOUNT_PATTERN.search(line)
+        ):
+            return line.strip(" *-=")
+    return None
+
+
+def parse_receipt_text(text, recognizer="text"):
+    """Разбирает текст чека правилами; уверенность — доля найденных полей с весами"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    amount, by_total = _find_amount(text)
+    expense_date = _find_date(text)
+    currency = _find_currency(text)
+    place = _find_place(lines)
+
+    confidence = 0.0
+    if amount is not None:
+        # Сумма без слова «Итог» может оказаться ценой позиции или номером
+        confidence += CONFIDENCE_WEIGHTS["amount"] * (1 if by_total else 0.3)
+    if expense_date:
+        confidence += CONFIDENCE_WEIGHTS["date"]
+    if currency:
+        confidence += CONFIDENCE_WEIGHTS["currency"]
+    if place:
+        confidence += CONFIDENCE_WEIGHTS["place"]
+
+    return Recognition(
+        place=place or "Неизвестное место",
+        category=DEFAULT_CATEGORY,
+        expense_date=expense_date,
+        amount=amount,
+        currency=currency or "RUB",
+        confidence=round(confidence, 2),
+        recognizer=recognizer,
+    )
+
+
+class Recognizer:
+    """Движок распознавания чеков"""
+
+    name = ""
+
+    def available(self):
+        """Движок можно использовать в этом окружении"""
+        return True
+
+    def recognize(self, image_path, stats):
+        """Распознаёт чек; stats дополняется размерами и временем распознавания"""
+        raise NotImplementedError
+
+    async def arecognize(self, image_path, stats):
+        """Асинхронная версия recognize; по умолчанию в отдельном потоке"""
+        return await asyncio.to_thread(self.recognize, image_path, stats)
+
+
+class OpenAIRecognizer(Recognizer):
+    """Распознавание моделью OpenAI; уверенность модели считается полной"""
+
+    name = "openai"
+
+    def recognize(self, image_path, stats):
+        return Recognition(*process_receipt(image_path, stats), 1.0, self.name)
+
+    async def arecognize(self, image_path, stats):
+        return Recognition(*await aprocess_receipt(image_path, stats), 1.0, self.name)
+
+
+class TesseractRecognizer(Recognizer):
+    """Локальный OCR (Tesseract) и разбор текста правилами, без сетевых запросов"""
+
+    name = "tesseract"
+
+    def __init__(self, lang):
+        self.lang = lang
+        self._available = None
+
+    def available(self):
+        if self._available is None:
+            self._available = False
+            if pytesseract is not None:
+                try:
+                    pytesseract.get_tesseract_version()
+                    self._available = True
+                except pytesseract.TesseractNotFoundError:
+                    log.warning("Tesseract не установлен, локальное распознавание отключено")
+        return self._available
+
+    def recognize(self, image_path, stats):
+        started = time.perf_counter()
+        text = pytesseract.image_to_string(load_ocr_image(image_path), lang=self.lang)
+        stats["original_bytes"] = os.path.getsize(image_path)
+        stats["recognition_ms"] = round((time.perf_counter() - started) * 1000)
+        log.debug("Текст чека (OCR): %s", text)
+        result = parse_receipt_text(text, self.name)
+        stats["confidence"] = result.confidence
+        return result
+
+
+class FiscalQRRecognizer(Recognizer):
+    """Фискальный QR-код: дата и сумма декодируются локально за миллисекунды.
+
+    Места по QR-коду не узнать: его определяет короткий запрос к модели
+    (details=True), категорию — классификатор по месту. Если QR-кода на
+    снимке нет, recognize возвращает None.
+    """
+
+    name = "fiscal_qr"
+
+    def __init__(self, details=True):
+        self.details = details
+
+    def available(self):
+        return qr_decoder_available()
+
+    def _read(self, image_path, stats):
+        started = time.perf_counter()
+        fiscal = read_fiscal_qr(image_path)
+        stats["qr_ms"] = round((time.perf_counter() - started) * 1000)
+        stats["original_bytes"] = os.path.getsize(image_path)
+        return fiscal
+
+    def _result(self, fiscal, place, category, stats):
+        stats["confidence"] = 1.0
+        return Recognition(
+            place=place,
+            category=category,
+            expense_date=fiscal["issued_at"].date(),
+            amount=fiscal["amount"],
+            currency=fiscal["currency"],
+            confidence=1.0,
+            recognizer=self.name,
+        )
+
+    def recognize(self, image_path, stats):
+        fiscal = self._read(image_path, stats)
+        if fiscal is None:
+            return None
+        place, category = "Неизвестное место", DEFAULT_CATEGORY
+        if self.details:
+            try:
+                place, category = process_receipt_details(image_path, stats)
+            except Exception as e:
+                raise RemoteStageError(f"{self.name}: {e}") from e
+        return self._result(fiscal, place, category, stats)
+
+    async def arecognize(self, image_path, stats):
+        fiscal = await asyncio.to_thread(self._read, image_path, stats)
+        if fiscal is None:
+            return None
+        place, category = "Неизвестное место", DEFAULT_CATEGORY
+        if self.details:
+            try:
+                place, category = await aprocess_receipt_details(image_path, stats)
+            except Exception as e:
+                raise RemoteStageError(f"{self.name}: {e}") from e
+        return self._result(fiscal, place, category, stats)
+
+
+class RoutingRecognizer(Recognizer):
+    """Локальные движки по очереди; к удалённому — только если ни один не уверен.
+
+    Локальный движок может вернуть None, если чек ему не подходит
+    (например, на снимке нет QR-кода), или результат с низкой уверенностью —
+    тогда чек переходит к следующему. Если движок упал, чек сразу уходит
+    к удалённому, а если упал его запрос к провайдеру (RemoteStageError) —
+    ошибка передаётся в очередь заданий без второго платного запроса.
+    """
+
+    name = "auto"
+
+    def __init__(self, stages, remote, min_confidence):
+        self.stages = stages
+        self.remote = remote
+        self.min_confidence = min_confidence
+
+    def _accepted(self, stage, result):
+        if result is None:
+            return None
+        if result.confidence >= self.min_confidence:
+            return result
+        log.info(
+            "Уверенность %s %.2f ниже %.2f, чек передаётся дальше",
+            stage.name, result.confidence, self.min_confidence,
+        )
+        return None
+
+    def recognize(self, image_path, stats):
+        started = time.perf_counter()
+        result = None
+        for stage in self.stages:
+            if not stage.available():
+                continue
+            try:
+                result = self._accepted(stage, stage.recognize(image_path, stats))
+            except RemoteStageError:
+                log.exception("Ошибка распознавания %s движком %s", image_path, stage.name)
+                raise
+            except Exception:  # pylint: disable=broad-except
+                log.exception(
+                    "Ошибка распознавания %s движком %s, чек передаётся %s",
+                    image_path, stage.name, self.remote.name,
+                )
+                break
+            if result:
+                break
+        result = result or self.remote.recognize(image_path, stats)
+        stats["recognition_ms"] = round((time.perf_counter() - started) * 1000)
+        return result
+
+    async def arecognize(self, image_path, stats):
+        started = time.perf_counter()
+        result = None
+        for stage in self.stages:
+            if not stage.available():
+                continue
+            try:
+                result = self._accepted(stage, await stage.arecognize(image_path, stats))
+            except RemoteStageError:
+                log.exception("Ошибка распознавания %s движком %s", image_path, stage.name)
+                raise
+            except Exception:  # pylint: disable=broad-except
+                log.exception(
+                    "Ошибка распознавания %s движком %s, чек передаётся %s",
+                    image_path, stage.name, self.remote.name,
+                )
+                break
+            if result:
+                break
+        result = result or await self.remote.arecognize(image_path, stats)
+        stats["recognition_ms"] = round((time.perf_counter() - started) * 1000)
+        return result
+
+
+_recognizer = None
+
+
+def get_recognizer():
+    """Движок распознавания по настройке RECEIPT_RECOGNIZER (создаётся один раз)"""
+    global _recognizer  # pylint: disable=global-statement
+    if _recognizer is None:
+        backend = settings.RECEIPT_RECOGNIZER
+        local = TesseractRecognizer(settings.RECEIPT_OCR_LANG)
+        if backend == "openai":
+            _recognizer = OpenAIRecognizer()
+        elif backend == "tesseract":
+            _recognizer = local
+        else:
+            _recognizer = RoutingRecognizer(
+                [FiscalQRRecognizer(details=settings.RECEIPT_QR_DETAILS), local],
+                OpenAIRecognizer(),
+                settings.RECEIPT_LOCAL_MIN_CONFIDENCE,
+            )
+    return _recognizer
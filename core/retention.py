@@ -0,0 +1,191 @@
+"""Хранение изображений чеков: перенос старых оригиналов в архив и удаление файлов-сирот"""
+
+import datetime
+import io
+from itertools import islice
+import logging
+import os
+import posixpath
+import time
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .media import PREVIEW_DIR, make_previews, preview_name
+from .models import Expense
+
+
+log = logging.getLogger(__name__)
+
+RECEIPT_DIR = Expense.receipt_image.field.upload_to.rstrip("/")
+
+
+def _recompress(data):
+    """JPEG архивного качества, уменьшенный до RECEIPT_ARCHIVE_MAX_EDGE по большей стороне"""
+    with Image.open(io.BytesIO(data)) as image:
+        edge = settings.RECEIPT_ARCHIVE_MAX_EDGE
+        image.draft("RGB", (edge, edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        buffer = io.BytesIO()
+        image.save(
+            buffer, format="JPEG", quality=settings.RECEIPT_ARCHIVE_QUALITY,
+            optimize=True, progressive=True,
+        )
+    return buffer.getvalue()
+
+
+def _move_previews(storage, old_name, new_name):
+    """Переименовывает превью, если имя оригинала в архиве изменилось"""
+    for size in settings.RECEIPT_PREVIEW_SIZES:
+        old, new = preview_name(old_name, size), preview_name(new_name, size)
+        if old == new or not storage.exists(old):
+            continue
+        with storage.open(old, "rb") as content:
+            storage.save(new, content)
+        storage.delete(old)
+
+
+def archive_receipt(field_file, dry_run=False):
+    """Переносит оригинал чека в архивное хранилище; возвращает (новое имя, байт до, байт после).
+
+    Оригинал пересжимается, только если это уменьшает файл, иначе копируется
+    как есть. Превью остаются в основном хранилище и создаются заранее, чтобы
+    просмотр архивного чека не обращался к холодному хранилищу.
+    """
+    hot = field_file.storage
+    name = field_file.name
+    with hot.open(name, "rb") as original:
+        data = original.read()
+    original_size = len(data)
+    if dry_run:
+        return name, original_size, original_size
+    make_previews(field_file)
+    try:
+        compressed = _recompress(data)
+    except (UnidentifiedImageError, OSError) as e:
+        log.warning("Не удалось пересжать %s, копируется как есть: %s", name, e)
+        compressed = None
+    if compressed is not None and len(compressed) < len(data):
+        data, name = compressed, os.path.splitext(name)[0] + ".jpg"
+    new_name = storages["archive"].save(name, ContentFile(data))
+    _move_previews(hot, field_file.name, new_name)
+    return new_name, original_size, len(data)
+
+
+def archive_receipts(older_than_days=None, batch_size=200, after_id=0, dry_run=False):
+    """Переносит в архив оригиналы чеков старше older_than_days, порциями по id.
+
+    Генератор: после каждой порции отдаёт статистику и last_id, с которого
+    можно продолжить. Файл, общий для нескольких расходов (дедупликация),
+    переносится один раз и только когда все эти расходы обработаны.
+    """
+    older_than_days = settings.RECEIPT_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = timezone.now() - datetime.timedelta(days=older_than_days)
+    hot = Expense.receipt_image.field.storage
+    candidates = (
+        Expense.objects.filter(archived_at=None, status=Expense.STATUS_DONE, created_at__lt=cutoff)
+        .exclude(receipt_image="")
+        .order_by("id")
+    )
+    while True:
+        started = time.perf_counter()
+        chunk = list(candidates.filter(id__gt=after_id)[:batch_size])
+        if not chunk:
+            return
+        after_id = chunk[-1].id
+        stats = {"scanned": len(chunk), "archived": 0, "skipped": 0, "freed": 0, "written": 0}
+        originals = {expense.receipt_image.name: expense.receipt_image for expense in chunk}
+        for name, field_file in originals.items():
+            sharing = Expense.objects.filter(receipt_image=name, archived_at=None)
+            if sharing.exclude(status=Expense.STATUS_DONE).exists() or not hot.exists(name):
+                stats["skipped"] += 1
+                continue
+            new_name, freed, written = archive_receipt(field_file, dry_run)
+            stats["archived"] += 1
+            stats["freed"] += freed
+            stats["written"] += written
+            if dry_run:
+                continue
+            with transaction.atomic():
+                # updated_at не сдвигаем: клиентам синхронизации перенос в архив не виден
+                sharing.update(receipt_image=new_name, archived_at=timezone.now())
+                # Оригинал удаляется, только когда строки уже ссылаются на архив
+                transaction.on_commit(lambda name=name: hot.delete(name))
+        stats["last_id"] = after_id
+        stats["seconds"] = time.perf_counter() - started
+        log.info("Архивирование чеков до id %s: %s", after_id, stats)
+        yield stats
+
+
+def _walk(storage, path):
+    """Имена файлов каталога хранилища рекурсивно, в порядке сортировки"""
+    try:
+        directories, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    entries = [(name, False) for name in files] + [(name, True) for name in directories]
+    for name, is_directory in sorted(entries):
+        full_name = posixpath.join(path, name)
+        if is_directory:
+            yield from _walk(storage, full_name)
+        else:
+            yield full_name
+
+
+def _referenced_stems(first, last, archived):
+    """Имена без расширения файлов чеков из диапазона [first, last], на которые ссылаются расходы.
+
+    archived: True — только архивные оригиналы, False — только в основном хранилище, None — все.
+    """
+    names = Expense.objects.filter(receipt_image__gte=first, receipt_image__lte=last + "\U0010ffff")
+    if archived is not None:
+        names = names.filter(archived_at__isnull=not archived)
+    names = names.values_list("receipt_image", flat=True)
+    return {os.path.splitext(name)[0] for name in names}
+
+
+def _original_stem(storage_name):
+    """Имя оригинала без расширения для файла чека или его превью"""
+    if storage_name.startswith(PREVIEW_DIR + "/"):
+        # previews/<размер>/<имя оригинала>.webp
+        storage_name = storage_name.split("/", 2)[2]
+    return os.path.splitext(storage_name)[0]
+
+
+def delete_orphans(batch_size=500, dry_run=False, grace_hours=None):
+    """Удаляет файлы чеков и превью, на которые не ссылается ни один расход.
+
+    Обходит основное хранилище (оригиналы и превью) и архив порциями в
+    порядке имён, поэтому не держит в памяти ни список файлов, ни расходы.
+    Файлы моложе RECEIPT_ORPHAN_GRACE_HOURS не трогаются: загрузка могла
+    сохранить файл, но ещё не записать расход.
+    """
+    grace_hours = settings.RECEIPT_ORPHAN_GRACE_HOURS if grace_hours is None else grace_hours
+    cutoff = timezone.now() - datetime.timedelta(hours=grace_hours)
+    hot = Expense.receipt_image.field.storage
+    archive = storages["archive"]
+    roots = [(hot, RECEIPT_DIR, False), (hot, PREVIEW_DIR, None), (archive, RECEIPT_DIR, True)]
+    for storage, root, archived in roots:
+        files = _walk(storage, root)
+        while batch := list(islice(files, batch_size)):
+            started = time.perf_counter()
+            stems = [_original_stem(name) for name in batch]
+            # Превью (archived=None) нужны и расходам с архивным оригиналом
+            referenced = _referenced_stems(min(stems), max(stems), archived)
+            stats = {"scanned": len(batch), "deleted": 0, "freed": 0}
+            for name, stem in zip(batch, stems):
+                if stem in referenced or storage.get_modified_time(name) > cutoff:
+                    continue
+                stats["deleted"] += 1
+                stats["freed"] += storage.size(name)
+                if not dry_run:
+                    storage.delete(name)
+            stats["last_name"] = batch[-1]
+            stats["seconds"] = time.perf_counter() - started
+            log.info("Очистка файлов-сирот до %s: %s", batch[-1], stats)
+            yield stats
@@ -0,0 +1,254 @@
+"""Импорт расходов из CSV-выписок банка или карты пакетами через bulk_create"""
+
+from collections import Counter
+import csv
+import datetime
+from decimal import Decimal, InvalidOperation
+import io
+import logging
+import time
+from django.conf import settings
+from django.db import transaction
+from .caching import invalidate_dashboard
+from .classifier import predict_category
+from .models import Expense, MonthlySummary, PlaceCategory, ProcessingJob, UserProfile
+
+
+log = logging.getLogger(__name__)
+
+_amount_field = Expense._meta.get_field("amount")
+# Шаг и предел суммы по полю Expense.amount (max_digits=10, decimal_places=2)
+AMOUNT_QUANTUM = Decimal(1).scaleb(-_amount_field.decimal_places)
+AMOUNT_LIMIT = Decimal(10) ** (_amount_field.max_digits - _amount_field.decimal_places)
+
+# Названия столбцов в выписках российских и зарубежных банков (в нижнем регистре)
+COLUMN_ALIASES = {
+    "expense_date": [
+        "дата операции", "дата", "дата транзакции", "дата платежа", "date",
+        "transaction date", "booking date", "posted date",
+    ],
+    "amount": [
+        "сумма операции", "сумма", "сумма платежа", "сумма в валюте операции",
+        "amount", "transaction amount", "debit",
+    ],
+    "currency": ["валюта операции", "валюта", "currency"],
+    "place": [
+        "описание", "описание операции", "место", "получатель", "контрагент",
+        "назначение платежа", "description", "merchant", "payee", "details",
+    ],
+    "category": ["категория", "category"],
+}
+REQUIRED_COLUMNS = ("expense_date", "amount")
+DATE_FORMATS = (
+    "%d.%m.%Y", "%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S", "%d/%m/%Y", "%d.%m.%y",
+)
+# Банки отдают выписки в UTF-8 (часто с BOM) или в Windows-1251
+ENCODINGS = ("utf-8-sig", "cp1251")
+
+
+class StatementError(ValueError):
+    """Выписку не удалось разобрать"""
+
+
+def decode_statement(data):
+    """Текст выписки из байтов в первой подходящей кодировке"""
+    for encoding in ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    raise StatementError("Не удалось определить кодировку выписки")
+
+
+def _reader(text):
+    """csv.reader с разделителем, определённым по началу файла"""
+    try:
+        dialect = csv.Sniffer().sniff(text[:8192], delimiters=";,\t|")
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(io.StringIO(text), dialect)
+
+
+def map_columns(header, overrides=None):
+    """Номера столбцов полей расхода по заголовку выписки; overrides — явные названия"""
+    names = [" ".join(column.split()).casefold() for column in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        wanted = [overrides[field].casefold()] if overrides and overrides.get(field) else aliases
+        for alias in wanted:
+            if alias in names:
+                columns[field] = names.index(alias)
+                break
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+    if missing:
+        raise StatementError(f"В выписке не найдены столбцы: {', '.join(missing)}")
+    return columns
+
+
+def parse_date(value, formats=None):
+    """Дата операции в одном из распространённых форматов или None.
+
+    Подошедший формат переносится в начало списка formats: в одной выписке
+    даты записаны одинаково, и остальные строки разбираются с первой попытки.
+    """
+    value = value.strip()
+    formats = formats if formats is not None else list(DATE_FORMATS)
+    for index, date_format in enumerate(formats):
+        try:
+            parsed = datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+        if index:
+            formats.insert(0, formats.pop(index))
+        return parsed
+    return None
+
+
+def parse_amount(value):
+    """Сумма в русском, английском или немецком формате: «-1 234,50», «-1,234.50», «1.234,50».
+
+    Десятичный разделитель — последний из «,» и «.»; другой (и пробелы,
+    апострофы) разделяет разряды. Один и тот же знак, встреченный несколько
+    раз, — разделитель разрядов («1,234,567»). None, если число не разобрано
+    или не помещается в Expense.amount.
+    """
+    value = value.replace("\xa0", "").replace(" ", "").replace("'", "")
+    separators = [separator for separator in (",", ".") if separator in value]
+    decimal_separator = max(separators, key=value.rfind, default=None)
+    if len(separators) == 1 and value.count(decimal_separator) > 1:
+        decimal_separator = None
+    for separator in separators:
+        if separator != decimal_separator:
+            value = value.replace(separator, "")
+    if decimal_separator:
+        value = value.replace(decimal_separator, ".")
+    try:
+        amount = Decimal(value).quantize(AMOUNT_QUANTUM)
+    except InvalidOperation:
+        return None
+    if not amount.is_finite() or abs(amount) >= AMOUNT_LIMIT:
+        return None
+    return amount
+
+
+def read_statement(text, overrides=None, default_currency="RUB"):
+    """Строки выписки: (дата, сумма со знаком, валюта, место, категория) и число пропущенных"""
+    reader = _reader(text)
+    try:
+        columns = map_columns(next(reader), overrides)
+    except StopIteration as e:
+        raise StatementError("Пустая выписка") from e
+
+    def cell(row, field):
+        index = columns.get(field)
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    date_formats = list(DATE_FORMATS)
+    rows, skipped = [], 0
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        expense_date = parse_date(cell(row, "expense_date"), date_formats)
+        amount = parse_amount(cell(row, "amount"))
+        if expense_date is None or amount is None or not amount:
+            skipped += 1
+            continue
+        rows.append((
+            expense_date,
+            amount,
+            (cell(row, "currency") or default_currency).upper()[:3],
+            cell(row, "place")[:255] or None,
+            cell(row, "category"),
+        ))
+    return rows, skipped
+
+
+def _existing_keys(user_id, rows):
+    """Ключи (дата, сумма, место) уже сохранённых расходов за период выписки"""
+    dates = [row[0] for row in rows]
+    existing = (
+        Expense.objects.filter(
+            user_id=user_id, expense_date__gte=min(dates), expense_date__lte=max(dates)
+        )
+        .exclude(amount=None)
+        .values_list("expense_date", "amount", "place")
+        .iterator()
+    )
+    return Counter(
+        (expense_date, amount, PlaceCategory.key_of(place)) for expense_date, amount, place in existing
+    )
+
+
+def import_statement(user, text, overrides=None, batch_size=None, progress=None):
+    """Импортирует расходы из CSV-выписки и возвращает статистику импорта.
+
+    Если в выписке есть отрицательные суммы, расходами считаются только они
+    (положительные — поступления). Строка, совпадающая с уже сохранённым
+    расходом по дате, сумме и месту, пропускается; каждый сохранённый расход
+    гасит только одну строку, поэтому две одинаковые покупки за день не
+    теряются. Категорию подбирает классификатор, затем берётся категория банка.
+    Суммы в валюте профиля переносятся сразу, остальные пересчитывает фоновое
+    задание: курсы на каждую дату выписки не запрашиваются внутри запроса.
+    progress(сохранено, всего) вызывается после каждой пачки bulk_create.
+    """
+    started = time.perf_counter()
+    batch_size = batch_size or settings.STATEMENT_IMPORT_BATCH_SIZE
+    target_currency = UserProfile.currency_of(user.pk)
+    rows, skipped = read_statement(text, overrides)
+    stats = {"rows": len(rows) + skipped, "invalid": skipped, "credits": 0, "duplicates": 0}
+    if any(row[1] < 0 for row in rows):
+        debits = [row for row in rows if row[1] < 0]
+        stats["credits"] = len(rows) - len(debits)
+        rows = [(date, -amount, *rest) for date, amount, *rest in debits]
+
+    existing = _existing_keys(user.pk, rows) if rows else Counter()
+    expenses = []
+    for expense_date, amount, currency, place, bank_category in rows:
+        amount = round(amount, 2)
+        key = (expense_date, amount, PlaceCategory.key_of(place))
+        if existing[key]:
+            existing[key] -= 1
+            stats["duplicates"] += 1
+            continue
+        converted = amount if currency == target_currency else None
+        expenses.append(Expense(
+            user=user,
+            source=Expense.SOURCE_STATEMENT,
+            status=Expense.STATUS_DONE,
+            expense_date=expense_date,
+            amount=amount,
+            currency=currency,
+            place=place,
+            category=(
+                predict_category(user.pk, place) if place else None
+            ) or Expense.normalize_category(bank_category),
+            amount_in_target_currency=converted,
+            converted_currency=target_currency if converted is not None else "",
+        ))
+
+    created = 0
+    for start in range(0, len(expenses), batch_size):
+        batch = expenses[start:start + batch_size]
+        with transaction.atomic():
+            Expense.objects.bulk_create(batch)
+        created += len(batch)
+        if progress:
+            progress(created, len(expenses))
+
+    # bulk_create не отправляет сигналы: сводка, классификатор и кэш обновляются явно
+    with transaction.atomic():
+        for bucket in {MonthlySummary.bucket_of(expense) for expense in expenses}:
+            MonthlySummary.refresh(*bucket)
+        pairs = Counter(filter(None, map(PlaceCategory.pair_of, expenses)))
+        for (user_id, place_key, category), count in pairs.items():
+            PlaceCategory.record(user_id, place_key, category, count)
+    invalidate_dashboard(user.pk)
+
+    stats["imported"] = created
+    stats["converting"] = sum(expense.amount_in_target_currency is None for expense in expenses)
+    if stats["converting"]:
+        ProcessingJob.enqueue_reconvert(user.pk)
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    log.info("Импорт выписки пользователя %s: %s", user.pk, stats)
+    return stats
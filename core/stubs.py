@@ -0,0 +1,116 @@
+"""Заглушки внешних провайдеров (OpenAI, openexchangerates) для нагрузочных тестов"""
+
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+from django.test.utils import override_settings
+from openai import OpenAI
+from . import receipts
+
+
+STUB_RECEIPT = {
+    "place": "Магнит",
+    "category": "Продукты",
+    "date": "2025-04-26",
+    "amount": 100.5,
+    "currency": "USD",
+}
+STUB_RATES = {"USD": 1, "RUB": 80.5, "EUR": 0.92}
+RATES_PATH = re.compile(r"/api/historical/\d{4}-\d{2}-\d{2}\.json")
+
+
+class StubServer(ThreadingHTTPServer):
+    """HTTP-сервер заглушек с задержкой ответа latency секунд"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.latency = latency
+        self.calls = {"chat": 0, "rates": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Отвечает как chat.completions и historical/<дата>.json, с keep-alive"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Ответ модели распознавания с фиксированным чеком"""
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.endswith("/chat/completions"):
+            self._reply(404, {"error": "not found"})
+            return
+        self.server.count("chat")
+        time.sleep(self.server.latency)
+        self._reply(
+            200,
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "gpt-4.1-mini",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": json.dumps(STUB_RECEIPT)},
+                    }
+                ],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            },
+        )
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Таблица курсов к USD на любую дату"""
+        if not RATES_PATH.match(self.path.split("?")[0]):
+            self._reply(404, {"error": "not found"})
+            return
+        self.server.count("rates")
+        time.sleep(self.server.latency)
+        self._reply(200, {"base": "USD", "rates": STUB_RATES})
+
+
+@contextlib.contextmanager
+def stub_providers(latency=0.2):
+    """Подменяет клиентов OpenAI и адрес openexchangerates локальной заглушкой"""
+    server = StubServer(latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stub_client = OpenAI(api_key="stub", base_url=f"{server.base_url}/v1")
+    original_client, receipts._client = receipts._client, stub_client  # pylint: disable=protected-access
+    receipts._async_clients.clear()  # pylint: disable=protected-access
+    try:
+        with override_settings(
+            OPEN_EXCHANGE_RATES_API_URL=f"{server.base_url}/api/historical/"
+        ):
+            yield server
+    finally:
+        receipts._client = original_client  # pylint: disable=protected-access
+        receipts._async_clients.clear()  # pylint: disable=protected-access
+        server.shutdown()
+        server.server_close()
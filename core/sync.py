@@ -0,0 +1,109 @@
+"""Инкрементальная синхронизация расходов: изменения и удаления после курсора клиента.
+
+Курсор — позиция в двух потоках: изменённые расходы по (updated_at, id) и
+отметки об удалении по (deleted_at, id). Оба читаются по индексам
+(user, updated_at, id) и (user, deleted_at, id), поэтому работа сервера
+зависит от числа изменений, а не от длины истории. Когда поток дочитан,
+курсор отступает на SYNC_OVERLAP_SECONDS назад: строки из транзакций,
+закоммиченных позже, но с более ранней меткой времени, придут при следующей
+синхронизации, а уже полученные клиент просто применит повторно.
+"""
+
+import base64
+import datetime
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import Expense, ExpenseTombstone
+
+
+class InvalidSyncCursor(ValueError):
+    """Курсор синхронизации не удалось разобрать"""
+
+
+class SyncCursorExpired(Exception):
+    """Курсор старше хранимых отметок об удалении: нужна полная синхронизация"""
+
+
+def encode_cursor(changed, deleted):
+    """Курсор из позиций (время, id) в потоках изменений и удалений; None — с начала"""
+    parts = []
+    for position in (changed, deleted):
+        moment, row_id = position or (None, 0)
+        parts += [moment.isoformat() if moment else "", str(row_id)]
+    return base64.urlsafe_b64encode("|".join(parts).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор в пару позиций (время или None, id)"""
+    try:
+        changed_at, changed_id, deleted_at, deleted_id = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        )
+        return (
+            (datetime.datetime.fromisoformat(changed_at) if changed_at else None, int(changed_id)),
+            (datetime.datetime.fromisoformat(deleted_at) if deleted_at else None, int(deleted_id)),
+        )
+    except (ValueError, UnicodeError) as e:
+        raise InvalidSyncCursor(cursor) from e
+
+
+def _after(rows, field, position, limit):
+    """Строки после позиции по (field, id), не больше limit + 1"""
+    moment, row_id = position
+    if moment is not None:
+        rows = rows.filter(Q(**{f"{field}__gt": moment}) | Q(**{field: moment, "id__gt": row_id}))
+    return list(rows.order_by(field, "id")[: limit + 1])
+
+
+def _advance(page, field, limit, safe):
+    """Новая позиция потока и признак, что в нём есть ещё строки"""
+    if len(page) > limit:
+        last = page[limit - 1]
+        return (getattr(last, field), last.id), True
+    # Поток дочитан: следующий запрос начнётся с запасом назад
+    return safe, False
+
+
+def changes_since(user, cursor=None, limit=None, columns=None):
+    """Изменённые расходы, id удалённых и курсор следующего запроса.
+
+    Без курсора отдаётся вся история постранично, а удаления — только
+    случившиеся после начала синхронизации. has_more означает, что в одном
+    из потоков остались строки и запрос нужно повторить с новым курсором.
+    """
+    limit = limit or settings.API_PAGE_SIZE
+    now = timezone.now()
+    safe = (now - datetime.timedelta(seconds=settings.SYNC_OVERLAP_SECONDS), 0)
+    if cursor:
+        changed_position, deleted_position = decode_cursor(cursor)
+        retention = datetime.timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+        if deleted_position[0] is None or deleted_position[0] < now - retention:
+            raise SyncCursorExpired(cursor)
+    else:
+        changed_position, deleted_position = (None, 0), safe
+
+    expenses = Expense.objects.filter(user=user)
+    if columns:
+        expenses = expenses.only(*columns, "updated_at")
+    changed = _after(expenses, "updated_at", changed_position, limit)
+    deleted = _after(
+        ExpenseTombstone.objects.filter(user=user).only("id", "expense_id", "deleted_at"),
+        "deleted_at", deleted_position, limit,
+    )
+    changed_position, more_changed = _advance(changed, "updated_at", limit, safe)
+    deleted_position, more_deleted = _advance(deleted, "deleted_at", limit, safe)
+    return {
+        "changed": changed[:limit],
+        "deleted": [tombstone.expense_id for tombstone in deleted[:limit]],
+        "cursor": encode_cursor(changed_position, deleted_position),
+        "has_more": more_changed or more_deleted,
+    }
+
+
+def prune_tombstones(older_than_days=None):
+    """Удаляет отметки об удалении старше срока хранения; возвращает их число"""
+    days = older_than_days if older_than_days is not None else settings.SYNC_TOMBSTONE_RETENTION_DAYS
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    deleted, _ = ExpenseTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
@@ -1,3 +1,990 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import hashlib
+from decimal import Decimal
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+import httpx
+from openai import OpenAIError
+from PIL import Image
+from . import jobs, metrics, views
+from .api import delete_expenses
+from .conversions import convert_in_chunks, needs_conversion
+from .dedup import find_cached_result, find_cached_results
+from .jobs import claim_jobs, prepare_receipt
+from .metrics import Registry, start_metrics_server
+from .models import (
+    Expense, ExpenseTombstone, MonthlySummary, ProcessingJob, ReceiptBatch, RecognizedReceipt,
+    UserProfile,
+)
+from .pagination import paginate_expenses
+from .providers import ProviderClient, ProviderError
+from .receipts import _parse_response, parse_receipt_date
+from .querybudget import QueryBudgetTestMixin
+from .recognizers import (
+    FiscalQRRecognizer, Recognition, Recognizer, RemoteStageError, RoutingRecognizer,
+)
+from .statements import import_statement, parse_amount
+from .sync import encode_cursor as encode_sync_cursor
 
-# Create your tests here.
+
+def make_image(color="white", size=(64, 96), name="receipt.png"):
+    """PNG-файл для загрузки через тестовый клиент"""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    QUERY_BUDGET_ENABLED=True,
+    QUERY_BUDGET_STRICT=False,
+)
+class BudgetlensTestCase(TestCase):
+    """Пользователь с профилем в RUB, вход выполнен; файлы чеков во временном каталоге"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", password="secret")
+        UserProfile.objects.update_or_create(user=self.user, defaults={"target_currency": "RUB"})
+        self.client.force_login(self.user)
+
+
+class ReceiptBatchTests(BudgetlensTestCase):
+    """Пакетная загрузка чеков"""
+
+    def test_duplicates_are_reported(self):
+        files = [make_image("white", name="a.png"), make_image("white", name="b.png"),
+                 make_image("black", name="c.png")]
+        response = self.client.post(reverse("upload_batch"), {"receipt_files": files})
+        batch = ReceiptBatch.objects.get(user=self.user)
+        self.assertRedirects(response, reverse("batch", args=[batch.id]))
+        self.assertEqual(batch.duplicates, 1)
+        self.assertEqual(batch.expenses.count(), 2)
+        page = self.client.get(reverse("batch", args=[batch.id]))
+        self.assertContains(page, "Пропущено уже загруженных чеков: 1")
+
+
+class ReprocessTests(BudgetlensTestCase):
+    """Повторная обработка чека со страницы расхода"""
+
+    def setUp(self):
+        super().setUp()
+        storage = Expense._meta.get_field("receipt_image").storage
+        self.expense = Expense.objects.create(
+            user=self.user, place="Магазин", amount=Decimal("100.00"), currency="RUB",
+            receipt_image=storage.save("cheques/reprocess.png", make_image()),
+        )
+
+    def reprocess(self):
+        response = self.client.post(reverse("reprocess_expense", args=[self.expense.id]))
+        self.assertRedirects(response, reverse("expense", args=[self.expense.id]), fetch_redirect_response=False)
+        self.expense.refresh_from_db()
+
+    def test_failed_receipt_is_requeued(self):
+        Expense.objects.filter(id=self.expense.id).update(status=Expense.STATUS_FAILED)
+        job = ProcessingJob.objects.create(
+            expense=self.expense, status=ProcessingJob.STATUS_FAILED, attempts=5
+        )
+        self.reprocess()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ProcessingJob.STATUS_QUEUED, 0))
+        self.assertEqual(self.expense.status, Expense.STATUS_PENDING)
+        self.assertEqual(self.expense.jobs.count(), 1)
+
+    def test_done_and_queued_receipts_are_left_alone(self):
+        for status in (Expense.STATUS_DONE, Expense.STATUS_PENDING, Expense.STATUS_PROCESSING):
+            with self.subTest(status=status):
+                Expense.objects.filter(id=self.expense.id).update(status=status)
+                self.reprocess()
+                self.assertEqual(self.expense.status, status)
+                self.assertFalse(self.expense.jobs.exists())
+                self.assertEqual(self.expense.amount, Decimal("100.00"))
+
+
+class RecognitionCacheTests(BudgetlensTestCase):
+    """Кэш результатов распознавания по хэшу чека"""
+
+    def remember(self, user, content_hash="a" * 64, **fields):
+        return RecognizedReceipt.objects.create(
+            user=user, content_hash=content_hash, receipt_image="cheques/a.png",
+            place="Магазин", category="Продукты", expense_date=datetime.date(2026, 1, 5),
+            amount=Decimal("100.00"), currency="RUB", **fields,
+        )
+
+    def test_other_users_results_are_not_reused(self):
+        self.remember(User.objects.create_user("stranger"))
+        expense = Expense(user=self.user, content_hash="a" * 64)
+        self.assertIsNone(find_cached_result(expense))
+        self.assertEqual(find_cached_results(self.user.pk, [expense]), [None])
+
+    def test_own_result_is_reused(self):
+        cached = self.remember(self.user)
+        expense = Expense(user=self.user, content_hash="a" * 64)
+        self.assertEqual(find_cached_result(expense), cached)
+
+    def test_similar_receipt_is_flagged_not_reused(self):
+        # Другой чек того же магазина: перцептивный хэш отличается на несколько бит
+        self.remember(self.user, perceptual_hash="f" * 64)
+        earlier = Expense.objects.create(
+            user=self.user, content_hash="a" * 64, perceptual_hash="f" * 64,
+            amount=Decimal("100.00"), status=Expense.STATUS_DONE,
+        )
+        expense = Expense(user=self.user, content_hash="b" * 64, perceptual_hash="e" + "f" * 63)
+        self.assertIsNone(find_cached_result(expense))
+        self.assertEqual(find_cached_results(self.user.pk, [expense]), [None])
+        self.assertFalse(prepare_receipt(expense))
+        self.assertEqual(expense.status, Expense.STATUS_PENDING)
+        self.assertEqual(expense.similar_to, earlier)
+        self.assertIsNone(expense.amount)
+
+    def test_edit_updates_cached_result(self):
+        cached = self.remember(self.user)
+        expense = Expense.objects.create(
+            user=self.user, content_hash="a" * 64, place="Магазин", category="Продукты",
+            expense_date=datetime.date(2026, 1, 5), amount=Decimal("100.00"), currency="RUB",
+            status=Expense.STATUS_DONE,
+        )
+        response = self.client.post(
+            reverse("save_expense", args=[expense.id]),
+            {"place": "Аптека", "category": "Здравоохранение", "expense_date": "2026-01-05",
+             "amount": "250.00", "currency": "RUB"},
+        )
+        self.assertRedirects(response, reverse("expense", args=[expense.id]), fetch_redirect_response=False)
+        cached.refresh_from_db()
+        self.assertEqual((cached.place, cached.amount), ("Аптека", Decimal("250.00")))
+
+    def test_api_edit_forgets_cached_result(self):
+        self.remember(self.user)
+        expense = Expense.objects.create(
+            user=self.user, content_hash="a" * 64, amount=Decimal("100.00"), currency="RUB",
+            expense_date=datetime.date(2026, 1, 5), status=Expense.STATUS_DONE,
+        )
+        response = self.client.patch(
+            reverse("api_expense", args=[expense.id]), {"amount": "250.00"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(RecognizedReceipt.objects.filter(user=self.user).exists())
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """Предохранитель клиента провайдера"""
+
+    def open_client(self):
+        client = ProviderClient(
+            "test", connect_timeout=1, read_timeout=1, retries=0, backoff=0,
+            pool_size=1, failure_threshold=1, reset_timeout=0,
+        )
+        client.breaker.record_failure()
+        self.assertTrue(client.breaker.is_open)
+        return client
+
+    def test_cancelled_probe_is_released(self):
+        client = self.open_client()
+        failing = mock.Mock(get=mock.AsyncMock(side_effect=asyncio.CancelledError))
+        with mock.patch.object(client, "get_async_client", return_value=failing):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(client.aget_json("https://rates.test/"))
+        self.assertFalse(client.breaker.probing)
+        self.assertTrue(client.breaker.allow())
+
+    def test_unexpected_error_in_probe_is_released(self):
+        client = self.open_client()
+        with mock.patch.object(client.session, "get", side_effect=httpx.InvalidURL("bad")):
+            with self.assertRaises(httpx.InvalidURL):
+                client.get_json("https://rates.test/")
+        self.assertTrue(client.breaker.allow())
+
+    def test_successful_probe_closes_breaker(self):
+        client = self.open_client()
+        response = mock.Mock(status_code=200, text="{}", json=lambda: {"rates": {}})
+        with mock.patch.object(client.session, "get", return_value=response):
+            self.assertEqual(client.get_json("https://rates.test/"), {"rates": {}})
+        self.assertFalse(client.breaker.is_open)
+
+
+class StubStage(Recognizer):
+    """Движок с заранее заданным ответом и счётчиком вызовов"""
+
+    def __init__(self, name, result=None, error=None):
+        self.name = name
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def recognize(self, image_path, stats):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def recognition(recognizer, confidence=1.0):
+    return Recognition(
+        "Магазин", "Продукты", datetime.date(2026, 1, 5), Decimal("100.00"), "RUB",
+        confidence, recognizer,
+    )
+
+
+class RoutingRecognizerTests(SimpleTestCase):
+    """Выбор движка распознавания: QR-код, локальный OCR, модель"""
+
+    def route(self, qr, ocr, remote=None):
+        self.remote = remote or StubStage("openai", recognition("openai"))
+        router = RoutingRecognizer([qr, ocr], self.remote, min_confidence=0.85)
+        return router.recognize("receipt.png", {}), asyncio.run(router.arecognize("receipt.png", {}))
+
+    def test_qr_receipt_is_answered_by_qr_stage(self):
+        ocr = StubStage("tesseract", recognition("tesseract"))
+        results = self.route(StubStage("fiscal_qr", recognition("fiscal_qr")), ocr)
+        self.assertEqual([result.recognizer for result in results], ["fiscal_qr"] * 2)
+        self.assertEqual((ocr.calls, self.remote.calls), (0, 0))
+
+    def test_text_receipt_is_answered_by_ocr(self):
+        results = self.route(StubStage("fiscal_qr"), StubStage("tesseract", recognition("tesseract", 0.9)))
+        self.assertEqual([result.recognizer for result in results], ["tesseract"] * 2)
+        self.assertEqual(self.remote.calls, 0)
+
+    def test_image_only_receipt_goes_to_model(self):
+        results = self.route(StubStage("fiscal_qr"), StubStage("tesseract", recognition("tesseract", 0.4)))
+        self.assertEqual([result.recognizer for result in results], ["openai"] * 2)
+        self.assertEqual(self.remote.calls, 2)
+
+    def test_failed_remote_stage_is_not_billed_twice(self):
+        qr = StubStage("fiscal_qr", error=RemoteStageError("fiscal_qr: timeout"))
+        ocr = StubStage("tesseract", recognition("tesseract"))
+        remote = StubStage("openai", recognition("openai"))
+        router = RoutingRecognizer([qr, ocr], remote, min_confidence=0.85)
+        with self.assertLogs("core.recognizers", "ERROR"), self.assertRaises(RemoteStageError):
+            router.recognize("receipt.png", {})
+        self.assertEqual((ocr.calls, remote.calls), (0, 0))
+
+    def test_failed_local_stage_goes_straight_to_model(self):
+        ocr = StubStage("tesseract", recognition("tesseract"))
+        with self.assertLogs("core.recognizers", "ERROR"):
+            result, _ = self.route(StubStage("fiscal_qr", error=ValueError("bad image")), ocr)
+        self.assertEqual(result.recognizer, "openai")
+        self.assertEqual((ocr.calls, self.remote.calls), (0, 2))
+
+    def test_qr_details_failure_raises_remote_stage_error(self):
+        fiscal = {"issued_at": datetime.datetime(2026, 1, 5, 12, 0), "amount": Decimal("100.00"),
+                  "currency": "RUB"}
+        stage = FiscalQRRecognizer(details=True)
+        with mock.patch.object(stage, "_read", return_value=fiscal), \
+                mock.patch("core.recognizers.process_receipt_details", side_effect=OpenAIError("down")):
+            with self.assertRaises(RemoteStageError):
+                stage.recognize("receipt.png", {})
+
+
+class ConversionTests(BudgetlensTestCase):
+    """Пакетный пересчёт сумм в валюту профиля"""
+
+    def setUp(self):
+        super().setUp()
+        self.expense = Expense.objects.create(
+            user=self.user, place="Cafe", category="Питание вне дома",
+            expense_date=datetime.date(2026, 1, 5), amount=Decimal("10.00"), currency="USD",
+            amount_in_target_currency=Decimal("900.00"), converted_currency="RUB",
+        )
+        # Смена валюты профиля без фонового задания: пересчёт запускается в тесте
+        UserProfile.objects.filter(user=self.user).update(target_currency="EUR")
+
+    def test_failed_conversion_resets_stale_amount(self):
+        with mock.patch("core.conversions.get_rates_table", return_value=None):
+            [stats] = convert_in_chunks(Expense.objects.filter(user=self.user))
+        self.assertEqual((stats["converted"], stats["failed"]), (0, 1))
+        self.expense.refresh_from_db()
+        self.assertIsNone(self.expense.amount_in_target_currency)
+        self.assertEqual(self.expense.converted_currency, "")
+        summary = MonthlySummary.objects.get(user=self.user, month="2026-01")
+        self.assertEqual(summary.total, 0)
+        # Расход остаётся в очереди на пересчёт
+        self.assertTrue(needs_conversion(Expense.objects.filter(user=self.user)).exists())
+
+    def test_updated_at_is_stamped_after_rates_are_fetched(self):
+        fetched_at = []
+
+        def slow_table(date):
+            fetched_at.append(timezone.now())
+            return {"USD": 1, "EUR": Decimal("0.5")}
+
+        with mock.patch("core.conversions.get_rates_table", side_effect=slow_table):
+            list(convert_in_chunks(Expense.objects.filter(user=self.user)))
+        self.expense.refresh_from_db()
+        self.assertEqual(self.expense.converted_currency, "EUR")
+        self.assertGreaterEqual(self.expense.updated_at, fetched_at[0])
+
+    def test_same_currency_needs_no_rates(self):
+        UserProfile.objects.filter(user=self.user).update(target_currency="USD")
+        with mock.patch("core.conversions.get_rates_table") as get_rates_table:
+            list(convert_in_chunks(Expense.objects.filter(user=self.user)))
+        get_rates_table.assert_not_called()
+        self.expense.refresh_from_db()
+        self.assertEqual(self.expense.amount_in_target_currency, Decimal("10.00"))
+
+
+class StatementImportTests(BudgetlensTestCase):
+    """Импорт CSV-выписки"""
+
+    def test_profile_currency_rows_need_no_rates(self):
+        lines = ["Дата;Сумма;Валюта;Описание"] + [
+            f"{day:02d}.01.2026;-{day}00,00;RUB;Магазин {day}" for day in range(1, 29)
+        ]
+        with mock.patch("core.rates.fetch_rates_table") as fetch_rates_table:
+            stats = import_statement(self.user, "\n".join(lines))
+        fetch_rates_table.assert_not_called()
+        self.assertEqual((stats["imported"], stats["converting"]), (28, 0))
+        self.assertFalse(Expense.objects.filter(user=self.user, amount_in_target_currency=None).exists())
+        self.assertFalse(ProcessingJob.objects.filter(kind=ProcessingJob.KIND_RECONVERT).exists())
+
+    def test_foreign_currency_rows_are_converted_in_background(self):
+        text = "Дата;Сумма;Валюта;Описание\n05.01.2026;-10,00;USD;Cafe\n06.01.2026;-500,00;RUB;Магазин"
+        with mock.patch("core.rates.fetch_rates_table") as fetch_rates_table:
+            stats = import_statement(self.user, text)
+        fetch_rates_table.assert_not_called()
+        self.assertEqual(stats["converting"], 1)
+        job = ProcessingJob.objects.get(kind=ProcessingJob.KIND_RECONVERT)
+        self.assertEqual(job.user_id, self.user.pk)
+        usd = Expense.objects.get(user=self.user, currency="USD")
+        self.assertIsNone(usd.amount_in_target_currency)
+
+
+    def test_thousands_separators(self):
+        cases = {
+            "-1 234,50": Decimal("-1234.50"), "-1,234.56": Decimal("-1234.56"),
+            "1.234,50": Decimal("1234.50"), "1,234,567": Decimal("1234567.00"),
+            "12,5": Decimal("12.50"), "abc": None, "NaN": None, "123456789,00": None,
+        }
+        for value, amount in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(parse_amount(value), amount)
+
+    def test_english_statement_keeps_large_amounts(self):
+        text = "Date,Amount,Currency,Description\n2026-01-05,\"-1,234.56\",RUB,Rent\n2026-01-06,-12.50,RUB,Cafe"
+        stats = import_statement(self.user, text)
+        self.assertEqual((stats["imported"], stats["invalid"]), (2, 0))
+        self.assertTrue(Expense.objects.filter(user=self.user, amount=Decimal("1234.56")).exists())
+
+
+class ReceiptFileDeletionTests(BudgetlensTestCase):
+    """Удаление файлов чеков вместе с расходами"""
+
+    def create_receipts(self, count, prefix):
+        storage = Expense._meta.get_field("receipt_image").storage
+        return [
+            Expense.objects.create(
+                user=self.user, receipt_image=storage.save(f"cheques/{prefix}{index}.png", make_image()),
+                status=Expense.STATUS_DONE,
+            )
+            for index in range(count)
+        ]
+
+    def bulk_delete(self, expenses):
+        with CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks(execute=True):
+            delete_expenses(self.user, [expense.id for expense in expenses])
+        return len(queries)
+
+    def test_bulk_delete_checks_shared_files_in_one_query(self):
+        few = self.bulk_delete(self.create_receipts(2, "few"))
+        many = self.bulk_delete(self.create_receipts(10, "many"))
+        self.assertEqual(few, many)
+
+    def test_shared_file_is_kept(self):
+        storage = Expense._meta.get_field("receipt_image").storage
+        deleted, kept = self.create_receipts(2, "shared")
+        kept.receipt_image = deleted.receipt_image.name
+        kept.save()
+        own = storage.path(kept.receipt_image.name)
+        self.bulk_delete([deleted])
+        self.assertTrue(os.path.exists(own))
+        self.bulk_delete([kept])
+        self.assertFalse(os.path.exists(own))
+
+
+class MetricsTests(SimpleTestCase):
+    """Метрики в формате Prometheus"""
+
+    def test_large_counters_keep_precision(self):
+        registry = Registry()
+        registry.inc("budgetlens_openai_tokens_total", 1234567, kind="prompt")
+        registry.inc("budgetlens_cache_total", 0.5)
+        text = registry.render()
+        self.assertIn('budgetlens_openai_tokens_total{kind="prompt"} 1234567\n', text)
+        self.assertIn("budgetlens_cache_total 0.5\n", text)
+
+    def test_workers_are_summed_through_metrics_dir(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        other = Registry()
+        other.inc("budgetlens_cache_total", 3, cache="dashboard", result="hit")
+        other.observe("budgetlens_request_seconds", 0.2, view="dashboard")
+        with open(os.path.join(directory, "1.json"), "w", encoding="utf-8") as file:
+            json.dump(other.snapshot(), file)
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+        metrics.registry.inc("budgetlens_cache_total", 2, cache="dashboard", result="hit")
+        metrics.registry.observe("budgetlens_request_seconds", 0.02, view="dashboard")
+        with override_settings(METRICS_DIR=directory):
+            text = metrics.render()
+        self.assertIn('budgetlens_cache_total{cache="dashboard",result="hit"} 5\n', text)
+        self.assertIn('budgetlens_request_seconds_bucket{view="dashboard",le="0.025"} 1\n', text)
+        self.assertIn('budgetlens_request_seconds_count{view="dashboard"} 2\n', text)
+        self.assertTrue(os.path.exists(os.path.join(directory, f"{os.getpid()}.json")))
+
+    def test_metrics_server_listens_locally_and_checks_access(self):
+        server = start_metrics_server(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        address, port = server.server_address
+        self.assertEqual(address, "127.0.0.1")
+        url = f"http://{address}:{port}/metrics"
+        with override_settings(METRICS_ALLOWED_IPS=[], METRICS_TOKEN="secret"):
+            self.assertEqual(httpx.get(url).status_code, 404)
+            response = httpx.get(url, headers={"Authorization": "Bearer secret"})
+            self.assertEqual(response.status_code, 200)
+
+
+class MetricsAccessTests(BudgetlensTestCase):
+    """Доступ к /metrics за прокси на том же хосте"""
+
+    def test_proxied_loopback_requests_need_token(self):
+        with override_settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="127.0.0.1").status_code, 404)
+            response = self.client.get(
+                "/metrics", REMOTE_ADDR="127.0.0.1", headers={"Authorization": "Bearer wrong"}
+            )
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get(
+                "/metrics", REMOTE_ADDR="127.0.0.1", headers={"Authorization": "Bearer secret"}
+            )
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=["10.0.0.5"])
+    def test_allowed_address(self):
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="10.0.0.5").status_code, 200)
+
+
+class AsgiRoutesTests(BudgetlensTestCase):
+    """Асинхронные вьюшки подключаются только в маршрутах ASGI-процесса"""
+
+    def test_wsgi_routes_use_sync_views(self):
+        self.assertIs(resolve("/core/upload/").func, views.upload_receipt)
+        self.assertIs(resolve("/core/save_expense/1/").func, views.save_expense)
+
+    @override_settings(ROOT_URLCONF="budgetlens.asgi_urls")
+    async def test_asgi_routes_use_async_views(self):
+        self.assertIs(resolve("/core/upload/").func, views.aupload_receipt)
+        expense = await Expense.objects.acreate(
+            user=self.user, place="Магазин", expense_date=datetime.date(2026, 1, 5),
+            amount=Decimal("100.00"), currency="RUB", status=Expense.STATUS_DONE,
+        )
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(
+            reverse("save_expense", args=[expense.id]),
+            {"place": "Аптека", "category": "Здравоохранение", "expense_date": "2026-01-05",
+             "amount": "250.00", "currency": "RUB"},
+        )
+        self.assertEqual(response.status_code, 302)
+        await expense.arefresh_from_db()
+        self.assertEqual((expense.place, expense.amount), ("Аптека", Decimal("250.00")))
+
+
+class ApiTests(BudgetlensTestCase):
+    """JSON API расходов"""
+
+    def setUp(self):
+        super().setUp()
+        self.expense = Expense.objects.create(
+            user=self.user, place="Магазин", category="Продукты",
+            expense_date=datetime.date(2026, 1, 5), amount=Decimal("100.00"), currency="RUB",
+            amount_in_target_currency=Decimal("100.00"), converted_currency="RUB",
+            status=Expense.STATUS_DONE,
+        )
+
+    def test_csrf_failure_is_json(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.delete(
+            reverse("api_expenses"), {"ids": [self.expense.id]}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIn("csrf", response.json()["errors"])
+        self.assertTrue(Expense.objects.filter(id=self.expense.id).exists())
+
+    def test_csrf_token_is_accepted(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        client.get(reverse("dashboard"))
+        response = client.delete(
+            reverse("api_expenses"), {"ids": [self.expense.id]}, content_type="application/json",
+            headers={"X-CSRFToken": client.cookies["csrftoken"].value},
+        )
+        self.assertEqual(response.json(), {"deleted": 1})
+
+    def test_boolean_ids_are_rejected(self):
+        response = self.client.delete(
+            reverse("api_expenses"), {"ids": [True]}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(
+            reverse("api_expenses"), {"expenses": [{"id": True, "amount": "1.00"}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"]["0"]["id"], ["Ожидается целый id"])
+
+
+class PaginationTests(BudgetlensTestCase):
+    """Курсорная пагинация расходов по (expense_date, id)"""
+
+    def setUp(self):
+        super().setUp()
+        dates = [None, None, datetime.date(2026, 1, 5), datetime.date(2026, 1, 5),
+                 datetime.date(2026, 1, 3), datetime.date(2026, 1, 9)]
+        self.expenses = [Expense.objects.create(user=self.user, expense_date=day) for day in dates]
+        # Без даты — первыми, затем новые сверху; при равной дате — по убыванию id
+        self.ordered = [self.expenses[i].id for i in (1, 0, 5, 3, 2, 4)]
+
+    def test_pages_cover_all_expenses_in_order(self):
+        ids, cursor = [], None
+        while True:
+            page, cursor = paginate_expenses(Expense.objects.filter(user=self.user), cursor, limit=2)
+            ids += [expense.id for expense in page]
+            if cursor is None:
+                break
+        self.assertEqual(ids, self.ordered)
+
+    def test_inserted_expense_does_not_shift_pages(self):
+        first, cursor = paginate_expenses(Expense.objects.filter(user=self.user), limit=3)
+        Expense.objects.create(user=self.user, expense_date=datetime.date(2026, 2, 1))
+        second, _ = paginate_expenses(Expense.objects.filter(user=self.user), cursor, limit=3)
+        self.assertEqual([expense.id for expense in first + second], self.ordered)
+
+    @override_settings(EXPENSES_PAGE_SIZE=4)
+    def test_expense_page_view(self):
+        first = self.client.get(reverse("dashboard"))
+        self.assertEqual([expense.id for expense in first.context["expenses"]], self.ordered[:4])
+        response = self.client.get(reverse("expense_page"), {"cursor": first.context["next_cursor"]})
+        self.assertEqual([item["id"] for item in response.json()["results"]], self.ordered[4:])
+        self.assertIsNone(response.json()["next"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("expense_page"), {"cursor": "не-курсор"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cursor", response.json()["errors"])
+
+
+class ConditionalRequestTests(BudgetlensTestCase):
+    """ETag и 304 на дашборде и в API до изменения данных пользователя"""
+
+    def setUp(self):
+        super().setUp()
+        self.expense = Expense.objects.create(
+            user=self.user, place="Магазин", category="Продукты",
+            expense_date=datetime.date(2026, 1, 5), amount=Decimal("100.00"), currency="RUB",
+            amount_in_target_currency=Decimal("100.00"), converted_currency="RUB",
+            status=Expense.STATUS_DONE,
+        )
+
+    def revalidate(self, url):
+        # Первый ответ выдаёт CSRF-cookie, от которой зависит ETag дашборда
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+        return etag, self.client.get(url, headers={"If-None-Match": etag})
+
+    def test_dashboard_not_modified(self):
+        _, response = self.revalidate(reverse("dashboard"))
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("private", response["Cache-Control"])
+
+    def test_change_invalidates_etag(self):
+        for url in (reverse("dashboard"), reverse("api_expenses")):
+            with self.subTest(url=url):
+                etag, _ = self.revalidate(url)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.expense.amount = Decimal("150.00")
+                    self.expense.save()
+                response = self.client.get(url, headers={"If-None-Match": etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], etag)
+
+    def test_api_not_modified(self):
+        for url in (reverse("api_expenses"), reverse("api_expense", args=[self.expense.id])):
+            with self.subTest(url=url):
+                _, response = self.revalidate(url)
+                self.assertEqual(response.status_code, 304)
+
+    def test_etag_is_per_user(self):
+        etag, _ = self.revalidate(reverse("api_expenses"))
+        other = User.objects.create_user("stranger")
+        self.client.force_login(other)
+        response = self.client.get(reverse("api_expenses"), headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+
+class SyncTests(BudgetlensTestCase):
+    """Инкрементальная синхронизация: курсор, удаления и устаревший курсор"""
+
+    def setUp(self):
+        super().setUp()
+        self.expenses = [
+            Expense.objects.create(user=self.user, place=f"Магазин {day}", amount=Decimal(day))
+            for day in range(1, 6)
+        ]
+        # Изменения старше запаса SYNC_OVERLAP_SECONDS: повторно они не приходят
+        Expense.objects.filter(user=self.user).update(
+            updated_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+
+    def sync(self, since=None, **params):
+        if since:
+            params["since"] = since
+        return self.client.get(reverse("api_sync"), params)
+
+    def full_sync(self):
+        ids, cursor = [], None
+        while True:
+            data = self.sync(cursor, limit=2).json()
+            ids += [item["id"] for item in data["changed"]]
+            cursor = data["next"]
+            if not data["has_more"]:
+                return ids, cursor
+
+    def test_full_sync_pages_through_history(self):
+        ids, _ = self.full_sync()
+        self.assertEqual(ids, [expense.id for expense in self.expenses])
+
+    def test_delta_returns_changes_and_deletions(self):
+        _, cursor = self.full_sync()
+        edited, deleted = self.expenses[1], self.expenses[3]
+        edited.place = "Аптека"
+        edited.save()
+        deleted_id = deleted.id
+        deleted.delete()
+        data = self.sync(cursor).json()
+        self.assertEqual([item["id"] for item in data["changed"]], [edited.id])
+        self.assertEqual(data["deleted"], [deleted_id])
+        self.assertFalse(data["has_more"])
+
+    def test_other_users_changes_are_not_synced(self):
+        _, cursor = self.full_sync()
+        stranger = User.objects.create_user("stranger")
+        Expense.objects.create(user=stranger, place="Чужой").delete()
+        data = self.sync(cursor).json()
+        self.assertEqual((data["changed"], data["deleted"]), ([], []))
+
+    def test_invalid_cursor(self):
+        response = self.sync("не-курсор")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("since", response.json()["errors"])
+
+    def test_expired_cursor(self):
+        old = timezone.now() - datetime.timedelta(days=91)
+        with override_settings(SYNC_TOMBSTONE_RETENTION_DAYS=90):
+            response = self.sync(encode_sync_cursor((old, 1), (old, 1)))
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(self.sync(encode_sync_cursor((old, 1), None)).status_code, 410)
+
+    def test_not_modified(self):
+        _, cursor = self.full_sync()
+        etag = self.sync(cursor)["ETag"]
+        response = self.client.get(
+            reverse("api_sync"), {"since": cursor}, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(ExpenseTombstone.objects.exists())
+
+
+class JobClaimTests(BudgetlensTestCase):
+    """Захват заданий очереди обработчиками"""
+
+    def setUp(self):
+        super().setUp()
+        self.jobs = [
+            ProcessingJob.objects.create(expense=Expense.objects.create(user=self.user))
+            for _ in range(3)
+        ]
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        first = claim_jobs("openai", 2)
+        second = claim_jobs("openai", 5)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(claim_jobs("openai", 5), [])
+        job = ProcessingJob.objects.get(pk=first[0])
+        self.assertEqual((job.status, job.attempts), (ProcessingJob.STATUS_RUNNING, 1))
+
+    def test_concurrent_claim_loses_race(self):
+        due_jobs = jobs._due_jobs
+        calls = []
+
+        def claimed_by_other_worker(now):
+            calls.append(now)
+            if len(calls) == 2:
+                # Между выбором кандидатов и захватом их забрал другой обработчик
+                ProcessingJob.objects.update(
+                    status=ProcessingJob.STATUS_RUNNING, locked_at=timezone.now()
+                )
+            return due_jobs(now)
+
+        with mock.patch.object(jobs, "_due_jobs", claimed_by_other_worker):
+            self.assertEqual(claim_jobs("openai", 3), [])
+        self.assertFalse(ProcessingJob.objects.filter(attempts__gt=0).exists())
+
+    @override_settings(JOB_LOCK_TIMEOUT=300)
+    def test_stale_lock_is_reclaimed(self):
+        ProcessingJob.objects.update(
+            status=ProcessingJob.STATUS_RUNNING,
+            locked_at=timezone.now() - datetime.timedelta(seconds=301),
+            attempts=1,
+        )
+        ProcessingJob.objects.filter(pk=self.jobs[0].pk).update(locked_at=timezone.now())
+        claimed = claim_jobs("openai", 5)
+        self.assertEqual(sorted(claimed), [job.pk for job in self.jobs[1:]])
+        self.assertEqual(ProcessingJob.objects.get(pk=self.jobs[1].pk).attempts, 2)
+
+    def test_other_provider_and_future_jobs_are_skipped(self):
+        ProcessingJob.objects.filter(pk=self.jobs[0].pk).update(provider="local")
+        ProcessingJob.objects.filter(pk=self.jobs[1].pk).update(
+            run_after=timezone.now() + datetime.timedelta(minutes=5)
+        )
+        self.assertEqual(claim_jobs("openai", 5), [self.jobs[2].pk])
+
+    @override_settings(JOB_LOCK_TIMEOUT=300)
+    def test_stale_job_without_attempts_is_failed(self):
+        # Обработчик падал на этом задании каждую попытку, не успевая записать ошибку
+        crashed = self.jobs[0]
+        ProcessingJob.objects.filter(pk=crashed.pk).update(
+            status=ProcessingJob.STATUS_RUNNING,
+            locked_at=timezone.now() - datetime.timedelta(seconds=301),
+            attempts=crashed.max_attempts,
+        )
+        self.assertNotIn(crashed.pk, claim_jobs("openai", 5))
+        crashed.refresh_from_db()
+        self.assertEqual(crashed.status, ProcessingJob.STATUS_FAILED)
+        self.assertEqual(crashed.expense.status, Expense.STATUS_FAILED)
+
+    def test_unparsable_response_is_not_retried(self):
+        for error in (ValueError("Ответ модели не является JSON-объектом"), TypeError("None")):
+            with self.subTest(error=error):
+                job = ProcessingJob.objects.create(
+                    expense=Expense.objects.create(user=self.user),
+                    status=ProcessingJob.STATUS_RUNNING, attempts=1,
+                )
+                try:
+                    raise RemoteStageError("fiscal_qr") from error
+                except RemoteStageError as e:
+                    jobs._fail(job, e)
+                job.refresh_from_db()
+                self.assertEqual(job.status, ProcessingJob.STATUS_FAILED)
+                self.assertEqual(job.expense.status, Expense.STATUS_FAILED)
+
+    def test_provider_error_is_retried(self):
+        job = self.jobs[0]
+        ProcessingJob.objects.filter(pk=job.pk).update(status=ProcessingJob.STATUS_RUNNING, attempts=1)
+        job.refresh_from_db()
+        jobs._fail(job, ProviderError("openai: 503"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ProcessingJob.STATUS_QUEUED)
+
+
+class ReceiptResponseTests(SimpleTestCase):
+    """Разбор ответа модели распознавания"""
+
+    def response(self, content):
+        message = mock.Mock(content=content)
+        return mock.Mock(choices=[mock.Mock(message=message)])
+
+    def test_null_fields(self):
+        content = '{"place": null, "category": null, "date": null, "amount": null, "currency": null}'
+        self.assertEqual(
+            _parse_response(self.response(content)),
+            ("Неизвестное место", "Прочее", None, None, None),
+        )
+
+    def test_fields(self):
+        content = '```json\n{"place": "Магазин", "date": "05/01/2026", "amount": 10, "currency": "rub"}\n```'
+        place, _, expense_date, amount, currency = _parse_response(self.response(content))
+        self.assertEqual((place, parse_receipt_date(expense_date), amount, currency),
+                         ("Магазин", datetime.date(2026, 1, 5), 10, "RUB"))
+
+    def test_non_object_is_value_error(self):
+        with self.assertRaises(ValueError):
+            _parse_response(self.response("[1, 2]"))
+
+
+class CategoryMigrationTests(TransactionTestCase):
+    """Миграция 0013: категории приводятся к BASE_CATEGORIES, сводка пересобирается"""
+
+    before = [("core", "0012_expense_user_date_id_idx")]
+    after = [("core", "0013_normalize_category_expense_indexes")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_categories_are_normalized(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model("auth", "User").objects.create(username="owner")
+        Expense = apps.get_model("core", "Expense")
+        categories = ["groceries", "  продукты ", "Dining  Out", "что-то новое", "", None]
+        expenses = [
+            Expense.objects.create(
+                user=user, category=category, expense_date=datetime.date(2026, 1, 5),
+                amount_in_target_currency=Decimal("10.00"),
+            )
+            for category in categories
+        ]
+        apps.get_model("core", "RecognizedReceipt").objects.create(
+            user=user, content_hash="a" * 64, category="Groceries"
+        )
+
+        apps = self.migrate(self.after)
+        Expense = apps.get_model("core", "Expense")
+        self.assertEqual(
+            [Expense.objects.get(pk=expense.pk).category for expense in expenses],
+            ["Продукты", "Продукты", "Питание вне дома", "Прочее", None, None],
+        )
+        self.assertEqual(
+            apps.get_model("core", "RecognizedReceipt").objects.get().category, "Продукты"
+        )
+        summary = {
+            row.category: (row.total, row.count)
+            for row in apps.get_model("core", "MonthlySummary").objects.filter(month="2026-01")
+        }
+        self.assertEqual(summary, {
+            "Продукты": (Decimal("20.00"), 2),
+            "Питание вне дома": (Decimal("10.00"), 1),
+            "Прочее": (Decimal("10.00"), 1),
+            "": (Decimal("20.00"), 2),
+        })
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, BudgetlensTestCase):
+    """Страницы и API укладываются в объявленные бюджеты SQL-запросов без N+1"""
+
+    def setUp(self):
+        super().setUp()
+        storage = Expense._meta.get_field("receipt_image").storage
+        # Больше QUERY_BUDGET_REPEAT_THRESHOLD расходов: запрос на каждый был бы замечен
+        self.expenses = [
+            Expense.objects.create(
+                user=self.user, place=f"Магазин {day}", category="Продукты",
+                expense_date=datetime.date(2026, 1, day), amount=Decimal("100.00"), currency="RUB",
+                amount_in_target_currency=Decimal("100.00"), converted_currency="RUB",
+                status=Expense.STATUS_DONE,
+                receipt_image=storage.save(f"cheques/budget{day}.png", make_image()),
+            )
+            for day in range(1, 9)
+        ]
+        self.expense = self.expenses[0]
+
+    def test_dashboard(self):
+        self.assertQueryBudget(self.client.get(reverse("dashboard")))
+
+    def test_expense_list_page(self):
+        first = self.client.get(reverse("expense_page"))
+        self.assertQueryBudget(first)
+
+    def test_export(self):
+        response = self.client.get(reverse("export"), {"format": "csv"})
+        self.assertQueryBudget(response)
+        self.assertEqual(b"".join(response.streaming_content).decode("utf-8-sig").count("Магазин"), 8)
+
+    def test_expense_page(self):
+        self.assertQueryBudget(self.client.get(reverse("expense", args=[self.expense.id])))
+
+    def test_expense_edit(self):
+        # Худший случай: меняются месяц, категория и место, а чек есть в кэше распознавания
+        Expense.objects.filter(id=self.expense.id).update(content_hash="a" * 64)
+        RecognizedReceipt.objects.create(user=self.user, content_hash="a" * 64)
+        response = self.client.post(
+            reverse("save_expense", args=[self.expense.id]),
+            {"place": "Аптека", "category": "Здравоохранение", "expense_date": "2026-02-01",
+             "amount": "250.00", "currency": "RUB"},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertQueryBudget(response)
+
+    def test_upload(self):
+        response = self.client.post(reverse("upload"), {"receipt_image": make_image("gray")})
+        self.assertEqual(response.status_code, 302)
+        self.assertQueryBudget(response)
+
+    def test_upload_cached_result(self):
+        image = make_image("gray")
+        cached = RecognizedReceipt.objects.create(
+            user=self.user, content_hash=hashlib.sha256(image.read()).hexdigest(),
+            receipt_image=self.expense.receipt_image.name, place="Магазин", category="Продукты",
+            expense_date=datetime.date(2026, 3, 1), amount=Decimal("50.00"), currency="RUB",
+        )
+        image.seek(0)
+        response = self.client.post(reverse("upload"), {"receipt_image": image})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Expense.objects.filter(user=self.user, expense_date=cached.expense_date).exists())
+        self.assertQueryBudget(response)
+
+    def test_batch_upload(self):
+        files = [make_image(color, name=f"{color}.png") for color in ("red", "green", "blue", "red")]
+        response = self.client.post(reverse("upload_batch"), {"receipt_files": files})
+        self.assertEqual(response.status_code, 302)
+        self.assertQueryBudget(response)
+
+    def test_reprocess(self):
+        Expense.objects.filter(id=self.expense.id).update(status=Expense.STATUS_FAILED)
+        ProcessingJob.objects.create(expense=self.expense, status=ProcessingJob.STATUS_FAILED)
+        response = self.client.post(reverse("reprocess_expense", args=[self.expense.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertQueryBudget(response)
+
+    def test_reprocess_without_failed_job(self):
+        Expense.objects.filter(id=self.expense.id).update(status=Expense.STATUS_FAILED)
+        response = self.client.post(reverse("reprocess_expense", args=[self.expense.id]))
+        self.assertQueryBudget(response)
+
+    def test_api_list(self):
+        self.assertQueryBudget(self.client.get(reverse("api_expenses"), {"limit": 3}))
+
+    def test_api_expense(self):
+        self.assertQueryBudget(self.client.get(reverse("api_expense", args=[self.expense.id])))
+
+    def test_api_aggregates(self):
+        self.assertQueryBudget(self.client.get(reverse("api_aggregates")))
+
+    def test_api_sync(self):
+        self.assertQueryBudget(self.client.get(reverse("api_sync")))
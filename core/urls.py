@@ -4,9 +4,20 @@ from . import views
 
 urlpatterns = [
     path('upload/', views.upload_receipt, name='upload'),
+    path('upload/batch/', views.upload_batch, name='upload_batch'),
+    path('import/', views.import_expenses, name='import'),
+    path('batch/<int:batch_id>/', views.batch, name='batch'),
+    path('batch/<int:batch_id>/status/', views.batch_status, name='batch_status'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('expenses/page/', views.expense_page, name='expense_page'),
+    path('expenses/export/', views.export, name='export'),
     path('login/', auth_views.LoginView.as_view(template_name='login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(next_page='/login/'), name='logout'),
     path('expense/<int:expense_id>/', views.expense, name='expense'),
     path('save_expense/<int:expense_id>/', views.save_expense, name='save_expense'),
+    path('expense/<int:expense_id>/status/', views.expense_status, name='expense_status'),
+    path('expense/<int:expense_id>/reprocess/', views.reprocess_expense, name='reprocess_expense'),
+    path('expense/<int:expense_id>/receipt/<slug:size>/', views.receipt_image, name='receipt_image'),
+    path('category/suggest/', views.suggest_category, name='suggest_category'),
+    path('profile/', views.profile, name='profile'),
 ]
@@ -1,25 +1,50 @@
 """Views для основного приложения"""
 
-import base64
-from decimal import Decimal
 import logging
-import json
-import os
-import requests
-from django.db.models import Sum, F, Value, FloatField
-from django.db.models.functions import Lower, Trim, Coalesce
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Sum
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import redirect, render
-from openai import OpenAI
-from .forms import ExpenseEditForm, ExpenseForm
-from .models import Expense, UserProfile
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+from .forms import (
+    ExpenseEditForm,
+    ExpenseFilterForm,
+    ExpenseForm,
+    ExportForm,
+    ProfileForm,
+    ReceiptBatchForm,
+    StatementImportForm,
+)
+from .caching import dashboard_etag, dashboard_last_modified, get_dashboard_context
+from .classifier import get_classifier, predict_category
+from .dedup import find_duplicate, fingerprint, remember_correction
+from .exports import EXPORT_FORMATS, export_expenses
+from .jobs import (
+    aconvert_expense,
+    convert_expense,
+    create_receipt_batch,
+    enqueue_receipt,
+    prepare_receipt,
+    requeue_failed,
+)
+from .media import ensure_preview, receipt_file, serve_media
+from .metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    authorized as metrics_authorized,
+    render as render_metrics,
+    span,
+)
+from .models import Expense, MonthlySummary, PlaceCategory, ProcessingJob, ReceiptBatch
+from .pagination import InvalidCursor, paginate_expenses
+from .querybudget import query_budget
+from .statements import StatementError, import_statement
 
 
-OPEN_EXCHANGE_RATES_API_KEY = os.getenv("OPEN_EXCHANGE_RATES_API_KEY")
-OPEN_EXCHANGE_RATES_API_URL = "https://openexchangerates.org/api/historical/"
-
 log = logging.getLogger(__name__)
-client = OpenAI()
 
 PARTNERS = {
     "Транспорт": {
@@ -29,185 +54,33 @@ PARTNERS = {
 }
 
 
-def encode_image(image_path):
-    """Кодирует изображение в строку base64"""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-
-def process_receipt(image_path):
-    """Обрабатывает изображение чека с помощью API OpenAI"""
-    log.debug("views : process_receipt()")
-    base64_image = encode_image(image_path)
-    category = "Пример категории"
-    expense_date = "26-04-2025"
-    amount = 1000.00
-    currency = "RUB"
-
-    base_categories = [
-        "Жилье",
-        "Коммунальные услуги",
-        "Транспорт",
-        "Продукты",
-        "Рестораны",
-        "Здравоохранение",
-        "Платежи по долгам",
-        "Страхование",
-        "Одежда",
-        "Развлечения",
-        "Образование",
-        "Уход за детьми",
-        "Уход за питомцами",
-        "Подписки",
-        "Прочее",
-    ]
-
-    response = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": (
-                            "Проанализируйте предоставленный чек и извлеките следующие данные: "
-                            "1. Категория: Определите категорию расхода из следующего списка: "
-                            f"{', '.join(base_categories)}. 2. Дата: Определите дату транзакции. "
-                            "3. Сумма: Извлеките сумму расхода как десятичное число. Обратите внимание: "
-                            "- Запятая может быть разделителем тысяч или десятичным разделителем. "
-                            "4. Валюта: Определите валюту, использованную в расходе, начиная с "
-                            "5. Место покупки (например, название магазина, аптеки, ресторана). "
-                            "(трехсимвольный код валюты по ISO 4217). Ответьте строго в формате JSON, "
-                            "заканчивая фигурными скобками, без дополнительного языка разметки "
-                            'или объяснений. Пример ответа: { "place": "<place>", "category": "<category>",'
-                            ' "date": "<date>", "amount": <amount>,'
-                            ' "currency": "<currency>"}'
-                        ),
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                    },
-                ],
-            }
-        ],
-        temperature=0.2,
-    )
-
-    try:
-        if (
-            not response
-            or not response.choices
-            or not response.choices[0].message.content
-        ):
-            raise ValueError("Пустой или неверный ответ от API OpenAI")
-
-        content = response.choices[0].message.content.strip()
-        log.debug("Ответ от OpenAI")
-        log.debug(content)
-
-        if content.startswith("```json") and content.endswith("```"):
-            log.debug("Контент: %s", content)
-            content = content[7:-3].strip()
-            log.debug("Контент после удаления разметки: %s", content)
-
-        response_data = json.loads(content)
-
-        if "/" in response_data.get("date"):
-            response_data["date"] = response_data["date"].replace("/", "-")
-
-        category = response_data.get("category", "Прочее")
-        if category not in base_categories:
-            category = "Прочее"
-
-        place = response_data.get("place", "Неизвестное место")
-        expense_date = response_data.get("date")
-        amount = response_data.get("amount")
-        currency = response_data.get("currency").upper()
-
-        return place, category, expense_date, amount, currency
-    except json.JSONDecodeError as e:
-        log.error("Ошибка декодирования JSON: %s", e)
-        raise
-    except ValueError as e:
-        log.error("Ошибка значения: %s", e)
-        raise
-    except Exception as e:
-        log.error("Неожиданная ошибка: %s", e)
-        raise
-    
-
-def get_exchange_rate(date, from_currency, to_currency):
-    """Получить курс обмена для указанной даты и валют"""
-
-    if from_currency == to_currency:
-        return 1, 1
-
-    log.debug("views : get_exchange_rate()")
-    url = f"{OPEN_EXCHANGE_RATES_API_URL}{date}.json"
-    log.debug("URL: %s", url)
-    params = {"app_id": OPEN_EXCHANGE_RATES_API_KEY}
-    response = requests.get(url, params=params, timeout=10)
-
-    if response.status_code == 200:
-        data = response.json()
-        return data["rates"].get(from_currency), data["rates"].get(to_currency)
-
-    log.error("Ошибка при получении курса обмена: %s", response.text)
-    return None, None
+def _store_receipt(user, form):
+    """Сохраняет загруженный чек и ставит его в очередь; для дубля — уже сохранённый расход"""
+    expense_dto = form.save(commit=False)
+    expense_dto.user = user
+    fingerprint(expense_dto, form.cleaned_data["receipt_image"])
+    duplicate = find_duplicate(user, expense_dto)
+    if duplicate:
+        log.info("Повторная загрузка чека, расход %s", duplicate.id)
+        return duplicate
+    recognized = prepare_receipt(expense_dto)
+    with span("db_save"):
+        expense_dto.save()
+    if not recognized:
+        # Распознавание и конвертация выполняются фоновым обработчиком
+        enqueue_receipt(expense_dto)
+    return expense_dto
 
 
 @login_required
+@query_budget(11)
 def upload_receipt(request):
     """Вьюшка для загрузки изображения чека и его обработки"""
     log.debug("views : upload_receipt()")
     if request.method == "POST":
         form = ExpenseForm(request.POST, request.FILES)
         if form.is_valid():
-            expense_dto = form.save(commit=False)
-            expense_dto.user = request.user
-            expense_dto.save()
-
-            place, category, expense_date, amount, currency = process_receipt(
-                expense_dto.receipt_image.path
-            )
-
-            expense_dto.place = place
-            expense_dto.category = category
-            expense_dto.expense_date = expense_date
-            expense_dto.amount = amount
-            expense_dto.currency = currency
-
-           
-            target_currency = "RUB"
-
-            exchange_rate_to_usd, exchange_rate_to_target = get_exchange_rate(
-                expense_date, currency, target_currency
-            )
-            log.debug(
-                "Курсы обмена: к RUB %s, к целевой валюте %s",
-                exchange_rate_to_usd,
-                exchange_rate_to_target,
-            )
-
-            if exchange_rate_to_usd and exchange_rate_to_target:
-                exchange_rate_to_usd = Decimal(str(exchange_rate_to_usd))
-                exchange_rate_to_target = Decimal(str(exchange_rate_to_target))
-                amount_decimal = Decimal(str(amount))
-
-                converted_amount_to_usd = amount_decimal / exchange_rate_to_usd
-                converted_amount_to_target = (
-                    converted_amount_to_usd * exchange_rate_to_target
-                )
-                expense_dto.amount_in_target_currency = round(
-                    converted_amount_to_target, 2
-                )
-                log.debug("Конвертированная сумма в RUB: %s", expense_dto.amount_in_target_currency)
-            else:
-                log.error("Не удалось конвертировать сумму в целевую валюту")
-
-            expense_dto.save()
+            expense_dto = _store_receipt(request.user, form)
             # Перенаправить на страницу расхода для корректировки данных
             return redirect("expense", expense_id=expense_dto.id)
         else:
@@ -218,19 +91,109 @@ def upload_receipt(request):
 
 
 @login_required
-def dashboard(request):
-    """Вьюшка для отображения расходов пользователя, отсортированных по дате и агрегированных по категориям"""
-    expenses = Expense.objects.filter(user=request.user).order_by("-expense_date")
-    expenses = expenses.annotate(category_normalized=Trim(Lower(F("category"))))
+@query_budget(11)
+async def aupload_receipt(request):
+    """Асинхронная версия upload_receipt для ASGI (budgetlens.asgi_urls)"""
+    log.debug("views : aupload_receipt()")
+    user = await request.auser()
+    if request.method == "POST":
+        form = ExpenseForm(request.POST, request.FILES)
+        if await sync_to_async(form.is_valid)():
+            expense_dto = await sync_to_async(_store_receipt)(user, form)
+            return redirect("expense", expense_id=expense_dto.id)
+        else:
+            log.error("Ошибки формы: %s", form.errors)
+    else:
+        form = ExpenseForm()
+    # Уже загруженный пользователь: иначе контекстный процессор auth запросит его повторно
+    return await sync_to_async(render)(request, "upload.html", {"form": form, "user": user})
+
+
+@login_required
+@query_budget(15)
+def upload_batch(request):
+    """Вьюшка для пакетной загрузки чеков; распознавание идёт в фоне параллельно"""
+    log.debug("views : upload_batch()")
+    if request.method == "POST":
+        form = ReceiptBatchForm(request.POST, request.FILES)
+        if form.is_valid():
+            batch = create_receipt_batch(request.user, form.cleaned_data["receipt_files"])
+            return redirect("batch", batch_id=batch.id)
+        log.error("Ошибки формы: %s", form.errors)
+    else:
+        form = ReceiptBatchForm()
+    return render(request, "upload_batch.html", {"form": form})
+
+
+@login_required
+def import_expenses(request):
+    """Вьюшка импорта расходов из CSV-выписки банка"""
+    log.debug("views : import_expenses()")
+    stats = None
+    if request.method == "POST":
+        form = StatementImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                stats = import_statement(
+                    request.user,
+                    form.cleaned_data["statement_file"],
+                    overrides=form.column_overrides(),
+                )
+            except StatementError as e:
+                form.add_error("statement_file", str(e))
+        if form.errors:
+            log.error("Ошибки формы: %s", form.errors)
+    else:
+        form = StatementImportForm()
+    return render(request, "import.html", {"form": form, "stats": stats})
+
+
+def _batch_progress(batch):
+    """Число чеков пакета в каждом статусе обработки"""
+    progress = {status: 0 for status, _ in Expense.STATUS_CHOICES}
+    for item in batch.expenses.values("status").annotate(count=Count("id")).order_by():
+        progress[item["status"]] = item["count"]
+    progress["total"] = sum(progress.values())
+    return progress
+
+
+@login_required
+@query_budget(5)
+def batch(request, batch_id):
+    """Вьюшка со статусом пакетной загрузки"""
+    receipt_batch = get_object_or_404(ReceiptBatch, id=batch_id, user=request.user)
+    return render(
+        request,
+        "batch.html",
+        {
+            "batch": receipt_batch,
+            "expenses": receipt_batch.expenses.order_by("id"),
+            "progress": _batch_progress(receipt_batch),
+        },
+    )
+
+
+@login_required
+@query_budget(4)
+def batch_status(request, batch_id):
+    """Вьюшка с прогрессом пакетной загрузки для опроса со страницы пакета"""
+    receipt_batch = get_object_or_404(ReceiptBatch, id=batch_id, user=request.user)
+    return JsonResponse(_batch_progress(receipt_batch))
+
 
-    log.debug("Нормализованная категория: %s", expenses.values("category_normalized"))
-    total_spent = expenses.aggregate(
-        total=Coalesce(Sum('amount_in_target_currency', output_field=FloatField()), Value(0, output_field=FloatField()))
-    )['total']
+def _dashboard_summary(user):
+    """Итоги по категориям и рекомендация для дашборда"""
+    # Итоги читаются из помесячной сводки, а не агрегируются по всей истории
+    category_data = (
+        MonthlySummary.objects.filter(user=user)
+        .values("category")
+        .annotate(total_amount=Sum("total"))
+        .order_by("category")
+    )
+    totals = {item["category"]: float(item["total_amount"] or 0) for item in category_data}
 
-    food_spent = expenses.filter(category_normalized="транспорт").aggregate(
-        total=Coalesce(Sum('amount_in_target_currency', output_field=FloatField()), Value(0, output_field=FloatField()))
-    )['total']
+    total_spent = sum(totals.values())
+    food_spent = totals.get("Транспорт", 0)
 
     recommendation_message = None
 
@@ -238,93 +201,269 @@ def dashboard(request):
     if total_spent > 0 and food_spent / total_spent > 0.5:
         recommendation_message = PARTNERS["Транспорт"]["message"]
 
-    category_data = (
-        expenses.values("category_normalized")
-        .annotate(
-            total_amount=Coalesce(
-                Sum("amount_in_target_currency", output_field=FloatField()),
-                Value(0, output_field=FloatField()),
-            )
-        )
-        .order_by("category_normalized")
-    )
-
-    categories = [
-        (
-            item["category_normalized"].capitalize()
-            if item["category_normalized"]
-            else "Без категории"
-        )
-        for item in category_data
-    ]
-    amounts = [float(item["total_amount"]) for item in category_data]
+    categories = [category or "Без категории" for category in totals]
+    amounts = list(totals.values())
 
     log.debug("Агрегированные данные по категориям: %s", categories)
 
+    return {
+        "categories": categories,  # <--- обычный список
+        "amounts": amounts,         # <--- обычный
+        "recommendation_message": recommendation_message,
+    }
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=dashboard_etag, last_modified_func=dashboard_last_modified)
+@query_budget(4)
+def dashboard(request):
+    """Вьюшка для отображения расходов пользователя, отсортированных по дате и агрегированных по категориям"""
+    filter_form = ExpenseFilterForm(request.GET)
+    filter_form.is_valid()
+    expenses, next_cursor = paginate_expenses(
+        filter_form.filter(Expense.objects.filter(user=request.user)),
+        limit=settings.EXPENSES_PAGE_SIZE,
+    )
+
+    # Итоги кэшируются до ближайшего изменения расходов или профиля пользователя
+    summary = get_dashboard_context(request.user.pk, lambda: _dashboard_summary(request.user))
+
     return render(
         request,
         "dashboard.html",
         {
             "expenses": expenses,
-            "categories": categories,  # <--- обычный список
-            "amounts": amounts,         # <--- обычный
-            "recommendation_message": recommendation_message,
+            "next_cursor": next_cursor,
+            "filter_form": filter_form,
+            "export_form": ExportForm(),
+            **summary,
         },
     )
 
 
 @login_required
+@query_budget(3)
+def expense_page(request):
+    """Вьюшка со следующей страницей расходов в JSON для бесконечной прокрутки"""
+    filter_form = ExpenseFilterForm(request.GET)
+    if not filter_form.is_valid():
+        return JsonResponse({"errors": filter_form.errors}, status=400)
+    try:
+        expenses, next_cursor = paginate_expenses(
+            filter_form.filter(Expense.objects.filter(user=request.user)),
+            cursor=filter_form.cleaned_data["cursor"],
+            limit=settings.EXPENSES_PAGE_SIZE,
+        )
+    except InvalidCursor:
+        return JsonResponse({"errors": {"cursor": ["Некорректный курсор"]}}, status=400)
+    return JsonResponse(
+        {
+            "results": [
+                {
+                    "id": item.id,
+                    "url": reverse("expense", args=[item.id]),
+                    "place": item.place,
+                    "category": item.category,
+                    "amount": str(item.amount) if item.amount is not None else None,
+                    "currency": item.currency,
+                    "expense_date": item.expense_date.isoformat() if item.expense_date else None,
+                }
+                for item in expenses
+            ],
+            "next": next_cursor,
+        }
+    )
+
+
+@login_required
+@query_budget(3)
+def export(request):
+    """Вьюшка потоковой выгрузки расходов: строки уходят клиенту по мере чтения из БД"""
+    form = ExportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+    export_format = form.cleaned_data["format"]
+    _, content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(
+        export_expenses(
+            form.filter(Expense.objects.filter(user=request.user)),
+            export_format,
+            settings.EXPORT_CHUNK_SIZE,
+        ),
+        content_type=content_type,
+    )
+    response["Content-Disposition"] = f'attachment; filename="expenses.{extension}"'
+    return response
+
+
+@login_required
+@query_budget(3)
 def expense(request, expense_id):
     """Вьюшка для отображения деталей конкретного расхода"""
     log.debug("views : expense()")
     log.debug("ID расхода: %s", expense_id)
     expense_detail = Expense.objects.get(id=expense_id, user=request.user)
     log.debug("Детали расхода: %s", expense_detail.expense_date)
-    log.debug("Валюта пользователя: %s", request.user.userprofile.target_currency)
+    suggested_category = None
+    if not expense_detail.category and expense_detail.place:
+        # Подсказка категории из локального классификатора, без запроса к модели
+        suggested_category = predict_category(request.user.pk, expense_detail.place)
     return render(
-        request, "expense.html", {"expense": expense_detail, "user": request.user}
+        request,
+        "expense.html",
+        {
+            "expense": expense_detail,
+            "user": request.user,
+            "suggested_category": suggested_category,
+        },
+    )
+
+
+@login_required
+@query_budget(3)
+def receipt_image(request, expense_id, size):
+    """Вьюшка с изображением чека: WebP-превью нужного размера или оригинал"""
+    expense_detail = get_object_or_404(Expense, id=expense_id, user=request.user)
+    image = receipt_file(expense_detail)
+    if not image:
+        raise Http404("У расхода нет изображения чека")
+    if size not in settings.RECEIPT_PREVIEW_SIZES and size != "original":
+        raise Http404(size)
+    # Превью старых чеков создаются при первом просмотре; они всегда в основном
+    # хранилище, даже когда оригинал перенесён в архив
+    preview = ensure_preview(image, size) if size != "original" else None
+    if preview:
+        return serve_media(image.field.storage, preview)
+    return serve_media(image.storage, image.name)
+
+
+@login_required
+@query_budget(3)
+def suggest_category(request):
+    """Вьюшка с категорией для места из локального классификатора (JSON)"""
+    category, confidence = get_classifier().predict(
+        request.user.pk, PlaceCategory.key_of(request.GET.get("place"))
     )
+    if confidence < settings.CATEGORY_MIN_CONFIDENCE:
+        category = None
+    return JsonResponse({"category": category, "confidence": round(confidence, 2)})
+
+
+def _expense_edit_form(user, expense_id, data=None):
+    """Форма редактирования расхода и результат её проверки"""
+    expense_edit = Expense.objects.get(id=expense_id, user=user)
+    form = ExpenseEditForm(data, instance=expense_edit)
+    return form, data is not None and form.is_valid()
 
 
 @login_required
+@query_budget(15)
 def save_expense(request, expense_id):
     """Вьюшка для сохранения отредактированных данных о расходе с конвертацией валюты"""
     log.debug("views : save_expense()")
-    expense_edit = Expense.objects.get(id=expense_id, user=request.user)
 
     if request.method == "POST":
-        form = ExpenseEditForm(request.POST, instance=expense_edit)
-        if form.is_valid():
+        form, valid = _expense_edit_form(request.user, expense_id, request.POST)
+        if valid:
             expense_form = form.save(commit=False)
+            convert_expense(expense_form)
+            log.debug("Конвертированная сумма: %s", expense_form.amount_in_target_currency)
 
-           
-            target_currency = "RUB"
+            expense_form.save()
+            if form.has_changed():
+                remember_correction(expense_form)
+            return redirect("expense", expense_id=expense_form.id)
+        else:
+            log.error("Ошибки формы: %s", form.errors)
+    else:
+        form, _ = _expense_edit_form(request.user, expense_id)
 
-            exchange_rate_to_usd, exchange_rate_to_target = get_exchange_rate(
-                expense_form.expense_date, expense_form.currency, target_currency
-            )
+    return render(request, "expense.html", {"expense": form.instance, "form": form})
 
-            if exchange_rate_to_usd and exchange_rate_to_target:
-                exchange_rate_to_usd = Decimal(str(exchange_rate_to_usd))
-                exchange_rate_to_target = Decimal(str(exchange_rate_to_target))
-                amount_decimal = Decimal(str(expense_form.amount))
 
-                converted_amount_to_usd = amount_decimal / exchange_rate_to_usd
-                converted_amount_to_target = (
-                    converted_amount_to_usd * exchange_rate_to_target
-                )
-                expense_form.amount_in_target_currency = round(
-                    converted_amount_to_target, 2
-                )
-                log.debug("Конвертированная сумма: %s", expense_form.amount_in_target_currency)
-            else:
-                log.error("Не удалось конвертировать сумму в целевую валюту")
+@login_required
+@query_budget(15)
+async def asave_expense(request, expense_id):
+    """Асинхронная версия save_expense для ASGI (budgetlens.asgi_urls): курс запрашивается без потока"""
+    log.debug("views : asave_expense()")
+    user = await request.auser()
 
-            expense_form.save()
+    if request.method == "POST":
+        form, valid = await sync_to_async(_expense_edit_form)(user, expense_id, request.POST)
+        if valid:
+            expense_form = form.save(commit=False)
+            await aconvert_expense(expense_form)
+            log.debug("Конвертированная сумма: %s", expense_form.amount_in_target_currency)
+
+            await expense_form.asave()
+            if form.has_changed():
+                await sync_to_async(remember_correction)(expense_form)
             return redirect("expense", expense_id=expense_form.id)
         else:
             log.error("Ошибки формы: %s", form.errors)
     else:
-        form = ExpenseEditForm(instance=expense_edit)
+        form, _ = await sync_to_async(_expense_edit_form)(user, expense_id)
+
+    return await sync_to_async(render)(
+        request, "expense.html", {"expense": form.instance, "form": form, "user": user}
+    )
 
-    return render(request, "save_expense.html", {"form": form})
+
+@login_required
+@query_budget(4)
+def expense_status(request, expense_id):
+    """Вьюшка со статусом фоновой обработки чека для опроса со страницы расхода"""
+    expense_detail = get_object_or_404(Expense, id=expense_id, user=request.user)
+    job = expense_detail.jobs.order_by("-id").first()
+    return JsonResponse(
+        {
+            "status": expense_detail.status,
+            "attempts": job.attempts if job else 0,
+            "error": job.last_error if job else "",
+        }
+    )
+
+
+@login_required
+@require_POST
+@query_budget(7)
+def reprocess_expense(request, expense_id):
+    """Вьюшка для повторной постановки в очередь чека, обработка которого упала"""
+    expense_detail = get_object_or_404(Expense, id=expense_id, user=request.user)
+    # Чек в очереди или уже распознанный не трогаем: повторное распознавание
+    # затёрло бы правки пользователя; расходу из выписки распознавать нечего
+    if expense_detail.status != Expense.STATUS_FAILED or not expense_detail.receipt_image:
+        return redirect("expense", expense_id=expense_detail.id)
+    if not requeue_failed(expense_detail.jobs.all()):
+        enqueue_receipt(expense_detail)
+    return redirect("expense", expense_id=expense_detail.id)
+
+
+@login_required
+@query_budget(4)
+def profile(request):
+    """Вьюшка настроек профиля; смена валюты запускает фоновый пересчёт расходов"""
+    user_profile = request.user.userprofile
+    if request.method == "POST":
+        form = ProfileForm(request.POST, instance=user_profile)
+        if form.is_valid():
+            form.save()
+            return redirect("profile")
+        log.error("Ошибки формы: %s", form.errors)
+    else:
+        form = ProfileForm(instance=user_profile)
+    reconverting = ProcessingJob.objects.filter(
+        kind=ProcessingJob.KIND_RECONVERT,
+        user=request.user,
+        status__in=[ProcessingJob.STATUS_QUEUED, ProcessingJob.STATUS_RUNNING],
+    ).exists()
+    return render(request, "profile.html", {"form": form, "reconverting": reconverting})
+
+
+@query_budget(0)
+def metrics(request):
+    """Вьюшка с метриками процесса в формате Prometheus"""
+    if not metrics_authorized(request.META.get("REMOTE_ADDR"), request.headers.get("Authorization")):
+        raise Http404("metrics")
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)